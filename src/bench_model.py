@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import tracemalloc
+from message_parser import MessageParser
+from model import Model
+from text_buffer import ListTextBuffer, RopeTextBuffer
+
+OWNER = "bench"
+BUFFERS = {"list": ListTextBuffer, "rope": RopeTextBuffer}
+# relative frequency of every op in synthetic workload
+OP_WEIGHTS = {
+    "write": 50,
+    "delete": 12,
+    "new_line": 8,
+    "paste": 5,
+    "cut": 5,
+    "undo": 10,
+    "redo": 10,
+}
+_SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+
+def parse_size(size):
+    size = size.strip().upper().rstrip("B")
+    unit = size[-1:] if size[-1:] in _SIZE_UNITS else ""
+    return int(float(size[: len(size) - len(unit)]) * _SIZE_UNITS[unit])
+
+
+# text of about size bytes, built from few random lines
+def make_document(size, seed=0):
+    rnd = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyz     "
+    lines = [
+        "".join(rnd.choice(alphabet) for _ in range(rnd.randrange(20, 100)))
+        for _ in range(64)
+    ]
+    text = []
+    length = 0
+    i = 0
+    while length < size:
+        line = lines[i % len(lines)]
+        text.append(line)
+        length += len(line) + 1
+        i += 1
+    return "\n".join(text)[:size]
+
+
+# list of (username, op, arg), same seed gives same workload
+def make_workload(users, ops, seed=0):
+    rnd = random.Random(seed)
+    names = list(OP_WEIGHTS)
+    weights = list(OP_WEIGHTS.values())
+    workload = []
+    for _ in range(ops):
+        username = rnd.choice(users)
+        op = rnd.choices(names, weights)[0]
+        if op == "write":
+            arg = rnd.choice("abcdefghijklmnopqrstuvwxyz ")
+        elif op == "paste":
+            arg = rnd.choice(["word", "two words", "multi\nline\npaste"])
+        elif op == "cut":
+            arg = rnd.randrange(1, 8)
+        else:
+            arg = None
+        workload.append((username, op, arg))
+    return workload
+
+
+def _user_names(users):
+    return [f"user{i}" for i in range(users)]
+
+
+async def _make_model(text, users, buffer_cls):
+    model = Model(text, OWNER, buffer_cls=buffer_cls)
+    lines = len(model.text_lines)
+    for i, username in enumerate(users):
+        await model.add_user(username)
+        # users are spread over the document
+        model.user_positions[username] = (0, i * lines // len(users))
+    return model
+
+
+async def _apply_op(model, username, op, arg):
+    if op == "write":
+        await model.user_wrote_char(username, arg)
+    elif op == "delete":
+        await model.user_deleted_char(username)
+    elif op == "new_line":
+        await model.user_added_new_line(username)
+    elif op == "paste":
+        await model.paste(username, arg)
+    elif op == "cut":
+        for _ in range(arg):
+            await model.user_shifted_right(username)
+        await model.cut(username)
+    elif op == "undo":
+        await model.undo(username)
+    elif op == "redo":
+        await model.redo(username)
+
+
+def _op_messages(username, op, arg):
+    if op == "write":
+        return [f"{username} -E {'/s' if arg == ' ' else arg}"]
+    if op == "delete":
+        return [f"{username} -D"]
+    if op == "new_line":
+        return [f"{username} -NL"]
+    if op == "paste":
+        return [f"{username} -PASTE {arg}"]
+    if op == "cut":
+        return [f"{username} -MS r"] * arg + [f"{username} -CUT"]
+    if op == "undo":
+        return [f"{username} -UNDO"]
+    return [f"{username} -REDO"]
+
+
+# messages are parsed the same way host applies them,
+# so replay also measures MessageParser
+def make_session(workload):
+    return [_op_messages(username, op, arg) for username, op, arg in workload]
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(q * len(sorted_values)))]
+
+
+async def _run(text, users, workload, buffer_cls, replay):
+    model = await _make_model(text, users, buffer_cls)
+    parser = MessageParser(model, True, OWNER)
+    latencies = {}
+    started = time.perf_counter()
+    for (username, op, arg), messages in zip(
+        workload, make_session(workload) if replay else workload
+    ):
+        op_started = time.perf_counter_ns()
+        if replay:
+            for message in messages:
+                await parser.parse_message(message.split(" "))
+        else:
+            await _apply_op(model, username, op, arg)
+        latencies.setdefault(op, []).append(
+            time.perf_counter_ns() - op_started)
+    return time.perf_counter() - started, latencies
+
+
+def run_benchmark(
+    doc_size,
+    users=4,
+    ops=10000,
+    seed=0,
+    buffer="rope",
+    replay=False,
+    memory=True,
+):
+    text = make_document(doc_size, seed)
+    names = _user_names(users)
+    workload = make_workload(names, ops, seed)
+    elapsed, latencies = asyncio.run(
+        _run(text, names, workload, BUFFERS[buffer], replay))
+    all_latencies = sorted(x for op in latencies.values() for x in op)
+    result = {
+        "doc_size": doc_size,
+        "users": users,
+        "ops": ops,
+        "buffer": buffer,
+        "mode": "replay" if replay else "model",
+        "ops_per_sec": ops / elapsed if elapsed else 0,
+        "p50_us": _percentile(all_latencies, 0.5) / 1000,
+        "p99_us": _percentile(all_latencies, 0.99) / 1000,
+        "by_op": {
+            op: {
+                "count": len(values),
+                "p50_us": _percentile(sorted(values), 0.5) / 1000,
+                "p99_us": _percentile(sorted(values), 0.99) / 1000,
+            }
+            for op, values in latencies.items()
+        },
+        "peak_mem_mb": None,
+    }
+    # tracing slows allocations down, so memory is measured
+    # by separate run of the same workload
+    if memory:
+        tracemalloc.start()
+        try:
+            asyncio.run(_run(text, names, workload, BUFFERS[buffer], replay))
+            result["peak_mem_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def format_result(result):
+    peak = result["peak_mem_mb"]
+    return (
+        f"{result['doc_size']:>11} {result['users']:>5} {result['ops']:>8} "
+        f"{result['buffer']:>6} {result['mode']:>7} "
+        f"{result['ops_per_sec']:>11.0f} {result['p50_us']:>9.1f} "
+        f"{result['p99_us']:>9.1f} "
+        + (f"{peak:>9.1f}" if peak is not None else f"{'-':>9}")
+    )
+
+
+HEADER = (
+    f"{'doc_bytes':>11} {'users':>5} {'ops':>8} {'buffer':>6} {'mode':>7} "
+    f"{'ops/sec':>11} {'p50_us':>9} {'p99_us':>9} {'peak_mb':>9}"
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark of Model edit operations")
+    parser.add_argument("--sizes", nargs="+", default=["1K", "1M", "10M"],
+                        help="document sizes, like 1K 10M 100M")
+    parser.add_argument("--users", type=int, nargs="+", default=[4])
+    parser.add_argument("--ops", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--buffer", choices=BUFFERS, default="rope")
+    parser.add_argument("--replay", action="store_true",
+                        help="apply workload as messages through parser")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip peak memory measuring run")
+    parser.add_argument("--json", action="store_true",
+                        help="print one json object per result")
+    args = parser.parse_args(argv)
+    if not args.json:
+        print(HEADER)
+    for size in args.sizes:
+        for users in args.users:
+            result = run_benchmark(
+                parse_size(size),
+                users,
+                args.ops,
+                args.seed,
+                args.buffer,
+                args.replay,
+                not args.no_memory,
+            )
+            print(json.dumps(result) if args.json else format_result(result))
+
+
+if __name__ == "__main__":
+    main()
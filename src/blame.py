@@ -0,0 +1,230 @@
+import random
+
+# first line of blame file saved as runs,
+# older files have one username per line
+RUNS_HEADER = "#blame-runs 1"
+
+
+class _Run:
+    # runs are nodes of treap ordered by line,
+    # lines and runs count the whole subtree
+    __slots__ = ("length", "owner", "prio", "left", "right", "lines", "runs")
+
+    def __init__(self, length, owner):
+        self.length = length
+        self.owner = owner
+        self.prio = random.random()
+        self.left = None
+        self.right = None
+        self.lines = length
+        self.runs = 1
+
+
+def _lines(node):
+    return node.lines if node is not None else 0
+
+
+def _runs(node):
+    return node.runs if node is not None else 0
+
+
+def _update(node):
+    node.lines = node.length + _lines(node.left) + _lines(node.right)
+    node.runs = 1 + _runs(node.left) + _runs(node.right)
+    return node
+
+
+def _merge(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.prio > b.prio:
+        a.right = _merge(a.right, b)
+        return _update(a)
+    b.left = _merge(a, b.left)
+    return _update(b)
+
+
+# splits into first y lines and the rest,
+# run containing line y is split in two
+def _split(node, y):
+    if node is None:
+        return None, None
+    left = _lines(node.left)
+    if y <= left:
+        a, b = _split(node.left, y)
+        node.left = b
+        return a, _update(node)
+    end = left + node.length
+    if y >= end:
+        a, b = _split(node.right, y - end)
+        node.right = a
+        return _update(node), b
+    rest = _Run(end - y, node.owner)
+    node.length = y - left
+    right, node.right = node.right, None
+    return _update(node), _merge(rest, right)
+
+
+def _first(node):
+    while node.left is not None:
+        node = node.left
+    return node
+
+
+def _last(node):
+    while node.right is not None:
+        node = node.right
+    return node
+
+
+# builds treap of (length, owner) runs in O(n)
+def _build(runs):
+    stack = []
+    for length, owner in runs:
+        node = _Run(length, owner)
+        last = None
+        while stack and stack[-1].prio < node.prio:
+            last = _update(stack.pop())
+        node.left = last
+        if stack:
+            stack[-1].right = node
+        stack.append(node)
+    for node in reversed(stack):
+        _update(node)
+    return stack[0] if stack else None
+
+
+def _iter(node):
+    stack = []
+    while stack or node is not None:
+        if node is not None:
+            stack.append(node)
+            node = node.left
+            continue
+        node = stack.pop()
+        yield node.length, node.owner
+        node = node.right
+
+
+class BlameRuns:
+    # last editor of every line, kept as runs of lines with the same
+    # editor, so memory follows the number of edited runs, not lines,
+    # usernames are interned, runs store only their ids,
+    # every edit is O(log runs)
+
+    def __init__(self):
+        self._users = []
+        self._user_ids = {}
+        self._root = None
+
+    @classmethod
+    def _from_runs(cls, runs):
+        blame = cls()
+        compacted = []
+        for length, username in runs:
+            owner = blame._user_id(username)
+            if compacted and compacted[-1][1] == owner:
+                compacted[-1][0] += length
+            else:
+                compacted.append([length, owner])
+        blame._root = _build(compacted)
+        return blame
+
+    @classmethod
+    def from_lines(cls, usernames):
+        return cls._from_runs((1, username) for username in usernames)
+
+    @classmethod
+    def parse(cls, lines):
+        lines = [line.rstrip("\n") for line in lines]
+        if not lines or lines[0] != RUNS_HEADER:
+            return cls.from_lines(line for line in lines if line)
+        runs = []
+        for line in lines[1:]:
+            if line:
+                length, username = line.split("\t", 1)
+                runs.append((int(length), username))
+        return cls._from_runs(runs)
+
+    def dumps(self):
+        return "\n".join([RUNS_HEADER] + [
+            f"{length}\t{self._users[owner]}"
+            for length, owner in _iter(self._root)
+        ]) + "\n"
+
+    @property
+    def users(self):
+        return list(self._users)
+
+    @property
+    def run_count(self):
+        return _runs(self._root)
+
+    def _user_id(self, username):
+        if username not in self._user_ids:
+            self._user_ids[username] = len(self._users)
+            self._users.append(username)
+        return self._user_ids[username]
+
+    def __len__(self):
+        return _lines(self._root)
+
+    def __getitem__(self, y):
+        if y < 0:
+            y += len(self)
+        if y < 0 or y >= len(self):
+            raise IndexError("blame line out of range")
+        node = self._root
+        while True:
+            left = _lines(node.left)
+            if y < left:
+                node = node.left
+            elif y < left + node.length:
+                return self._users[node.owner]
+            else:
+                y -= left + node.length
+                node = node.right
+
+    def __iter__(self):
+        for length, owner in _iter(self._root):
+            for _ in range(length):
+                yield self._users[owner]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"BlameRuns({list(self)!r})"
+
+    # count lines from y are replaced by run of length lines,
+    # neighbour runs of the same user are joined with it
+    def _replace(self, y, count, length, username):
+        count = max(0, min(count, len(self) - y))
+        owner = self._user_id(username)
+        a, rest = _split(self._root, y)
+        _, b = _split(rest, count)
+        if a is not None and _last(a).owner == owner:
+            last_length = _last(a).length
+            a, _ = _split(a, a.lines - last_length)
+            length += last_length
+        if b is not None and _first(b).owner == owner:
+            first_length = _first(b).length
+            _, b = _split(b, first_length)
+            length += first_length
+        self._root = _merge(_merge(a, _Run(length, owner)), b)
+
+    # text from top to bot was inserted, positions are (x, y)
+    def inserted(self, top, bot, username):
+        top, bot = sorted((top, bot), key=lambda pos: pos[::-1])
+        if top[1] >= len(self):
+            self._replace(len(self), 0, top[1] - len(self) + 1, username)
+        self._replace(top[1], 1, bot[1] - top[1] + 1, username)
+
+    # text from top to bot was cut, its lines are joined
+    def cut(self, top, bot, username):
+        top, bot = sorted((top, bot), key=lambda pos: pos[::-1])
+        if top[1] >= len(self):
+            return
+        self._replace(top[1], bot[1] - top[1] + 1, 1, username)
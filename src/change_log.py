@@ -0,0 +1,108 @@
+import io
+import mmap
+import os
+import struct
+import history_pack
+
+# history frames are appended as length prefixed records,
+# so a save writes only frames made since the previous save
+MAGIC = b"MTCL\x01"
+INSERT = 1
+CUT = 2
+# frame of already saved op, that was undone later
+TOMBSTONE = 3
+_KIND_BY_TYPE = {"insert": INSERT, "cut": CUT}
+_LENGTH = struct.Struct("<I")
+# kind, op, top x, top y, bot x, bot y, username length
+_HEADER = struct.Struct("<BIiiiiH")
+
+
+def encode_frame(op, frame):
+    kind = _KIND_BY_TYPE[frame[0]]
+    top, bot = frame[1], frame[2]
+    if kind == CUT:
+        text, username = frame[3], frame[4]
+    else:
+        text, username = "", frame[3]
+    username = str(username).encode()
+    payload = (
+        _HEADER.pack(kind, op, *top, *bot, len(username))
+        + username
+        + text.encode()
+    )
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def encode_tombstone(op):
+    payload = _HEADER.pack(TOMBSTONE, op, 0, 0, 0, 0, 0)
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def append_records(path, records, truncate=False):
+    with open(path, "wb" if truncate else "ab") as f:
+        if truncate or f.tell() == 0:
+            f.write(MAGIC)
+        f.write(b"".join(records))
+
+
+def is_change_log(path):
+    with history_pack.open_file(path) as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _decode(data, start, end):
+    kind, op, top_x, top_y, bot_x, bot_y, username_len = \
+        _HEADER.unpack_from(data, start)
+    if kind == TOMBSTONE:
+        return kind, op, None
+    text_start = start + _HEADER.size + username_len
+    username = data[start + _HEADER.size:text_start].decode()
+    top, bot = (top_x, top_y), (bot_x, bot_y)
+    if kind == CUT:
+        text = data[text_start:end].decode()
+        return kind, op, ["cut", top, bot, text, username]
+    return kind, op, ["insert", top, bot, username]
+
+
+def _iter_data(path, data):
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a change log")
+    pos = len(MAGIC)
+    while pos + _LENGTH.size <= len(data):
+        (length,) = _LENGTH.unpack_from(data, pos)
+        start = pos + _LENGTH.size
+        end = start + length
+        if length < _HEADER.size or end > len(data):
+            return
+        yield _decode(data, start, end)
+        pos = end
+
+
+# yields (kind, op, frame), stops at torn record of crashed write
+def iter_records(path):
+    with history_pack.open_file(path) as f:
+        # log of packed session is read from pack
+        if not isinstance(f, io.BufferedReader):
+            data = f.read()
+            if len(data) > len(MAGIC):
+                yield from _iter_data(path, data)
+            return
+        if os.fstat(f.fileno()).st_size <= len(MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield from _iter_data(path, data)
+
+
+# (op, frame) in op order without undone ones
+def read_ops(path):
+    frames = {}
+    for kind, op, frame in iter_records(path):
+        if kind == TOMBSTONE:
+            frames.pop(op, None)
+        else:
+            frames[op] = frame
+    return [(op, frames[op]) for op in sorted(frames)]
+
+
+def read_frames(path):
+    return [frame for _, frame in read_ops(path)]
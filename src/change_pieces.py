@@ -0,0 +1,187 @@
+# session frames are replayed over pieces of the document, every piece
+# is original text, text inserted in the session or cut original text,
+# so history is normalised in one pass instead of comparing every pair
+# of frames, extents are (lines, length of last line) and positions
+# are (y, x), so they compare in document order
+import random
+
+ORIG = 0
+INSERTED = 1
+CUT = 2
+# original text is not known, positions never reach its end
+_TAIL = (1 << 62, 0)
+_ZERO = (0, 0)
+
+
+def _add(a, b):
+    return (a[0] + b[0], b[1]) if b[0] else (a[0], a[1] + b[1])
+
+
+# extent, that follows prefix p in extent e
+def _sub(e, p):
+    return (e[0] - p[0], e[1]) if e[0] > p[0] else (0, e[1] - p[1])
+
+
+def _extent(text):
+    return (text.count("\n"), len(text) - text.rfind("\n") - 1)
+
+
+def _take(text, e):
+    i = 0
+    for _ in range(e[0]):
+        i = text.find("\n", i) + 1
+        if i == 0:
+            return text, ""
+    i += e[1]
+    return text[:i], text[i:]
+
+
+def _live(piece):
+    return _ZERO if piece[0] == CUT else piece[1]
+
+
+class _Node:
+    # pieces are kept in treap ordered by position,
+    # total is live extent of the subtree
+    __slots__ = ("piece", "prio", "left", "right", "total")
+
+    def __init__(self, piece):
+        self.piece = piece
+        self.prio = random.random()
+        self.left = None
+        self.right = None
+        self.total = _live(piece)
+
+
+def _total(node):
+    return _ZERO if node is None else node.total
+
+
+def _update(node):
+    node.total = _add(_add(_total(node.left), _live(node.piece)),
+                      _total(node.right))
+    return node
+
+
+def _merge(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.prio > b.prio:
+        a.right = _merge(a.right, b)
+        return _update(a)
+    b.left = _merge(a, b.left)
+    return _update(b)
+
+
+# splits into text before live position with empty pieces standing
+# at it and the rest, piece containing position is split in two
+def _split(node, pos):
+    if node is None:
+        return None, None
+    left = _total(node.left)
+    if pos < left:
+        a, b = _split(node.left, pos)
+        node.left = b
+        return a, _update(node)
+    piece = node.piece
+    end = _add(left, _live(piece))
+    if end <= pos:
+        a, b = _split(node.right, _sub(pos, end))
+        node.right = a
+        return _update(node), b
+    head = _sub(pos, left)
+    if head == _ZERO:
+        a, node.left = node.left, None
+        return a, _update(node)
+    rest = list(piece)
+    rest[1] = _sub(piece[1], head)
+    rest[4] = _add(piece[4], head)
+    piece[1] = head
+    right, node.right = node.right, None
+    return _update(node), _merge(_Node(rest), right)
+
+
+def _iter(node):
+    stack = []
+    while stack or node is not None:
+        if node is not None:
+            stack.append(node)
+            node = node.left
+            continue
+        node = stack.pop()
+        yield node.piece
+        node = node.right
+
+
+class ChangePieces:
+    # piece is [kind, extent, username, cut text, original start]
+    def __init__(self):
+        self._root = _Node([ORIG, _TAIL, None, "", _ZERO])
+
+    @classmethod
+    def from_frames(cls, frames):
+        pieces = cls()
+        for frame in frames:
+            top, bot = frame[1][::-1], frame[2][::-1]
+            if frame[0] == "insert":
+                pieces.insert(top, _sub(bot, top), frame[3])
+            elif frame[0] == "cut":
+                pieces.cut(top, bot, frame[3], frame[4])
+        return pieces
+
+    def insert(self, pos, extent, username):
+        a, b = _split(self._root, pos)
+        self._root = _merge(
+            _merge(a, _Node([INSERTED, extent, username, "", _ZERO])), b)
+
+    def cut(self, top, bot, text, username):
+        a, rest = _split(self._root, top)
+        middle, b = _split(rest, _sub(bot, top))
+        result = None
+        last = None
+        for piece in _iter(middle):
+            if piece[0] == ORIG:
+                cut_text, text = _take(text, piece[1])
+                piece = [CUT, _extent(cut_text), username, cut_text,
+                         piece[4]]
+            elif piece[0] == INSERTED:
+                # text inserted and cut in the same session is not history
+                _, text = _take(text, piece[1])
+                continue
+            # cut pieces of one user next to each other are one piece,
+            # so repeated backspaces do not pile them up
+            if last is not None and last[2] == piece[2]:
+                last[1] = _add(last[1], piece[1])
+                last[3] += piece[3]
+                continue
+            last = piece
+            result = _merge(result, _Node(piece))
+        self._root = _merge(_merge(a, result), b)
+
+    def __iter__(self):
+        return _iter(self._root)
+
+    # frames in positions of final text with cut text put back,
+    # neighbour pieces of one user are joined
+    def frames(self):
+        frames = []
+        pos = _ZERO
+        for kind, extent, username, text, _ in self:
+            if kind == ORIG:
+                pos = _add(pos, extent)
+                continue
+            end = _add(pos, extent)
+            last = frames[-1] if frames else None
+            if (last and last[0] == ("cut" if kind == CUT else "insert")
+                    and last[-1] == username and last[2] == pos[::-1]):
+                last[2] = end[::-1]
+                if kind == CUT:
+                    last[3] += text
+            elif kind == CUT:
+                frames.append(["cut", pos[::-1], end[::-1], text, username])
+            else:
+                frames.append(["insert", pos[::-1], end[::-1], username])
+            pos = end
+        return frames
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import zlib
+from history_catalog import HISTORY_DIR_PATH
+
+# snapshots of documents are split into chunks by their content,
+# every chunk is stored once, compressed and named by its hash,
+# so sessions of the same document share unchanged chunks
+CHUNKS_DIR_PATH = HISTORY_DIR_PATH + "chunks/"
+# first line of snapshot manifest, older snapshots are plain copies
+MAGIC = b"#mttext-chunks 1\n"
+_MIN_CHUNK = 16 * 1024
+_MAX_CHUNK = 256 * 1024
+# chunk ends after line with these low bits of hash unset
+_BOUNDARY_MASK = 0x3F
+
+
+# boundaries depend only on nearby lines, so an edit changes
+# chunks around it and the rest of the document is chunked the same
+def split_chunks(data):
+    chunks = []
+    chunk = []
+    size = 0
+    for line in data.splitlines(keepends=True):
+        while len(line) > _MAX_CHUNK:
+            chunks.append(b"".join(chunk) + line[:_MAX_CHUNK - size])
+            line = line[_MAX_CHUNK - size:]
+            chunk = []
+            size = 0
+        chunk.append(line)
+        size += len(line)
+        if size >= _MAX_CHUNK or (
+                size >= _MIN_CHUNK
+                and zlib.crc32(line) & _BOUNDARY_MASK == 0):
+            chunks.append(b"".join(chunk))
+            chunk = []
+            size = 0
+    if chunk:
+        chunks.append(b"".join(chunk))
+    return chunks
+
+
+class ChunkStore:
+    def __init__(self, path=None):
+        self._path = path or CHUNKS_DIR_PATH
+
+    def _chunk_path(self, digest):
+        return os.path.join(self._path, digest[:2], digest)
+
+    def put(self, data):
+        digests = []
+        for chunk in split_chunks(data):
+            digest = hashlib.sha256(chunk).hexdigest()
+            path = self._chunk_path(digest)
+            try:
+                # reused chunk is fresh for garbage collection
+                os.utime(path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(zlib.compress(chunk))
+                os.replace(path + ".tmp", path)
+            digests.append(digest)
+        return digests
+
+    def get(self, digests):
+        data = []
+        for digest in digests:
+            with open(self._chunk_path(digest), "rb") as f:
+                data.append(zlib.decompress(f.read()))
+        return b"".join(data)
+
+    def write_snapshot(self, snapshot_path, data):
+        manifest = MAGIC + "".join(
+            digest + "\n" for digest in self.put(data)).encode()
+        with open(snapshot_path + ".tmp", "wb") as f:
+            f.write(manifest)
+        os.replace(snapshot_path + ".tmp", snapshot_path)
+
+    def copy_snapshot(self, file_path, snapshot_path):
+        with open(file_path, "rb") as f:
+            self.write_snapshot(snapshot_path, f.read())
+
+    def read_snapshot(self, snapshot_path):
+        with open(snapshot_path, "rb") as f:
+            data = f.read()
+        if data.startswith(MAGIC):
+            data = self.get(data[len(MAGIC):].decode().split())
+        return data.decode()
+
+    # digests used by snapshot, plain copies use none
+    @staticmethod
+    def snapshot_chunks(snapshot_path):
+        with open(snapshot_path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return []
+            return f.read().decode().split()
+
+    # (digest, path) of every stored chunk
+    def chunk_files(self):
+        for root, _, files in os.walk(self._path):
+            for file in files:
+                if not file.endswith(".tmp"):
+                    yield file, os.path.join(root, file)
@@ -0,0 +1,199 @@
+import asyncio
+from collections import deque
+from codec import BATCH_SEPARATOR
+
+
+class ClientWriter:
+    # what to do with client, which outbound queue is full
+    # glue new frames to the last pending chunk, cursor moves are dropped
+    # and replaced by fresh user positions, when queue is drained
+    COALESCE = "coalesce"
+    RESYNC = "resync"  # drop pending frames and send fresh snapshot
+    DISCONNECT = "disconnect"  # close connection
+    POLICIES = (COALESCE, RESYNC, DISCONNECT)
+    _CURSOR_OPS = ("-M", "-MS")
+
+    def __init__(
+        self,
+        writer,
+        username,
+        codec,
+        max_queue=256,
+        policy=RESYNC,
+        max_bytes=8 << 20,
+    ):
+        if policy not in self.POLICIES:
+            raise ValueError(f"unknown slow client policy: {policy}")
+        self.username = username
+        self.closed = False
+        self.needs_resync = False
+        self.max_depth = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.resyncs = 0
+        # codec can be switched after protocol negotiation,
+        # frames are encoded when offered
+        self.codec = codec
+        self._writer = writer
+        self._max_queue = max_queue
+        self._max_bytes = max_bytes
+        self._policy = policy
+        # each pending chunk is one or several frames written at once
+        self._pending = deque()
+        self._pending_bytes = 0
+        # users, whose cursor moves were dropped by coalescing
+        self._stale_positions = set()
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._finishing = False
+        self._task = None
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    @property
+    def positions_stale(self):
+        return bool(self._stale_positions)
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "resyncs": self.resyncs,
+        }
+
+    def start(self):
+        self._task = asyncio.create_task(self._write_loop())
+
+    # never blocks, returns False if client should be forgotten
+    def offer(self, message):
+        if self.closed:
+            return False
+        if self.needs_resync:
+            self.dropped += 1
+            return True
+        frame = self.codec.encode(message)
+        if self._pending_bytes + len(frame) > self._max_bytes:
+            return self._overflow()
+        full = len(self._pending) >= self._max_queue
+        if self._policy == self.COALESCE and (full or self._stale_positions):
+            if not self._coalesce(message, frame, full):
+                return self._overflow()
+        elif full:
+            return self._overflow()
+        else:
+            self._pending.append(bytearray(frame))
+            self._pending_bytes += len(frame)
+        self.max_depth = max(self.max_depth, len(self._pending))
+        self._wakeup.set()
+        return True
+
+    # message is kept whole or dropped, returns False if it can't be
+    # merged without losing state of the client
+    def _coalesce(self, message, frame, full):
+        args = message.split(" ", 2)
+        sender = args[0]
+        if self._is_cursor_move(args):
+            self._stale_positions.add(sender)
+            self.coalesced += 1
+            return True
+        # edit is applied at sender position, which client doesn't know
+        if sender in self._stale_positions:
+            return False
+        if len(args) > 1 and args[1] == "-U":
+            self._stale_positions.clear()
+        if full:
+            self._pending[-1] += frame
+            self.coalesced += 1
+        else:
+            self._pending.append(bytearray(frame))
+        self._pending_bytes += len(frame)
+        return True
+
+    def _is_cursor_move(self, args):
+        if len(args) < 2:
+            return False
+        if args[1] == "-B" and len(args) > 2:
+            return all(
+                op.split(" ", 1)[0] in self._CURSOR_OPS
+                for op in args[2].split(f" {BATCH_SEPARATOR} ")
+            )
+        return args[1] in self._CURSOR_OPS
+
+    # full queue falls back to resync, or to disconnect
+    def _overflow(self):
+        if self._policy == self.DISCONNECT:
+            self.dropped += 1
+            self.close()
+            return False
+        self.dropped += len(self._pending) + 1
+        self._clear_pending()
+        self.needs_resync = True
+        return True
+
+    def _clear_pending(self):
+        self._pending.clear()
+        self._pending_bytes = 0
+        self._stale_positions.clear()
+
+    # bulk sender waits here, so it doesn't overflow the queue
+    async def wait_for_room(self):
+        while not self.closed and len(self._pending) >= self._max_queue // 2:
+            self._drained.clear()
+            await self._drained.wait()
+
+    # snapshot is queued whole, even if it is over the byte cap
+    def resync(self, snapshot_messages):
+        self.needs_resync = False
+        self.resyncs += 1
+        self._clear_pending()
+        for message in snapshot_messages:
+            frame = self.codec.encode(message)
+            self._pending.append(bytearray(frame))
+            self._pending_bytes += len(frame)
+        self.max_depth = max(self.max_depth, len(self._pending))
+        self._wakeup.set()
+
+    # message carries current positions of all users
+    def refresh_positions(self, users_message):
+        self._stale_positions.clear()
+        return self.offer(users_message)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._clear_pending()
+        self._wakeup.set()
+        self._drained.set()
+        self._writer.close()
+
+    # writes everything already queued, then closes connection
+    async def finish(self):
+        self._finishing = True
+        self._wakeup.set()
+        if self._task:
+            await self._task
+        self.close()
+
+    async def _write_loop(self):
+        while not self.closed:
+            if not self._pending:
+                if self._finishing:
+                    break
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            data = b"".join(self._pending)
+            self._pending.clear()
+            self._pending_bytes = 0
+            try:
+                self._writer.write(data)
+                await self._writer.drain()
+                self._drained.set()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                break
+        self.close()
@@ -0,0 +1,196 @@
+TEXT_DELIMITER = b' \n\x1E'
+# last token of every parsed message, parser skips it
+FRAME_TAIL = "\n\x1E"
+
+# ops without free text payload, that can be packed into -B message:
+# [sender_username] -B [op] [op_args]* (\x1F [op] [op_args]*)*
+BATCHABLE_OPS = ("-E", "-D", "-NL", "-M", "-MS", "-CUT", "-UNDO", "-REDO")
+BATCH_SEPARATOR = "\x1F"
+# client, that offers it in -C message, gets document as -TS -TC* -TE
+SNAPSHOT_CHUNKS = "chunks"
+# -C argument naming the document on multi-document host
+DOCUMENT_PREFIX = "doc="
+
+
+def make_batch(messages):
+    sender = messages[0].split(" ", 1)[0]
+    ops = [message.split(" ", 1)[1] for message in messages]
+    return f"{sender} -B " + f" {BATCH_SEPARATOR} ".join(ops)
+
+
+def unescape_char(arg):
+    return " " if arg == "/s" else arg
+
+
+def escape_char(char):
+    return "/s" if char == " " else char
+
+
+# text payload of -T/-PASTE like messages, spaces are kept as is
+def payload_text(args):
+    return " ".join(args[2:-1] if args[-1] == FRAME_TAIL else args[2:])
+
+
+def encode_varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _pack_str(text):
+    data = text.encode()
+    return encode_varint(len(data)) + data
+
+
+def _unpack_str(data, offset):
+    length, offset = decode_varint(data, offset)
+    return data[offset: offset + length].decode(), offset + length
+
+
+class TextCodec:
+    # [sender_username] [op] [args]* separated by spaces,
+    # terminated by TEXT_DELIMITER
+    NAME = "text"
+
+    def encode(self, message):
+        return message.encode() + TEXT_DELIMITER
+
+    async def read_args(self, reader):
+        data = await reader.readuntil(TEXT_DELIMITER)
+        return data.decode().split(" ")
+
+
+class BinaryCodec:
+    # varint body length, then body:
+    # opcode byte, sender, op fields (strings are varint length + utf-8)
+    NAME = "binary"
+    MAX_FRAME_SIZE = 1 << 28
+    _RAW = 0
+    _OPCODES = {
+        "-E": 1, "-M": 2, "-MS": 3, "-T": 4, "-U": 5, "-C": 6, "-D": 7,
+        "-NL": 8, "-CUT": 9, "-PASTE": 10, "-UNDO": 11, "-REDO": 12,
+        "-WNACK": 13, "-DC": 14, "-DCH": 15, "-B": 16, "-PROTO": 17,
+        "-TS": 18, "-TC": 19, "-TE": 20,
+    }
+    _OPS = {code: op for op, code in _OPCODES.items()}
+    # c - typed char, s - word, r - rest of message as text,
+    # u - (username, x, y) triples, b - batched ops
+    _FIELDS = {
+        "-E": "c", "-M": "s", "-MS": "s", "-T": "r", "-PASTE": "r",
+        "-C": "r", "-PROTO": "r", "-U": "u", "-B": "b",
+        "-TS": "s", "-TC": "r", "-TE": "s",
+    }
+
+    def encode(self, message):
+        args = message.split(" ")
+        try:
+            body = (bytes([self._OPCODES[args[1]]])
+                    + _pack_str(args[0])
+                    + self._pack_fields(args[1], args[2:]))
+        except (KeyError, IndexError, ValueError):
+            body = bytes([self._RAW]) + _pack_str(message)
+        return encode_varint(len(body)) + body
+
+    def _pack_fields(self, op, args):
+        kind = self._FIELDS.get(op)
+        if kind is None:
+            return b""
+        if kind == "c":
+            return _pack_str(unescape_char(args[0]))
+        if kind == "s":
+            return _pack_str(args[0])
+        if kind == "r":
+            return _pack_str(" ".join(args))
+        if kind == "u":
+            if len(args) % 3:
+                raise ValueError("broken users list")
+            out = bytearray(encode_varint(len(args) // 3))
+            for i in range(0, len(args), 3):
+                out += _pack_str(args[i])
+                out += encode_varint(int(args[i + 1]))
+                out += encode_varint(int(args[i + 2]))
+            return bytes(out)
+        ops = [[]]
+        for arg in args:
+            if arg == BATCH_SEPARATOR:
+                ops.append([])
+            else:
+                ops[-1].append(arg)
+        out = bytearray(encode_varint(len(ops)))
+        for op_args in ops:
+            if op_args[0] not in BATCHABLE_OPS:
+                raise ValueError("op can't be batched")
+            out.append(self._OPCODES[op_args[0]])
+            out += self._pack_fields(op_args[0], op_args[1:])
+        return bytes(out)
+
+    def decode(self, body):
+        if body[0] == self._RAW:
+            message, _ = _unpack_str(body, 1)
+            return message.split(" ") + [FRAME_TAIL]
+        op = self._OPS[body[0]]
+        sender, offset = _unpack_str(body, 1)
+        fields, _ = self._unpack_fields(op, body, offset)
+        return [sender, op, *fields, FRAME_TAIL]
+
+    def _unpack_fields(self, op, body, offset):
+        kind = self._FIELDS.get(op)
+        if kind is None:
+            return [], offset
+        if kind in "csr":
+            text, offset = _unpack_str(body, offset)
+            if kind == "c":
+                return [escape_char(text)], offset
+            return text.split(" ") if kind == "r" else [text], offset
+        count, offset = decode_varint(body, offset)
+        fields = []
+        for i in range(count):
+            if kind == "u":
+                username, offset = _unpack_str(body, offset)
+                x, offset = decode_varint(body, offset)
+                y, offset = decode_varint(body, offset)
+                fields += [username, str(x), str(y)]
+                continue
+            if i:
+                fields.append(BATCH_SEPARATOR)
+            sub_op = self._OPS[body[offset]]
+            sub_fields, offset = self._unpack_fields(
+                sub_op, body, offset + 1)
+            fields += [sub_op, *sub_fields]
+        return fields, offset
+
+    async def read_args(self, reader):
+        length = 0
+        shift = 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        if length == 0 or length > self.MAX_FRAME_SIZE:
+            raise ConnectionAbortedError("broken frame length")
+        return self.decode(await reader.readexactly(length))
+
+
+CODECS = {TextCodec.NAME: TextCodec, BinaryCodec.NAME: BinaryCodec}
+
+
+def message_from_args(args):
+    return " ".join(args[:-1] if args[-1] == FRAME_TAIL else args)
+
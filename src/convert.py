@@ -1,103 +1,159 @@
+import html
+
+# exporters write the document in chunks of about this many chars,
+# so memory does not grow with the document
+_CHUNK_SIZE = 1 << 16
+_PAGE_WIDTH = 612
+_PAGE_HEIGHT = 792
+_FONT_SIZE = 10
+_LEADING = 12
+_MARGIN = 30
+_LINES_PER_PAGE = (_PAGE_HEIGHT - 2 * _MARGIN) // _LEADING
+# catalog, pages and font go first, page and its content follow
+_CATALOG, _PAGES, _FONT = 1, 2, 3
+
+
+# parts are lines, progress gets number of written ones
+def _write_chunks(f, parts, progress=None):
+    chunk = []
+    size = 0
+    done = 0
+    for part in parts:
+        chunk.append(part)
+        size += len(part)
+        if size >= _CHUNK_SIZE:
+            f.write("".join(chunk))
+            done += len(chunk)
+            if progress:
+                progress(done)
+            chunk = []
+            size = 0
+    if chunk:
+        f.write("".join(chunk))
+        if progress:
+            progress(done + len(chunk))
+
+
+def _pdf_escape(line):
+    return (line.replace("\\", "\\\\").replace("(", "\\(")
+            .replace(")", "\\)").replace("\r", "").replace("\t", "    "))
+
+
+def _rtf_escape(line):
+    line = line.replace("\\", "\\\\").replace("{", "\\{").replace("}", "\\}")
+    if line.isascii():
+        return line
+    chars = []
+    for char in line:
+        if char.isascii():
+            chars.append(char)
+            continue
+        units = char.encode("utf-16-le")
+        for i in range(0, len(units), 2):
+            unit = int.from_bytes(units[i:i + 2], "little")
+            # rtf takes signed 16-bit code units
+            chars.append(f"\\u{unit - 65536 if unit > 32767 else unit}?")
+    return "".join(chars)
+
+
+class _PdfWriter:
+    # objects are written as soon as they are ready,
+    # only their offsets are kept for xref
+    def __init__(self, f):
+        self._f = f
+        self._offset = 0
+        self.offsets = {}
+
+    def write(self, data):
+        self._f.write(data)
+        self._offset += len(data)
+
+    def obj(self, number, body):
+        self.offsets[number] = self._offset
+        self.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    def stream(self, number, content):
+        self.obj(number, f"<< /Length {len(content)} >>\nstream\n".encode()
+                 + content + b"\nendstream")
+
+    def finish(self):
+        xref = self._offset
+        size = max(self.offsets) + 1
+        self.write(f"xref\n0 {size}\n0000000000 65535 f \n".encode())
+        self.write("".join(
+            f"{self.offsets[number]:010d} 00000 n \n"
+            for number in range(1, size)).encode())
+        self.write(f"trailer\n<< /Size {size} /Root {_CATALOG} 0 R >>\n"
+                   f"startxref\n{xref}\n%%EOF\n".encode())
+
+
 class TextExporter:
     def __init__(self, lines):
         self.lines = lines
 
-    def to_pdf(self, file_path):
-        content_lines = []
-
-        y_position = 700
+    def _pages(self):
+        page = []
         for line in self.lines:
-            content_lines.extend(
-                [
-                    "BT",
-                    "/F1 12 Tf",
-                    f"20 {y_position} Td",
-                    f"({line}) Tj",
-                    "ET",
-                ]
-            )
-            y_position -= 20
-
-        content = "\n".join(content_lines)
-        content_bytes = content.encode("utf-8")
-
-        body = [
-            "%PDF-1.4",
-            "1 0 obj",
-            "<< /Type /Catalog /Pages 2 0 R >>",
-            "endobj",
-            "2 0 obj",
-            "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
-            "endobj",
-            "3 0 obj",
-            "<< /Type /Page /Parent 2 0 R "
-            "/Contents 4 0 R /Resources "
-            "<< /Font << /F1 << /Type /Font "
-            "/Subtype /Type1 /BaseFont "
-            "/Helvetica >> >> >> >>",
-            "endobj",
-            "4 0 obj",
-            f"<< /Length {len(content_bytes)} >>",
-            "stream",
-            content,
-            "endstream",
-            "endobj",
-        ]
-
-        body_bytes = "\n".join(body).encode("utf-8")
-        xref_position = len(body_bytes)
-
-        xref_and_trailer = [
-            "xref",
-            "0 5",
-            "0000000000 65535 f",
-            "0000000010 00000 n",
-            "0000000050 00000 n",
-            "0000000100 00000 n",
-            "0000000200 00000 n",
-            "trailer",
-            "<< /Size 5 /Root 1 0 R >>",
-            "startxref",
-            str(xref_position),
-            "%%EOF",
-        ]
-
-        full_pdf = body + xref_and_trailer
+            page.append(line)
+            if len(page) == _LINES_PER_PAGE:
+                yield page
+                page = []
+        if page or not self.lines:
+            yield page
 
+    def _page_content(self, page):
+        content = [f"BT\n/F1 {_FONT_SIZE} Tf\n{_LEADING} TL\n"
+                   f"{_MARGIN} {_PAGE_HEIGHT - _MARGIN - _FONT_SIZE} Td"]
+        for line in page:
+            content.append(f"({_pdf_escape(line)}) Tj T*")
+        content.append("ET")
+        # helvetica knows only latin chars
+        return "\n".join(content).encode("cp1252", errors="replace")
+
+    def to_pdf(self, file_path, progress=None):
         with open(file_path + ".pdf", "wb") as f:
-            f.write("\n".join(full_pdf).encode("utf-8"))
-
-    def to_html(self, file_path):
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>Generated HTML</title>
-        </head>
-        <body>
-            {''.join(f'<p>{line}</p>' for line in self.lines)}
-        </body>
-        </html>
-        """
+            pdf = _PdfWriter(f)
+            pdf.write(b"%PDF-1.4\n")
+            pdf.obj(_CATALOG, f"<< /Type /Catalog /Pages {_PAGES} 0 R >>"
+                    .encode())
+            pdf.obj(_FONT, b"<< /Type /Font /Subtype /Type1 "
+                    b"/BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+            number = _FONT + 1
+            done = 0
+            for page in self._pages():
+                pdf.obj(number, (
+                    f"<< /Type /Page /Parent {_PAGES} 0 R "
+                    f"/MediaBox [0 0 {_PAGE_WIDTH} {_PAGE_HEIGHT}] "
+                    f"/Contents {number + 1} 0 R "
+                    f"/Resources << /Font << /F1 {_FONT} 0 R >> >> >>"
+                ).encode())
+                pdf.stream(number + 1, self._page_content(page))
+                number += 2
+                done += len(page)
+                if progress:
+                    progress(done)
+            # page count is known only after the last page
+            kids = " ".join(
+                f"{kid} 0 R" for kid in range(_FONT + 1, number, 2))
+            pdf.obj(_PAGES, (
+                f"<< /Type /Pages /Kids [{kids}] "
+                f"/Count {(number - _FONT - 1) // 2} >>").encode())
+            pdf.finish()
 
+    def to_html(self, file_path, progress=None):
         with open(file_path + ".html", "w", encoding="utf-8") as f:
-            f.write(html_content)
-
-    def to_doc(self, file_path):
-        header = r"{\rtf1\ansi\deff0"
-        body = ""
-
-        for line in self.lines:
-            safe_line = (
-                line.replace("\\", r"\\")
-                .replace("{", r"\{")
-                .replace("}", r"\}")
-            )
-            body += f"{safe_line}\\par\n"
-
-        rtf_footer = "}"
-        content = header + "\n" + body + rtf_footer
+            f.write(
+                "<!DOCTYPE html>\n<html>\n<head>\n"
+                "<meta charset=\"UTF-8\">\n"
+                "<title>Generated HTML</title>\n"
+                "</head>\n<body>\n")
+            _write_chunks(f, (f"<p>{html.escape(line)}</p>\n"
+                              for line in self.lines), progress)
+            f.write("</body>\n</html>\n")
 
+    def to_doc(self, file_path, progress=None):
         with open(file_path + ".doc", "w", encoding="utf-8") as f:
-            f.write(content)
+            f.write("{\\rtf1\\ansi\\deff0\n")
+            _write_chunks(f, (f"{_rtf_escape(line)}\\par\n"
+                              for line in self.lines), progress)
+            f.write("}")
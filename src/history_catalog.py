@@ -0,0 +1,144 @@
+import hashlib
+import os
+import sqlite3
+from collections import namedtuple
+from contextlib import closing
+
+HISTORY_DIR_PATH = "/tmp/lib/mttext/history/"
+CATALOG_PATH = HISTORY_DIR_PATH + "catalog.sqlite"
+
+
+class HistorySession(namedtuple(
+    "HistorySession",
+    "index started authors op_count changes_size dir_name",
+)):
+    @property
+    def original_file(self):
+        return self.started + ".o.cache"
+
+    @property
+    def blame_file(self):
+        return self.started + ".blame.cache"
+
+
+class HistoryCatalog:
+    # every finished session of every document, so listing and lookup
+    # of a session is an index search instead of directory scan,
+    # documents are known by hash of their full path
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS documents ("
+        " doc_key TEXT PRIMARY KEY, path TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS sessions ("
+        " doc_key TEXT NOT NULL, idx INTEGER NOT NULL,"
+        " started TEXT NOT NULL, authors TEXT NOT NULL,"
+        " op_count INTEGER NOT NULL, changes_size INTEGER NOT NULL,"
+        " dir_name TEXT NOT NULL, PRIMARY KEY (doc_key, idx))",
+    )
+    _COLUMNS = "idx, started, authors, op_count, changes_size, dir_name"
+
+    def __init__(self, path=None, history_dir=None):
+        self._path = path or CATALOG_PATH
+        self._history_dir = history_dir or HISTORY_DIR_PATH
+
+    @staticmethod
+    def document_key(file_path):
+        return hashlib.sha1(
+            os.path.realpath(file_path).encode()).hexdigest()
+
+    # history of files with the same name in different dirs is apart
+    @classmethod
+    def history_dir_name(cls, file_path):
+        return (cls.document_key(file_path)[:12] + "-"
+                + os.path.basename(file_path))
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        db = sqlite3.connect(self._path)
+        for statement in self._SCHEMA:
+            db.execute(statement)
+        return db
+
+    # sessions saved before catalog were kept by file name only,
+    # they are added once, when document is first looked up
+    def _add_document(self, db, file_path):
+        doc_key = self.document_key(file_path)
+        if db.execute("SELECT 1 FROM documents WHERE doc_key = ?",
+                      (doc_key,)).fetchone():
+            return doc_key
+        db.execute("INSERT INTO documents VALUES (?, ?)",
+                   (doc_key, os.path.realpath(file_path)))
+        dir_name = os.path.basename(file_path)
+        try:
+            files = sorted(os.listdir(self._history_dir + dir_name))
+        except OSError:
+            files = []
+        for file in files:
+            if file.endswith(".o.cache"):
+                self._insert(db, doc_key, file[:-len(".o.cache")],
+                             [], 0, 0, dir_name)
+        return doc_key
+
+    def _insert(self, db, doc_key, started, authors, op_count,
+                changes_size, dir_name):
+        (last,) = db.execute(
+            "SELECT COALESCE(MAX(idx), 0) FROM sessions WHERE doc_key = ?",
+            (doc_key,)).fetchone()
+        db.execute(
+            "INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (doc_key, last + 1, started, ",".join(authors), op_count,
+             changes_size, dir_name))
+
+    def record_session(self, file_path, started, authors, op_count,
+                       changes_size):
+        with closing(self._connect()) as db, db:
+            doc_key = self._add_document(db, file_path)
+            self._insert(db, doc_key, str(started), sorted(authors),
+                         op_count, changes_size,
+                         self.history_dir_name(file_path))
+
+    def _session(self, row):
+        index, started, authors, op_count, changes_size, dir_name = row
+        return HistorySession(
+            index, started, authors.split(",") if authors else [],
+            op_count, changes_size, dir_name)
+
+    def sessions(self, file_path):
+        with closing(self._connect()) as db, db:
+            doc_key = self._add_document(db, file_path)
+            rows = db.execute(
+                f"SELECT {self._COLUMNS} FROM sessions"
+                " WHERE doc_key = ? ORDER BY idx", (doc_key,)).fetchall()
+        return [self._session(row) for row in rows]
+
+    # index is 1-based, as in the list
+    def session(self, file_path, index):
+        with closing(self._connect()) as db, db:
+            doc_key = self._add_document(db, file_path)
+            row = db.execute(
+                f"SELECT {self._COLUMNS} FROM sessions"
+                " WHERE doc_key = ? AND idx = ?",
+                (doc_key, int(index))).fetchone()
+        return self._session(row) if row else None
+
+    def latest(self, file_path):
+        with closing(self._connect()) as db, db:
+            doc_key = self._add_document(db, file_path)
+            row = db.execute(
+                f"SELECT {self._COLUMNS} FROM sessions"
+                " WHERE doc_key = ? ORDER BY idx DESC LIMIT 1",
+                (doc_key,)).fetchone()
+        return self._session(row) if row else None
+
+    def documents(self):
+        with closing(self._connect()) as db, db:
+            rows = db.execute(
+                "SELECT path FROM documents ORDER BY path").fetchall()
+        return [path for (path,) in rows]
+
+    # indices of later sessions do not change
+    def remove_sessions(self, file_path, indices):
+        with closing(self._connect()) as db, db:
+            doc_key = self._add_document(db, file_path)
+            db.executemany(
+                "DELETE FROM sessions WHERE doc_key = ? AND idx = ?",
+                [(doc_key, int(index)) for index in indices])
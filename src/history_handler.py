@@ -1,8 +1,16 @@
 import asyncio
 import datetime
 import os
-import shutil
-from view import View
+import sqlite3
+import time
+import change_log
+import history_pack
+import time_travel
+from blame import BlameRuns
+from change_pieces import ChangePieces
+from chunk_store import ChunkStore
+from history_catalog import HistoryCatalog
+from text_buffer import get_range
 
 
 class HistoryHandler:
@@ -15,205 +23,188 @@ class HistoryHandler:
     def __init__(self, file_path=None):
         self._changes_frames_by_op: dict = {}
         self._changes_frames = []
-        self._last_edited_by = []
+        # (frame, unix time) of every edit and undo not yet saved,
+        # versions of session go through them in order
+        self._timeline = []
+        # versions already written with session history
+        self._saved_version = 0
+        # versions of shown session, None if it has no checkpoints
+        self._versions = None
+        self._version = None
+        self._session_frames = []
+        self._final_text = ""
+        # blame is read from file, when it is first needed
+        self._blame = BlameRuns()
+        self._pending_blame = None
         self._op_cnt = 0
+        # ops before it are already in changes log
+        self._saved_op_cnt = 0
+        self._unsaved_tombstones = []
         self._file_path = None
         self._session_start = datetime.datetime.now()
         self.stop = False
+        self._catalog = HistoryCatalog()
+        self._chunks = ChunkStore()
         if not file_path:
             return
         self._file_path = file_path
-        self._file_name = file_path[file_path.rfind("/"):]
-        self._HISTORY_DIR_PATH += self._file_name + '/'
+        # one host can serve several documents, even with the same name
+        # in different dirs, so caches are named like history dirs
+        cache_name = HistoryCatalog.history_dir_name(file_path)
+        self._HISTORY_DIR_PATH += cache_name + '/'
+        self._BASE_CACHE_PATH = self._CACHE_PATH + cache_name + '.base.cache'
+        self._CHANGES_CACHE_PATH = (
+            self._CACHE_PATH + cache_name + '.changes.cache')
         os.makedirs(os.path.dirname(self._HISTORY_DIR_PATH), exist_ok=True)
         os.makedirs(os.path.dirname(self._CACHE_PATH), exist_ok=True)
 
+    @property
+    def _session_path(self):
+        return self._HISTORY_DIR_PATH + str(self._session_start)
+
     def stop_view(self):
         self.stop = True
 
+    @property
+    def _last_edited_by(self):
+        if self._pending_blame is not None:
+            self._blame = self._read_blame(*self._pending_blame)
+            self._pending_blame = None
+        return self._blame
+
+    @_last_edited_by.setter
+    def _last_edited_by(self, usernames):
+        self._blame = BlameRuns.from_lines(usernames)
+        self._pending_blame = None
+
     def load_blame(self,
                    text_lines,
                    owner_username, history_file: str = None, filename=None):
+        file_path = None
         try:
             if history_file:
                 file_path = self._HISTORY_DIR_PATH + filename + '/' + \
                     history_file.replace(".o.cache", ".blame.cache")
             else:
-                files = filter(lambda x: '.blame.cache' in x, os.listdir(
-                    self._HISTORY_DIR_PATH + self._file_name + '/'))
-                most_recent = None
-                for file in files:
-                    date = datetime.datetime.strptime(
-                        file[file.rfind('/'):].replace('.blame.cache', ""))
-                    if not most_recent:
-                        most_recent = date
-                    if date > most_recent:
-                        most_recent = date
-                file_path = self._HISTORY_DIR_PATH + self._file_name + \
-                    '/' + str(most_recent) + '.blame.cache'
-            with open(file_path, 'r') as f:
-                for line in f.readlines():
-                    self._last_edited_by.append(line.replace('\n', ""))
+                session = self._catalog.latest(self._file_path)
+                if session is not None:
+                    file_path = (HistoryHandler._HISTORY_DIR_PATH
+                                 + session.dir_name + '/'
+                                 + session.blame_file)
+        except sqlite3.Error:
+            pass
+        # file was changed after last session, its blame is stale
+        self._pending_blame = (file_path, owner_username, len(text_lines),
+                               not history_file)
+
+    def _read_blame(self, file_path, owner_username, line_count, check):
+        try:
+            if file_path is None:
+                raise FileNotFoundError(self._file_path)
+            with history_pack.open_file(file_path, 'r') as f:
+                blame = BlameRuns.parse(f.readlines())
+            if check and len(blame) != line_count:
+                raise FileNotFoundError(file_path)
+            return blame
         except OSError:
-            for line in text_lines:
-                self._last_edited_by.append(owner_username)
-
-    async def _is_pos_in_range(self, pos, top, bot):
-        return top[1] < pos[1] and pos[1] < bot[1] or \
-            top[1] == pos[1] and top[0] <= pos[0] and \
-            (bot[1] > pos[1] or bot[1] == pos[1] and pos[0] <= bot[0]) or \
-            bot[1] == pos[1] and bot[0] >= pos[0] and \
-            (top[1] < pos[1] or top[1] == pos[1] and top[0] <= pos[0])
-
-    async def _make_pos_correct_on_insert(self, action_top, action_bot, pos):
-        if pos[1] == action_top[1] and pos[0] >= action_top[0]:
-            pos = (pos[0] + action_bot[0] - action_top[0],
-                   pos[1] + action_bot[1] - action_top[1])
-        elif pos[1] > action_top[1]:
-            pos = (pos[0], pos[1] + action_bot[1] - action_top[1])
-        return pos
-
-    async def _make_pos_correct_after_cut(self, top, bot, pos):
-        if await self._is_pos_in_range(pos, top, bot):
-            pos = top
-        if pos[1] > bot[1]:
-            pos = (pos[0], pos[1] - (bot[1] - top[1]))
-        if pos[1] == bot[1] and pos[0] >= bot[0]:
-            pos = (pos[0] - (bot[0] - top[0]), top[1])
-        return pos
-
-    async def _cut_selected(self, top, bot, text_lines):
-        bot_x, bot_y = bot
-        top_x, top_y = top
-        if bot_y == top_y:
-            text_lines[bot_y] = text_lines[bot_y][:top_x] + \
-                text_lines[bot_y][bot_x:]
-        else:
-            text_lines[top_y] = text_lines[top_y][:top_x] + \
-                text_lines[bot_y][bot_x:]
-            text_lines.pop(bot_y)
-        for y in range(bot_y - 1, top_y, -1):
-            text_lines.pop(y)
-        return text_lines
+            return BlameRuns.from_lines([owner_username] * line_count)
 
     async def _get_range(self, text_lines, top, bot):
-        if bot[1] < top[1] or \
-                bot[1] == top[1] and bot[0] < top[0]:
-            t = top
-            top = bot
-            bot = t
-        top_x, top_y = top
-        bot_x, bot_y = bot
-        if bot_y == top_y:
-            return text_lines[bot_y][top_x:bot_x]
-        t = '' if bot_y - \
-            top_y <= 1 else '\n'.join(text_lines[top_y + 1: bot_y]) + '\n'
-        return text_lines[top_y][top_x:] + '\n' + \
-            t + \
-            text_lines[bot_y][:bot_x]
-
-    async def _normalize_pos(self, pos, offset_pos):
-        if pos[1] == offset_pos[1]:
-            pos = (pos[0] - offset_pos[0], pos[1] - offset_pos[1])
-        else:
-            pos = (pos[0], pos[1] - offset_pos[1])
-        return pos
-
-    async def _currect_frame_and_op_on_cut(
-            self, frame, top, bot, cut_text: str):
-        cut_lines = cut_text.split('\n')
-        if len(cut_lines) == 1:
-            bot = (len(cut_lines[0]) + top[0], top[1])
-        else:
-            bot = (len(cut_lines[-1]),
-                   top[1] + len(cut_lines) - 1)
-        type, frame_top, frame_bot, *rest = frame
-        if type == 'cut':
-            return (top, bot, cut_text)
-        if (await self._is_pos_in_range(top, frame_top, frame_bot)
-                and await self._is_pos_in_range(bot, frame_top, frame_bot)):
-            frame[2] = await self._make_pos_correct_after_cut(
-                top, bot, frame_bot
-            )
-            return [(0, 0), (0, 0), '']
-        elif (await self._is_pos_in_range(frame_top, top, bot)
-              and await self._is_pos_in_range(frame_bot, top, bot)):
-            frame[1] = frame[2]
-            cut_top = frame_top
-            cut_bot = frame_bot
-            cut_top = await self._normalize_pos(cut_top, top)
-            cut_bot = await self._normalize_pos(cut_bot, top)
-            return [top,
-                    bot,
-                    '\n'.join(await self
-                              ._cut_selected(cut_top,
-                                             cut_bot,
-                                             cut_text.split('\n')))]
-        elif await self._is_pos_in_range(frame_top, top, bot):
-            frame[1] = top
-            frame[2] = await self._make_pos_correct_after_cut(top,
-                                                              bot,
-                                                              frame_bot)
-            cut_top = top
-            cut_bot = frame_top
-            cut_bot = await self._normalize_pos(cut_bot, top)
-            cut_top = (0, 0)
-            bot = frame_top
-            return [top,
-                    bot,
-                    '\n'.join(await self._get_range(cut_lines,
-                                                    cut_top,
-                                                    cut_bot))]
-        elif await self._is_pos_in_range(frame_bot, top, bot):
-            frame[2] = top
-            cut_top = frame_bot
-            cut_bot = bot
-            cut_top = await self._normalize_pos(cut_top, top)
-            cut_bot = await self._normalize_pos(cut_bot, top)
-            bot = await self._make_pos_correct_after_cut(top, frame_bot, bot)
-            return [top,
-                    bot,
-                    '\n'.join(await self._get_range(cut_lines,
-                                                    cut_top,
-                                                    cut_bot))]
-        else:
-            frame[1] = await self._make_pos_correct_on_insert(top,
-                                                              bot,
-                                                              frame_top)
-            frame[2] = await self._make_pos_correct_on_insert(top,
-                                                              bot,
-                                                              frame_bot)
-        return [top, bot, cut_text]
+        return get_range(text_lines, top, bot)
 
     async def user_cut_save_history(self, username, text_lines, top, bot):
         if not self._file_path:
             return
+        self._last_edited_by.cut(top, bot, username)
         self._op_cnt += 1
         self._changes_frames_by_op[self._op_cnt - 1] = (
             ['cut',
              top,
              bot,
              await self._get_range(text_lines, top, bot), username])
+        self._add_version(self._changes_frames_by_op[self._op_cnt - 1])
         return self._op_cnt
 
     async def correct_history_on_undo_cut(self, username, op_cnt):
         if not self._file_path:
             return
-        self._changes_frames_by_op.pop(op_cnt - 1)
+        self._forget_op(username, op_cnt - 1)
 
     async def new_text_save_history(self, username, top, bot):
         if not self._file_path:
             return
+        self._last_edited_by.inserted(top, bot, username)
         self._op_cnt += 1
         self._changes_frames_by_op[self._op_cnt - 1] = (
             ['insert', top, bot, username]
         )
+        self._add_version(self._changes_frames_by_op[self._op_cnt - 1])
         return self._op_cnt
 
     async def correct_history_on_undo_paste(self, username, op_cnt):
         if not self._file_path:
             return
-        self._changes_frames_by_op.pop(op_cnt - 1)
+        self._forget_op(username, op_cnt - 1)
+
+    # text changed by undo is not in changes log, its op is forgotten
+    # there, but versions of the session go through the undo
+    async def undo_cut_save_version(self, username, text_lines, top, bot):
+        if not self._file_path:
+            return
+        self._add_version(
+            ['cut', top, bot,
+             await self._get_range(text_lines, top, bot), username])
+
+    async def undo_insert_save_version(self, username, top, bot):
+        if not self._file_path:
+            return
+        self._add_version(['insert', top, bot, username])
+
+    def _add_version(self, frame):
+        self._timeline.append((list(frame), time.time()))
+
+    # undo reverts text of the frame, blame follows
+    def _forget_op(self, username, op):
+        frame = self._changes_frames_by_op.pop(op)
+        if frame[0] == 'insert':
+            self._last_edited_by.cut(frame[1], frame[2], username)
+        else:
+            self._last_edited_by.inserted(frame[1], frame[2], username)
+        if op < self._saved_op_cnt:
+            self._unsaved_tombstones.append(op)
+
+    def journal_state(self):
+        return {
+            "op_cnt": self._op_cnt,
+            "frames": list(self._changes_frames_by_op.items()),
+            "timeline": list(self._timeline),
+            "saved_version": self._saved_version,
+            "last_edited_by": self._last_edited_by.dumps(),
+            "session_start": str(self._session_start),
+            "saved_op_cnt": self._saved_op_cnt,
+            "unsaved_tombstones": self._unsaved_tombstones,
+        }
+
+    def restore_journal_state(self, state):
+        self._op_cnt = state["op_cnt"]
+        self._changes_frames_by_op = {
+            op: [frame[0], tuple(frame[1]), tuple(frame[2]), *frame[3:]]
+            for op, frame in state["frames"]
+        }
+        self._timeline = [
+            ([frame[0], tuple(frame[1]), tuple(frame[2]), *frame[3:]], t)
+            for frame, t in state.get("timeline", [])
+        ]
+        self._saved_version = state.get("saved_version", 0)
+        blame = state["last_edited_by"]
+        self._blame = BlameRuns.parse(
+            blame.split("\n") if isinstance(blame, str) else blame)
+        self._pending_blame = None
+        self._saved_op_cnt = state.get("saved_op_cnt", 0)
+        self._unsaved_tombstones = state.get("unsaved_tombstones", [])
+        # history of recovered session is saved as the same session
+        self._session_start = datetime.datetime.fromisoformat(
+            state["session_start"])
 
     def _save_base_version(self):
         with open(self._file_path, 'r') as f:
@@ -222,24 +213,21 @@ class HistoryHandler:
                 f.write(filetext)
 
     async def _save_changes(self, text_lines):
-        with open(self._CHANGES_CACHE_PATH, 'w') as f:
-            for i in range(0, self._op_cnt):
-                if i in self._changes_frames_by_op:
-                    self._changes_frames.append(self._changes_frames_by_op[i])
-            for frame in self._changes_frames:
-                frame_data = [
-                    str(frame[0]),
-                    str(frame[1][0]), str(frame[1][1]),
-                    str(frame[2][0]), str(frame[2][1]),
-                    frame[3].replace(' ', '/s') if frame[0] == 'cut'
-                    else str(frame[3]),
-                    str(frame[4]) if frame[0] == 'cut' else '',
-                    str(self._DELIMITER)
-                ]
-                frame_str = ' '.join(filter(None, frame_data))
-                f.write(frame_str)
-        shutil.copy(self._file_path, self._HISTORY_DIR_PATH +
-                    str(self._session_start) + '.o.cache')
+        records = [change_log.encode_tombstone(op)
+                   for op in self._unsaved_tombstones]
+        for op in range(self._saved_op_cnt, self._op_cnt):
+            if op in self._changes_frames_by_op:
+                records.append(change_log.encode_frame(
+                    op, self._changes_frames_by_op[op]))
+        # first save of session drops log of previous one
+        change_log.append_records(
+            self._CHANGES_CACHE_PATH, records,
+            truncate=self._saved_op_cnt == 0)
+        self._saved_op_cnt = self._op_cnt
+        self._unsaved_tombstones = []
+        self._chunks.copy_snapshot(
+            self._file_path,
+            self._session_path + '.o.cache')
 
     async def save_file(self, text_lines):
         if self._file_path is None:
@@ -248,9 +236,17 @@ class HistoryHandler:
             text = "\n".join(text_lines)
             f.write(text)
         await self._save_changes(text_lines)
+        self._save_versions(text)
 
     async def _read_changes(self, history_file):
-        with open(history_file, 'r') as f:
+        if change_log.is_change_log(history_file):
+            self._changes_frames.extend(change_log.read_frames(history_file))
+            return
+        await self._read_legacy_changes(history_file)
+
+    # history of sessions saved before change log
+    async def _read_legacy_changes(self, history_file):
+        with history_pack.open_file(history_file, 'r') as f:
             changes_text = f.read()
             changes = changes_text.split(str(self._DELIMITER))
             for change in changes:
@@ -269,28 +265,94 @@ class HistoryHandler:
                 else:
                     self._changes_frames[-1].append(rest[0])
 
-    async def show_changes(self, filename, history_file: str, model, stdscr):
-        history_file = history_file.replace('.o.cache', '.cache')
-        await self._read_changes(
-            self._HISTORY_DIR_PATH
-            + filename
-            + '/'
-            + history_file
-        )
-        for i in range(len(self._changes_frames) - 1, -1, -1):
-            frame = self._changes_frames[i]
+    # ops of session in order, legacy log has no op numbers
+    async def _read_ops(self, history_file):
+        if change_log.is_change_log(history_file):
+            return change_log.read_ops(history_file)
+        self._changes_frames.clear()
+        await self._read_legacy_changes(history_file)
+        return list(enumerate(self._changes_frames))
+
+    async def show_changes(self, filename, history_file: str, model, stdscr,
+                           at=None):
+        await self.load_session(filename, history_file, model, at)
+        await self._show_changes_view(stdscr, model)
+
+    async def load_session(self, filename, history_file: str, model,
+                           at=None):
+        session_path = (self._HISTORY_DIR_PATH + filename + '/'
+                        + history_file.replace('.o.cache', ''))
+        await self._read_changes(session_path + '.cache')
+        self._session_frames = list(self._changes_frames)
+        self._final_text = model.text_lines.get_text()
+        self._versions = time_travel.Versions.load(
+            session_path, self._chunks)
+        if self._versions is not None and at is not None:
+            await self.show_version(model, self._version_at(at))
+        else:
+            await self._show_session_changes(model)
+
+    # at is op index or unix time
+    def _version_at(self, at):
+        if isinstance(at, int):
+            return at
+        return self._versions.version_at(at)
+
+    async def _show_session_changes(self, model):
+        if self._versions is not None:
+            self._version = self._versions.last
+        self._changes_frames = list(self._session_frames)
+        await model.text_upload(self._final_text)
+        # frames go in text order, cut text is put back before the next
+        for frame in self._changes_frames:
             if frame[0] == 'cut':
                 op_type, top, bot, cut_text, *rest = frame
                 await model._insert(cut_text, top)
-            else:
-                continue
-        await self._show_changes_view(stdscr, model)
+
+    # text after first version ops, op that made it is marked,
+    # text cut by it is put back
+    async def show_version(self, model, version):
+        if self._versions is None:
+            return
+        version = min(max(version, 0), self._versions.last)
+        if version == self._versions.last:
+            await self._show_session_changes(model)
+            return
+        self._version = version
+        lines = self._versions.lines(version)
+        frame = self._versions.frame(version)
+        if frame and frame[0] == 'cut':
+            time_travel.undo_frame(lines, frame)
+        self._changes_frames = [frame] if frame else []
+        await model.text_upload(lines.get_text())
+        if frame:
+            # view follows the op
+            x, y = min(frame[1], frame[2], key=lambda pos: pos[::-1])
+            await model.user_pos_update(model._owner_username, x, y)
+
+    async def step_version(self, model, step):
+        if self._versions is not None:
+            await self.show_version(model, self._version + step)
+
+    def version_status(self):
+        if self._versions is None:
+            return None
+        status = f"version {self._version}/{self._versions.last}"
+        op_time = self._versions.time(self._version)
+        if op_time is not None:
+            status += " " + datetime.datetime.fromtimestamp(
+                op_time).strftime("%Y-%m-%d %H:%M:%S")
+        frame = self._versions.frame(self._version)
+        if frame is not None:
+            status += f" {frame[0]} by {frame[-1]}"
+        return status
 
     async def show_blame(self, filename, history_file: str, model, stdscr):
+        from view import View
         self.load_blame(model.text_lines, None, history_file, filename)
         view = View(stdscr, 'view_blame')
         max_len = 0
-        for username in self._last_edited_by:
+        for username in self._last_edited_by.users:
             max_len = max(len(username), max_len)
         while not self.stop:
             view.draw_blame(
@@ -303,6 +365,7 @@ class HistoryHandler:
             await asyncio.sleep(0.05)
 
     async def _show_changes_view(self, stdscr, model):
+        from view import View
         view = View(stdscr, 'view_changes')
         while not self.stop:
             view.draw_text(
@@ -310,70 +373,56 @@ class HistoryHandler:
                 model.user_positions,
                 model.users,
                 model.shift_user_positions,
-                self._changes_frames)
+                self._changes_frames,
+                status=self.version_status())
             await asyncio.sleep(0.05)
         pass
 
     async def session_ended(self):
         if not self._file_path:
             return
-        self._changes_frames.clear()
-        await self._read_changes(self._CHANGES_CACHE_PATH)
-        for i in range(len(self._changes_frames) - 1, -1, -1):
-            frame = self._changes_frames[i]
-            if frame[0] != 'cut':
-                continue
-            op_type, top, bot, cut_text, *rest = frame
-            for j in range(i - 1, -1, -1):
-                top, bot, cut_text = await self._currect_frame_and_op_on_cut(
-                    self._changes_frames[j], top, bot, cut_text
-                )
-            for j in range(i + 1, len(self._changes_frames)):
-                frame_to_correct = self._changes_frames[j]
-                if frame[0] != 'cut':
-                    break
-                frame_to_correct[1] = await self._make_pos_correct_on_insert(
-                    top, bot, frame_to_correct[1]
-                )
-                frame_to_correct[2] = await self._make_pos_correct_on_insert(
-                    top, bot, frame_to_correct[2]
-                )
-            frame[1] = top
-            frame[2] = bot
-            frame[3] = cut_text
-        # TODO: correct blame
-        for frame in self._changes_frames:
-            op_type, top, bot, *rest = frame
-            if op_type == 'cut':
-                cut_text = rest[0]
-                username = rest[1]
-                self._last_edited_by[top[1]] = username
-                self._last_edited_by[bot[1]] = username
-                for y in range(top[1] + 1, bot[1]):
-                    self._last_edited_by.pop(y)
-            if op_type == 'insert':
-                username = rest[0]
-                self._last_edited_by[top[1]] = username
-                for y in range(top[1], bot[1]):
-                    self._last_edited_by.insert(y, username)
-        with open(self._HISTORY_DIR_PATH +
-                  str(self._session_start) + '.cache', 'w') as f:
-            for frame in self._changes_frames:
-                frame_data = [
-                    str(frame[0]),
-                    str(frame[1][0]), str(frame[1][1]),
-                    str(frame[2][0]), str(frame[2][1]),
-                    frame[3].replace(' ', '/s') if frame[0] == 'cut'
-                    else str(frame[3]),
-                    str(frame[4]) if frame[0] == 'cut' else '',
-                    str(self._DELIMITER)
-                ]
-                frame_str = ' '.join(filter(None, frame_data))
-                f.write(frame_str)
-        with open(self._HISTORY_DIR_PATH
-                  + str(self._session_start)
-                  + '.blame.cache',
-                  'w') as f:
-            for line in self._last_edited_by:
-                f.write(line + '\n')
+        ops = await self._read_ops(self._CHANGES_CACHE_PATH)
+        blame = self._last_edited_by.dumps()
+        # long session is normalised and written without stopping the loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._save_session, ops, blame)
+
+    def _save_session(self, ops, blame):
+        session_path = self._session_path
+        op_count = len(ops)
+        pieces = ChangePieces.from_frames(frame for _, frame in ops)
+        self._changes_frames = pieces.frames()
+        records = [change_log.encode_frame(op, frame)
+                   for op, frame in enumerate(self._changes_frames)]
+        change_log.append_records(
+            session_path + '.cache', records, truncate=True)
+        with open(session_path + '.blame.cache', 'w') as f:
+            f.write(blame)
+        self._catalog.record_session(
+            self._file_path, self._session_start,
+            {frame[-1] for frame in self._changes_frames},
+            op_count, sum(map(len, records)))
         os.remove(self._CHANGES_CACHE_PATH)
+
+    # ops made since previous save, their times and checkpoints of
+    # saved text are appended to session history, so any version of the
+    # session is rebuilt from them in bounded time
+    def _save_versions(self, text):
+        if not self._timeline:
+            return
+        first = self._saved_version
+        ops = list(enumerate(
+            (frame for frame, _ in self._timeline), first))
+        change_log.append_records(
+            self._session_path + '.ops.cache',
+            [change_log.encode_frame(op, frame) for op, frame in ops],
+            truncate=not first)
+        time_travel.append_times(
+            self._session_path + '.times.cache',
+            {op: t for op, (_, t) in enumerate(self._timeline, first)},
+            truncate=not first)
+        time_travel.write_checkpoints(
+            self._session_path + '.checkpoints.cache', text, ops,
+            self._chunks, first=first)
+        self._saved_version += len(self._timeline)
+        self._timeline = []
@@ -0,0 +1,95 @@
+import io
+import os
+import zipfile
+
+# change logs, blame and versions of old sessions are moved
+# into one pack per document, loose file is read first,
+# so session is readable at every step of packing
+PACK_NAME = "sessions.pack"
+PACKED_SUFFIXES = (
+    ".cache",
+    ".blame.cache",
+    ".ops.cache",
+    ".times.cache",
+    ".checkpoints.cache",
+)
+# checkpoints are read by offsets, stored members seek fast
+_STORED_SUFFIXES = (".checkpoints.cache",)
+
+
+def pack_path(path):
+    return os.path.join(os.path.dirname(path), PACK_NAME)
+
+
+def session_files(started):
+    return [started + suffix for suffix in PACKED_SUFFIXES]
+
+
+def open_file(path, mode="rb"):
+    try:
+        return open(path, mode)
+    except FileNotFoundError:
+        pass
+    try:
+        with zipfile.ZipFile(pack_path(path)) as pack:
+            # member stays readable after pack is closed
+            f = pack.open(os.path.basename(path))
+            return f if "b" in mode else io.TextIOWrapper(f)
+    except (KeyError, OSError, zipfile.BadZipFile):
+        raise FileNotFoundError(path)
+
+
+def exists(path):
+    try:
+        open_file(path).close()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def packed_names(dir_path):
+    try:
+        with zipfile.ZipFile(os.path.join(dir_path, PACK_NAME)) as pack:
+            return set(pack.namelist())
+    except (OSError, zipfile.BadZipFile):
+        return set()
+
+
+# loose files are removed only after they are in the pack
+def pack_files(dir_path, names):
+    names = [name for name in names
+             if os.path.exists(os.path.join(dir_path, name))]
+    if not names:
+        return []
+    packed = packed_names(dir_path)
+    with zipfile.ZipFile(os.path.join(dir_path, PACK_NAME), "a") as pack:
+        for name in names:
+            if name in packed:
+                continue
+            pack.write(
+                os.path.join(dir_path, name), name,
+                compress_type=(zipfile.ZIP_STORED
+                               if name.endswith(_STORED_SUFFIXES)
+                               else zipfile.ZIP_DEFLATED))
+    for name in names:
+        os.remove(os.path.join(dir_path, name))
+    return names
+
+
+# members can not be deleted from zip, pack is written again
+def remove_files(dir_path, names):
+    names = set(names)
+    for name in names:
+        try:
+            os.remove(os.path.join(dir_path, name))
+        except FileNotFoundError:
+            pass
+    if not names & packed_names(dir_path):
+        return
+    path = os.path.join(dir_path, PACK_NAME)
+    with zipfile.ZipFile(path) as pack, \
+            zipfile.ZipFile(path + ".tmp", "w") as new_pack:
+        for info in pack.infolist():
+            if info.filename not in names:
+                new_pack.writestr(info, pack.read(info))
+    os.replace(path + ".tmp", path)
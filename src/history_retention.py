@@ -0,0 +1,117 @@
+import datetime
+import os
+import time
+from collections import namedtuple
+import history_pack
+import time_travel
+from chunk_store import ChunkStore
+import history_catalog
+from history_catalog import HistoryCatalog
+
+# chunks younger than this can belong to snapshot being saved
+_CHUNK_GRACE = 60 * 60
+
+
+class RetentionPolicy(namedtuple(
+    "RetentionPolicy",
+    "keep_last keep_days daily_after_days pack_after_days",
+    defaults=(10, None, 7, 1),
+)):
+    # last sessions are always kept, sessions older than keep_days
+    # are dropped, older than daily_after_days are thinned out
+    # to the last session of every day
+    def kept(self, sessions, now):
+        sessions = sorted(sessions, key=lambda session: session.index)
+        kept = {session.index
+                for session in sessions[-max(self.keep_last, 1):]}
+        last_of_day = {}
+        for session in sessions:
+            age = now - _started(session)
+            if (self.keep_days is not None
+                    and age > datetime.timedelta(days=self.keep_days)):
+                continue
+            if age <= datetime.timedelta(days=self.daily_after_days):
+                kept.add(session.index)
+            else:
+                last_of_day[_started(session).date()] = session.index
+        return kept | set(last_of_day.values())
+
+
+def _started(session):
+    return datetime.datetime.fromisoformat(session.started)
+
+
+class HistoryCompactor:
+    # drops sessions, that policy does not keep, moves files of old
+    # sessions into pack of the document and removes chunks,
+    # that no snapshot uses
+    def __init__(self, policy=RetentionPolicy(), catalog=None,
+                 chunks=None, history_dir=None):
+        self._policy = policy
+        self._catalog = catalog or HistoryCatalog()
+        self._chunks = chunks or ChunkStore()
+        self._history_dir = history_dir or history_catalog.HISTORY_DIR_PATH
+
+    # returns (removed, packed) sessions
+    def compact_document(self, file_path, now=None):
+        now = now or datetime.datetime.now()
+        sessions = self._catalog.sessions(file_path)
+        kept = self._policy.kept(sessions, now)
+        removed = [session for session in sessions
+                   if session.index not in kept]
+        for session in removed:
+            dir_path = self._history_dir + session.dir_name
+            history_pack.remove_files(
+                dir_path, history_pack.session_files(session.started))
+            try:
+                os.remove(os.path.join(dir_path, session.original_file))
+            except FileNotFoundError:
+                pass
+        self._catalog.remove_sessions(
+            file_path, [session.index for session in removed])
+        packed = []
+        pack_age = datetime.timedelta(days=self._policy.pack_after_days)
+        for session in sessions:
+            if session.index in kept and now - _started(session) > pack_age:
+                if history_pack.pack_files(
+                        self._history_dir + session.dir_name,
+                        history_pack.session_files(session.started)):
+                    packed.append(session)
+        return removed, packed
+
+    def compact(self, now=None):
+        removed = []
+        packed = []
+        for file_path in self._catalog.documents():
+            document_removed, document_packed = self.compact_document(
+                file_path, now)
+            removed.extend(document_removed)
+            packed.extend(document_packed)
+        return removed, packed, self.collect_chunks()
+
+    def _used_chunks(self):
+        used = set()
+        for document in os.scandir(self._history_dir):
+            if not document.is_dir():
+                continue
+            for file in os.scandir(document.path):
+                if file.name.endswith(".o.cache"):
+                    used.update(ChunkStore.snapshot_chunks(file.path))
+            names = {file.name for file in os.scandir(document.path)}
+            names |= history_pack.packed_names(document.path)
+            for name in names:
+                if name.endswith(".checkpoints.cache"):
+                    used.update(time_travel.checkpoint_chunks(
+                        os.path.join(document.path, name)))
+        return used
+
+    # returns number of removed chunks
+    def collect_chunks(self):
+        used = self._used_chunks()
+        removed = 0
+        for digest, path in self._chunks.chunk_files():
+            if (digest not in used
+                    and time.time() - os.path.getmtime(path) > _CHUNK_GRACE):
+                os.remove(path)
+                removed += 1
+        return removed
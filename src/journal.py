@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import json
+import os
+from message_parser import MessageParser
+
+JOURNAL_DIR_PATH = "/tmp/lib/mttext/journal/"
+# messages, that change text, cursors or history of the document
+JOURNALED_OPS = frozenset((
+    "-E", "-D", "-NL", "-M", "-MS", "-PASTE", "-CUT",
+    "-UNDO", "-REDO", "-B", "-DC",
+))
+
+
+class Journal:
+    # every op applied by host is appended to the journal before
+    # it reaches disk with the next Ctrl+S, writes are batched
+    # and synced every _FLUSH_INTERVAL, long journal is compacted
+    # into snapshot of model state, restarted host replays both
+    _FLUSH_INTERVAL = 0.05
+    _SNAPSHOT_EVERY = 10000
+
+    def __init__(self, file_path, model, journal_dir=None):
+        journal_dir = journal_dir or JOURNAL_DIR_PATH
+        real_path = os.path.realpath(file_path)
+        # documents with the same name in different dirs must not clash
+        digest = hashlib.sha1(real_path.encode()).hexdigest()[:12]
+        self._dir = os.path.join(
+            journal_dir, digest + "-" + os.path.basename(real_path))
+        self._log_path = os.path.join(self._dir, "journal.log")
+        self._snapshot_path = os.path.join(self._dir, "snapshot.json")
+        self._model = model
+        self._seq = 0
+        self._since_snapshot = 0
+        self._pending = []
+        self._snapshot = None
+        self._write_m = asyncio.Lock()
+        self._flush_task = None
+        self._closed = False
+        os.makedirs(self._dir, exist_ok=True)
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def record(self, message):
+        args = message.split(" ", 2)
+        if len(args) < 2 or args[1] not in JOURNALED_OPS:
+            return
+        self._seq += 1
+        self._since_snapshot += 1
+        self._pending.append((self._seq, message))
+        if self._since_snapshot >= self._SNAPSHOT_EVERY:
+            self.snapshot()
+
+    # state is taken between ops, so it matches the last seq,
+    # must be taken after file is saved, or saved ops are replayed again
+    def snapshot(self):
+        self._snapshot = (self._seq, self._model.journal_state())
+        self._since_snapshot = 0
+
+    # recovered or loaded state is the base of new ops
+    def start(self):
+        self.snapshot()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while not self._closed:
+            await asyncio.sleep(self._FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        async with self._write_m:
+            pending, self._pending = self._pending, []
+            snapshot, self._snapshot = self._snapshot, None
+            if not pending and snapshot is None:
+                return
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._write, pending, snapshot)
+
+    def _write(self, pending, snapshot):
+        with open(self._log_path, "a") as f:
+            for seq, message in pending:
+                f.write(json.dumps([seq, message]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if snapshot is None:
+            return
+        seq, state = snapshot
+        self._replace(self._snapshot_path,
+                      json.dumps({"seq": seq, "model": state}))
+        # ops older than snapshot are all in this batch or written before
+        self._replace(self._log_path, "".join(
+            json.dumps([s, message]) + "\n"
+            for s, message in pending if s > seq))
+
+    def _replace(self, path, data):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _read(self):
+        snapshot = None
+        entries = []
+        try:
+            with open(self._snapshot_path, "r") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            pass
+        try:
+            with open(self._log_path, "r") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # torn write of the crash
+                        break
+        except OSError:
+            pass
+        return snapshot, entries
+
+    # returns True if previous session was not ended cleanly
+    async def recover(self):
+        snapshot, entries = await asyncio.get_running_loop().run_in_executor(
+            None, self._read)
+        if snapshot is None and not entries:
+            return False
+        seq = 0
+        if snapshot is not None:
+            seq = snapshot["seq"]
+            await self._model.restore_journal_state(snapshot["model"])
+        # parser without username applies ops of host user too
+        parser = MessageParser(self._model, True, None)
+        for entry_seq, message in entries:
+            if entry_seq <= seq:
+                continue
+            args = message.split(" ")
+            if args[0] not in self._model.users:
+                await self._model.add_user(args[0])
+            await parser.parse_message(args)
+            seq = entry_seq
+        self._seq = seq
+        return True
+
+    # session ended cleanly, history is saved, nothing to recover
+    async def close(self):
+        # write in progress must not recreate removed journal
+        self._closed = True
+        if self._flush_task:
+            await self._flush_task
+            self._flush_task = None
+        async with self._write_m:
+            self._pending = []
+            self._snapshot = None
+            for path in (self._log_path, self._snapshot_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
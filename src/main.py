@@ -1,65 +1,63 @@
+import datetime
 import re
+from chunk_store import ChunkStore
+from history_catalog import HistoryCatalog
+from history_retention import HistoryCompactor, RetentionPolicy
 from mttext_app import MtTextEditApp
+from session_registry import SessionRegistry
+from worker_pool import WorkerPool
 import argparse
 import os
 
 PERMISSION_FILE = "/tmp/lib/mttext/permissions"
 HISTORY_FILE_PATH = "/tmp/lib/mttext/history/"
 
-# TODO: implement correct division for files with same filename
-
 
 def list_all_saved_history(file_path):
-    file_name = file_path[file_path.rfind("/"):]
-    os.makedirs(
-        os.path.dirname(HISTORY_FILE_PATH + file_name + "/"), exist_ok=True
-    )
-    files = os.listdir(HISTORY_FILE_PATH + file_name + "/")
-    files.sort()
-    i = 1
-    for hist_file in filter(lambda x: ".o.cache" in x, files):
-        print(hist_file[: hist_file.rfind(".o.cache")] + f"\t{i}")
-        i += 1
-
-
-def show_changes(file_path, changes_index):
-    file_name = file_path[file_path.rfind("/"):]
-    file_list = os.listdir(HISTORY_FILE_PATH + file_name + "/")
-    file_list.sort()
-    files = list(filter(lambda x: ".o.cache" in x, file_list))
+    for session in HistoryCatalog().sessions(file_path):
+        print(f"{session.started}\t{session.index}")
+
+
+def _read_session(file_path, changes_index):
+    session = HistoryCatalog().session(file_path, changes_index)
+    if session is None:
+        return None, None
+    return session, ChunkStore().read_snapshot(
+        HISTORY_FILE_PATH + session.dir_name + "/" + session.original_file)
+
+
+# version of session is number of its ops or time of the version
+def _parse_version(at):
+    if at is None:
+        return None
+    if at.isdigit():
+        return int(at)
+    return datetime.datetime.fromisoformat(at).timestamp()
+
+
+def show_changes(file_path, changes_index, at=None):
     try:
-        with open(
-            HISTORY_FILE_PATH
-            + file_name
-            + "/"
-            + files[int(changes_index) - 1],
-            "r",
-        ) as f:
-            filetext = f.read()
-    except FileExistsError:
+        session, filetext = _read_session(file_path, changes_index)
+    except OSError:
+        session = None
+    if session is None:
         print("no such changes file found, :(")
         return
     app = MtTextEditApp("view_changes", filetext)
-    app.show_changes(file_name, files[int(changes_index) - 1])
+    app.show_changes(session.dir_name, session.original_file,
+                     at=_parse_version(at))
 
 
 def show_blame(file_path, changes_index):
-    file_name = file_path[file_path.rfind('/'):]
-    file_list = os.listdir(
-        HISTORY_FILE_PATH + file_name + '/')
-    file_list.sort()
-    files = list(filter(lambda x: '.o.cache' in x, file_list))
     try:
-        with open(
-                HISTORY_FILE_PATH +
-                file_name + '/' +
-                files[int(changes_index) - 1], 'r') as f:
-            filetext = f.read()
-    except Exception:
+        session, filetext = _read_session(file_path, changes_index)
+    except OSError:
+        session = None
+    if session is None:
         print('no such changes file found, :(')
         return
     app = MtTextEditApp("view_blame", filetext)
-    app.show_blame(file_name, files[int(changes_index) - 1])
+    app.show_blame(session.dir_name, session.original_file)
 
 
 def get_permissions():
@@ -106,16 +104,38 @@ def manage_permissions(username, access_rights):
         return False
 
 
-def connect_to_session(debug, conn_ip, username):
+def connect_to_session(debug, conn_ip, username, document=None):
     r = re.compile(r"(\d{1,3}\.){3}\d{1,3}")
     if not r.match(conn_ip):
         print("Wrong connection ip address")
         return 0
-    socket = MtTextEditApp(username, debug=debug)
+    socket = MtTextEditApp(username, debug=debug, document=document)
     socket.connect(conn_ip)
 
 
-def host_session(debug, file_path, username):
+def compact_history(policy, file_path=None):
+    compactor = HistoryCompactor(policy)
+    if file_path:
+        removed, packed = compactor.compact_document(file_path)
+        chunks = compactor.collect_chunks()
+    else:
+        removed, packed, chunks = compactor.compact()
+    print(f"removed {len(removed)} sessions, packed {len(packed)}, "
+          f"removed {chunks} chunks")
+
+
+def host_session(debug, file_path, username, headless=False, workers=1,
+                 history_policy=None):
+    # directory is hosted as set of documents, clients choose one
+    # documents of directory are always served without terminal
+    if os.path.isdir(file_path):
+        if workers > 1:
+            WorkerPool(file_path, username, workers, debug=debug,
+                       history_policy=history_policy).run()
+        else:
+            SessionRegistry(file_path, username, debug=debug,
+                            history_policy=history_policy).run()
+        return
     try:
         with open(file_path, "r") as f:
             filetext = f.read()
@@ -123,9 +143,13 @@ def host_session(debug, file_path, username):
         print("File does not exist :(")
         return
     socket = MtTextEditApp(
-        username, filetext, debug=debug, file_path=file_path
+        username, filetext, debug=debug, file_path=file_path,
+        history_policy=history_policy
     )
-    socket.run()
+    if headless:
+        socket.run_headless()
+    else:
+        socket.run()
 
 
 def main():
@@ -135,7 +159,8 @@ def main():
         prog="mtrtext",
         description="multi-user text editor",
         epilog=":)",
-        usage="%(prog)s [-D] (-H FILE_PATH USERNAME | -C CONN_IP USERNAME | \
+        usage="%(prog)s [-D] (-H FILE_PATH USERNAME [--headless] | \
+        -C CONN_IP USERNAME [--doc DOCUMENT] | \
         -P USERNAME ACCESS_RIGHTS | -Pl | \
         -CHH FILE_PATH | -CH FILE_PATH INDEX \
         -B FILE_PATH INDEX)"
@@ -145,10 +170,20 @@ def main():
                         help="Print some debug messages")
     parser.add_argument('-H', nargs=2,
                         metavar=('FILE_PATH', 'USERNAME'),
-                        help='Host edit session')
+                        help='Host edit session, if FILE_PATH is a '
+                        'directory, every file in it is hosted headless')
+    parser.add_argument('--headless', action='store_true', default=False,
+                        help='Host session without terminal, '
+                        'stop it with SIGTERM')
+    parser.add_argument('--workers', type=int, default=1,
+                        metavar='N',
+                        help='Worker processes for hosted directory, '
+                        'each document lives in one of them')
     parser.add_argument('-C', nargs=2,
                         metavar=('CONN_IP', 'USERNAME'),
                         help='Connect to session')
+    parser.add_argument('--doc', metavar='DOCUMENT', default=None,
+                        help='Document to open on multi-document host')
     parser.add_argument('-P', nargs=2,
                         metavar=('USERNAME', 'ACCESS_RIGHTS'),
                         help='Manage user permissions + to add, \
@@ -160,26 +195,50 @@ def main():
                         help='List all availible history changes for file')
     parser.add_argument('-CH', nargs=2,
                         metavar=('FILE_PATH', 'INDEX'),
-                        help='Show history for file from i-th session')
+                        help='Show history for file from i-th session, '
+                        '[ and ] step through its versions')
+    parser.add_argument('--at', metavar='VERSION', default=None,
+                        help='Open history at op number or ISO time')
     parser.add_argument('-B', nargs=2,
                         metavar=('FILE_PATH', 'INDEX'),
                         help='Show blame for file from i-th session')
+    parser.add_argument('--compact', nargs='?', const='',
+                        metavar='FILE_PATH',
+                        help='Drop history sessions, that retention policy '
+                        'does not keep, and pack old ones, '
+                        'all files if FILE_PATH is not given')
+    parser.add_argument('--compact-idle', action='store_true',
+                        default=False,
+                        help='Compact history of hosted file while idle')
+    parser.add_argument('--keep-last', type=int, default=10, metavar='N',
+                        help='Sessions, that are always kept')
+    parser.add_argument('--keep-days', type=int, default=None, metavar='D',
+                        help='Drop sessions older than D days')
+    parser.add_argument('--daily-after', type=int, default=7, metavar='D',
+                        help='Keep one session a day after D days')
+    parser.add_argument('--pack-after', type=int, default=1, metavar='D',
+                        help='Pack history of sessions older than D days')
     try:
         args = parser.parse_args()
+        policy = RetentionPolicy(args.keep_last, args.keep_days,
+                                 args.daily_after, args.pack_after)
         if args.Pl:
             list_permissions()
         if args.P:
             manage_permissions(args.P[0], args.P[1])
         if args.C:
-            connect_to_session(args.debug, args.C[0], args.C[1])
+            connect_to_session(args.debug, args.C[0], args.C[1], args.doc)
         if args.H:
-            host_session(args.debug, args.H[0], args.H[1])
+            host_session(args.debug, args.H[0], args.H[1], args.headless,
+                         args.workers, policy if args.compact_idle else None)
         if args.CHH:
             list_all_saved_history(args.CHH[0])
         if args.CH:
-            show_changes(args.CH[0], args.CH[1])
+            show_changes(args.CH[0], args.CH[1], args.at)
         if args.B:
             show_blame(args.B[0], args.B[1])
+        if args.compact is not None:
+            compact_history(policy, args.compact or None)
     except Exception as e:
         parser.print_help()
         print(f"Error: {str(e)}")
@@ -0,0 +1,281 @@
+import random
+from collections.abc import MutableMapping
+
+LEFT = "left"  # stays before text inserted at its offset
+RIGHT = "right"  # moves after text inserted at its offset
+
+
+class Marker:
+    # marker is a node of treap ordered by offset,
+    # add is pending shift of the whole subtree
+    __slots__ = ("key", "add", "prio", "left", "right", "parent", "tree")
+
+    def __init__(self, offset):
+        self.key = offset
+        self.add = 0
+        self.prio = random.random()
+        self.left = None
+        self.right = None
+        self.parent = None
+        self.tree = None
+
+
+def _push(node):
+    if node.add:
+        node.key += node.add
+        if node.left is not None:
+            node.left.add += node.add
+        if node.right is not None:
+            node.right.add += node.add
+        node.add = 0
+
+
+# splits into keys < offset (<= offset if inclusive) and the rest
+def _split(node, offset, inclusive):
+    if node is None:
+        return None, None
+    _push(node)
+    node.parent = None
+    if node.key < offset or inclusive and node.key == offset:
+        a, b = _split(node.right, offset, inclusive)
+        node.right = a
+        if a is not None:
+            a.parent = node
+        return node, b
+    a, b = _split(node.left, offset, inclusive)
+    node.left = b
+    if b is not None:
+        b.parent = node
+    return a, node
+
+
+def _merge(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.prio > b.prio:
+        _push(a)
+        a.right = _merge(a.right, b)
+        a.right.parent = a
+        return a
+    _push(b)
+    b.left = _merge(a, b.left)
+    b.left.parent = b
+    return b
+
+
+def _collapse(node, offset):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            continue
+        node.key = offset
+        node.add = 0
+        stack.append(node.left)
+        stack.append(node.right)
+
+
+class _MarkerTree:
+    def __init__(self, group, gravity):
+        self.group = group
+        self.gravity = gravity
+        self.root = None
+        self.size = 0
+
+    def _set_root(self, root):
+        self.root = root
+        if root is not None:
+            root.parent = None
+
+    def add(self, marker):
+        a, b = _split(self.root, marker.key, True)
+        marker.tree = self
+        self._set_root(_merge(_merge(a, marker), b))
+        self.size += 1
+
+    def remove(self, marker):
+        path = []
+        node = marker
+        while node is not None:
+            path.append(node)
+            node = node.parent
+        for node in reversed(path):
+            _push(node)
+        child = _merge(marker.left, marker.right)
+        parent = marker.parent
+        if parent is None:
+            self._set_root(child)
+        else:
+            if parent.left is marker:
+                parent.left = child
+            else:
+                parent.right = child
+            if child is not None:
+                child.parent = parent
+        marker.left = marker.right = marker.parent = marker.tree = None
+        self.size -= 1
+
+    def insert(self, offset, length):
+        a, b = _split(self.root, offset, self.gravity == LEFT)
+        if b is not None:
+            b.add += length
+        self._set_root(_merge(a, b))
+
+    def delete(self, start, stop):
+        a, rest = _split(self.root, start, False)
+        deleted, b = _split(rest, stop, True)
+        _collapse(deleted, start)
+        if b is not None:
+            b.add -= stop - start
+        self._set_root(_merge(_merge(a, deleted), b))
+
+    def __iter__(self):
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            yield node
+            stack.append(node.left)
+            stack.append(node.right)
+
+
+class MarkerIndex:
+    # markers are grouped by owner, edit of the owner
+    # can leave markers of its own group untouched
+    # every edit is O(log n) for each group
+
+    def __init__(self):
+        self._trees = {}
+
+    def __len__(self):
+        return sum(tree.size for tree in self._trees.values())
+
+    def __iter__(self):
+        for tree in list(self._trees.values()):
+            yield from list(tree)
+
+    def add(self, offset, gravity=RIGHT, group=None):
+        tree = self._trees.get((group, gravity))
+        if tree is None:
+            tree = self._trees[(group, gravity)] = _MarkerTree(
+                group, gravity)
+        marker = Marker(offset)
+        tree.add(marker)
+        return marker
+
+    def offset(self, marker):
+        offset = marker.key
+        node = marker
+        while node is not None:
+            offset += node.add
+            node = node.parent
+        return offset
+
+    def move(self, marker, offset):
+        tree = marker.tree
+        tree.remove(marker)
+        marker.key = offset
+        marker.add = 0
+        tree.add(marker)
+
+    # empty tree is dropped, so groups of gone users
+    # don't slow down every edit
+    def remove(self, marker):
+        tree = marker.tree
+        if tree is None:
+            return
+        tree.remove(marker)
+        if not tree.size:
+            del self._trees[(tree.group, tree.gravity)]
+
+    def insert(self, offset, length, keep_group=None):
+        for (group, _), tree in self._trees.items():
+            if keep_group is None or group != keep_group:
+                tree.insert(offset, length)
+
+    def delete(self, start, stop, keep_group=None):
+        if stop <= start:
+            return
+        for (group, _), tree in self._trees.items():
+            if keep_group is None or group != keep_group:
+                tree.delete(start, stop)
+
+
+class MarkerMap(MutableMapping):
+    # dict of (x, y) positions, that follow edits of the buffer
+    # if gravity_by_key is given, other keys store plain values
+    # if group_by_key is set, every key is a group of its own marker
+
+    def __init__(
+        self,
+        buffer,
+        group=None,
+        gravity=RIGHT,
+        gravity_by_key=None,
+        group_by_key=False,
+    ):
+        self._buffer = buffer
+        self._group = group
+        self._group_by_key = group_by_key
+        self._gravity = gravity
+        self._gravity_by_key = gravity_by_key
+        self._markers = {}
+        self._values = {}
+
+    def _is_position(self, key):
+        return self._gravity_by_key is None or key in self._gravity_by_key
+
+    def __getitem__(self, key):
+        marker = self._markers.get(key)
+        if marker is None:
+            return self._values[key]
+        return self._buffer.pos_of(self._buffer.markers.offset(marker))
+
+    def __setitem__(self, key, value):
+        if value is None or not self._is_position(key):
+            self._remove_marker(key)
+            self._values[key] = value
+            return
+        self._values.pop(key, None)
+        offset = self._buffer.offset_of(value)
+        marker = self._markers.get(key)
+        if marker is not None:
+            self._buffer.markers.move(marker, offset)
+            return
+        gravity = (
+            self._gravity
+            if self._gravity_by_key is None
+            else self._gravity_by_key[key]
+        )
+        self._markers[key] = self._buffer.markers.add(
+            offset, gravity, key if self._group_by_key else self._group
+        )
+
+    def _remove_marker(self, key):
+        marker = self._markers.pop(key, None)
+        if marker is not None:
+            self._buffer.markers.remove(marker)
+
+    def __delitem__(self, key):
+        if key in self._markers:
+            self._remove_marker(key)
+        else:
+            del self._values[key]
+
+    def __iter__(self):
+        yield from list(self._markers)
+        yield from list(self._values)
+
+    def __len__(self):
+        return len(self._markers) + len(self._values)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+    # markers must be released, when map is not needed anymore
+    def release(self):
+        for key in list(self._markers):
+            self._remove_marker(key)
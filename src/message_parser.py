@@ -1,13 +1,27 @@
+from asyncio import Lock
+from codec import (
+    BATCHABLE_OPS,
+    BATCH_SEPARATOR,
+    FRAME_TAIL,
+    payload_text,
+    unescape_char,
+)
 from model import Model
 
 
 class MessageParser:
     _handler_func_by_arg: dict
+    _SNAPSHOT_OPS = ("-T", "-TC", "-TE")
 
     def __init__(self, model: Model, is_host_parser, username):
         self._model = model
         self._username = username
         self._is_host = is_host_parser
+        self._apply_m = Lock()
+        # version of snapshot being streamed, messages that came
+        # after its start are applied when it is complete
+        self._snapshot_version = None
+        self._buffered_args = []
         self._move_func_by_dir = {
             "l": self._model.user_pos_shifted_left,
             "r": self._model.user_pos_shifted_right,
@@ -24,6 +38,9 @@ class MessageParser:
             "-M": self._user_moved_cursor,
             "-MS": self._user_moved_cursor_shifted,
             "-T": self._upload_text,
+            "-TS": self._snapshot_started,
+            "-TC": self._snapshot_chunk,
+            "-TE": self._snapshot_ended,
             "-E": self._user_wrote_char,
             "-D": self._user_deleted_char,
             "-DC": self._user_disconnected,
@@ -33,6 +50,8 @@ class MessageParser:
             "-CUT": self._user_cut,
             "-UNDO": self._user_undo,
             "-REDO": self._user_redo,
+            "-B": self._user_batch,
+            "-U": self._users_updated,
         }
 
     async def _user_connected(self, args):
@@ -45,9 +64,7 @@ class MessageParser:
         await self._shifted_move_func_by_dir[args[2]](args[0])
 
     async def _user_wrote_char(self, args):
-        await self._model.user_wrote_char(
-            args[0], args[2] if args[2] != "/s" else " "
-        )
+        await self._model.user_wrote_char(args[0], unescape_char(args[2]))
 
     async def _user_deleted_char(self, args):
         await self._model.user_deleted_char(args[0])
@@ -69,11 +86,43 @@ class MessageParser:
                 args[i], int(args[i + 1]), int(args[i + 2])
             )
 
+    # host resyncs slow client with users and full text again,
+    # this client is in the list too by then
+    async def _users_updated(self, args):
+        for i in range(2, len(args) - 2, 3):
+            if args[i] not in self._model.users:
+                await self._model.add_user(args[i])
+            await self._model.user_pos_update(
+                args[i], int(args[i + 1]), int(args[i + 2])
+            )
+
+    # full snapshot replaces unfinished stream with everything buffered
     async def _upload_text(self, args):
-        await self._model.text_upload(" ".join(args[2:-1]))
+        self._snapshot_version = None
+        self._buffered_args = []
+        await self._model.text_upload(payload_text(args))
+
+    async def _snapshot_started(self, args):
+        self._snapshot_version = args[2]
+        self._buffered_args = []
+        await self._model.text_upload("", finished=False)
+
+    async def _snapshot_chunk(self, args):
+        if self._snapshot_version is None:
+            return
+        await self._model.text_upload_chunk(payload_text(args))
+
+    async def _snapshot_ended(self, args):
+        if self._snapshot_version != args[2]:
+            return
+        self._snapshot_version = None
+        await self._model.text_upload_chunk("", finished=True)
+        buffered, self._buffered_args = self._buffered_args, []
+        for buffered_args in buffered:
+            await self._parse_message(buffered_args)
 
     async def _user_pasted(self, args):
-        await self._model.paste(args[0], " ".join(args[2:-1]))
+        await self._model.paste(args[0], payload_text(args))
 
     async def _user_cut(self, args):
         await self._model.cut(args[0])
@@ -84,10 +133,33 @@ class MessageParser:
     async def _user_redo(self, args):
         await self._model.redo(args[0])
 
+    async def _user_batch(self, args):
+        payload = args[2:-1] if args[-1] == FRAME_TAIL else args[2:]
+        op_args = []
+        for arg in payload + [BATCH_SEPARATOR]:
+            if arg != BATCH_SEPARATOR:
+                op_args.append(arg)
+                continue
+            if op_args and op_args[0] in BATCHABLE_OPS:
+                await self._handler_func_by_arg[op_args[0]](
+                    [args[0], *op_args, FRAME_TAIL]
+                )
+            op_args = []
+
     async def parse_message(self, args):
+        async with self._apply_m:
+            await self._parse_message(args)
+
+    async def _parse_message(self, args):
         if args[1] == "-U" and not hasattr(self, "_initialized"):
             await self._upload_meta_info(args)
             return
+        if (
+            self._snapshot_version is not None
+            and args[1] not in self._SNAPSHOT_OPS
+        ):
+            self._buffered_args.append(args)
+            return
         if args[1] == "-C" and args[0] not in self._model.users:
             await self._user_connected(args)
             return
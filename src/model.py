@@ -1,42 +1,94 @@
+import asyncio
 from asyncio import Lock
+from collections import deque
 from functools import wraps
-import time
 from history_handler import HistoryHandler
-from view import View
+from markers import LEFT, RIGHT, MarkerMap
+from text_buffer import RopeTextBuffer
 
 
 class Model:
-    def __init__(self, text: str, owner_username, file_path=None):
+    # view is redrawn on change signal,
+    # frames are drawn at most this often, changes between are joined
+    _FRAME_INTERVAL = 1 / 30
+    # positions in undo kwargs are markers of frame owner group,
+    # they follow edits of everyone else, paste end stays before
+    # text inserted right after it
+    _FRAME_POS_GRAVITY = {
+        "user_pos": RIGHT,
+        "shifted_pos": RIGHT,
+        "new_pos": LEFT,
+        "line_cut_pos": RIGHT,
+    }
+
+    def __init__(
+        self,
+        text: str,
+        owner_username,
+        file_path=None,
+        buffer_cls=RopeTextBuffer,
+        max_undo_depth=1000,
+    ):
+        self.text_lines = buffer_cls(text)
         self.users: list = list()
-        self.user_positions: dict = {}
-        self.shift_user_positions: dict = {}
+        # cursors are markers, so every edit moves them in one place,
+        # cursor of the editing user is set by the edit itself
+        self.user_positions = MarkerMap(self.text_lines, group_by_key=True)
+        self.shift_user_positions = MarkerMap(
+            self.text_lines, group_by_key=True
+        )
+        # positions from -U message can be ahead of uploaded text
+        self._uploaded_positions = {}
         self._text_m = Lock()
         self._users_m = Lock()
         self._users_pos_m = Lock()
         self._buffer = ""
         self._action_stack_m = Lock()
+        # oldest frames are forgotten when stack is full
+        self._max_undo_depth = max_undo_depth
+        # counts edits of all users, consecutive chars are grouped
+        # into one action frame only if nobody edited in between
+        self._edit_seq = 0
 
-        # each stack stores (undo_func: couritine, undo_kwargs: dict,
-        #  redo_func: courutine, redo_args: list)
+        # each stack stores (undo_func: couritine, undo_kwargs: MarkerMap,
+        #  redo_func: courutine, redo_args: list, edit_seq: int)
 
         self._action_stack_by_user = {}
-        # each stack stores (redo_func: courutine, redo_args: list)
+        # each stack stores (redo_func: courutine, undo_kwargs: MarkerMap,
+        #  redo_args: list), positions are taken from undo_kwargs
         # redo_func must crate new action frame for action stack
         self._reverted_action_stack_by_user = {}
         self._stop = False
+        # set when anything visible changed, render_view waits for it
+        self._changed = asyncio.Event()
+        # shown in title bar
+        self.status = None
         self._owner_username = owner_username
         self._file_path = file_path
         self.users.append(owner_username)
         self.user_positions[owner_username] = (0, 0)
-        self._action_stack_by_user[owner_username] = []
-        self._reverted_action_stack_by_user[owner_username] = []
-        self.text_lines = text.splitlines()
+        self._action_stack_by_user[owner_username] = deque()
+        self._reverted_action_stack_by_user[owner_username] = deque()
         self._history_handler = HistoryHandler(file_path)
-        if text == "":
-            self.text_lines = [""]
         if file_path:
             self._history_handler.load_blame(self.text_lines, owner_username)
 
+    def _signal_change(self):
+        self._changed.set()
+
+    def set_status(self, status):
+        self.status = status
+        self._signal_change()
+
+    def _signals_view(func):
+        @wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            result = await func(self, *args, **kwargs)
+            self._signal_change()
+            return result
+
+        return wrapper
+
     async def get_user_pos(self, username):
         async with self._users_pos_m:
             return self.user_positions[username]
@@ -45,25 +97,150 @@ class Model:
         async with self._text_m:
             await self._history_handler.save_file(self.text_lines)
 
+    @_signals_view
     async def user_disconnected(self, username):
         async with self._users_m, self._users_pos_m:
             self.users.remove(username)
             self.user_positions.pop(username)
-            self._action_stack_by_user.pop(username)
-            self._reverted_action_stack_by_user.pop(username)
+            self._clear_frames(self._action_stack_by_user.pop(username))
+            self._clear_frames(
+                self._reverted_action_stack_by_user.pop(username))
             if username in self.shift_user_positions:
                 self.shift_user_positions.pop(username)
 
-    async def text_upload(self, text: str):
+    @_signals_view
+    async def text_upload(self, text: str, finished=True):
+        async with self._text_m:
+            self.text_lines.set_text(text)
+        await self._restore_uploaded_positions(finished)
+
+    # streamed snapshot is appended chunk by chunk,
+    # so the text is shown before it is fully received
+    @_signals_view
+    async def text_upload_chunk(self, text: str, finished=False):
+        # appended text must not push cursors standing at its end
+        async with self._users_pos_m:
+            positions = dict(self.user_positions)
         async with self._text_m:
-            self.text_lines = text.splitlines()
+            y = len(self.text_lines) - 1
+            self.text_lines.insert_text((len(self.text_lines[y]), y), text)
+        async with self._users_pos_m:
+            for username, pos in positions.items():
+                self.user_positions[username] = pos
+        await self._restore_uploaded_positions(finished)
+
+    # everything journal needs to resume the document after crash
+    def journal_state(self):
+        return {
+            "text": self.text_lines.get_text(),
+            "users": [
+                [username, list(self.user_positions[username]),
+                 list(self.shift_user_positions[username])
+                 if username in self.shift_user_positions else None]
+                for username in self.users
+            ],
+            "history": self._history_handler.journal_state(),
+            # undo and redo replayed after snapshot need the frames
+            "undo": {
+                username: [
+                    [undo_func.__name__, self._frame_kwargs_state(kwargs),
+                     redo_func.__name__, list(redo_args[1:]), seq]
+                    for undo_func, kwargs, redo_func, redo_args, seq in stack
+                ]
+                for username, stack in self._action_stack_by_user.items()
+            },
+            "redo": {
+                username: [
+                    [redo_func.__name__, self._frame_kwargs_state(kwargs),
+                     list(redo_args[1:])]
+                    for redo_func, kwargs, redo_args in stack
+                ]
+                for username, stack in
+                self._reverted_action_stack_by_user.items()
+            },
+            "edit_seq": self._edit_seq,
+        }
+
+    async def restore_journal_state(self, state):
+        await self.text_upload(state["text"])
+        for username, pos, shifted_pos in state["users"]:
+            if username not in self.users:
+                await self.add_user(username)
+            async with self._users_pos_m:
+                self.user_positions[username] = tuple(pos)
+                if shifted_pos is not None:
+                    self.shift_user_positions[username] = tuple(shifted_pos)
+        self._history_handler.restore_journal_state(state["history"])
+        async with self._action_stack_m:
+            for username, frames in state.get("undo", {}).items():
+                stack = self._action_stack_by_user[username]
+                self._clear_frames(stack)
+                for undo_name, kwargs, redo_name, redo_args, seq in frames:
+                    stack.append([
+                        getattr(Model, undo_name),
+                        self._restore_frame_kwargs(kwargs),
+                        getattr(Model, redo_name),
+                        self._restore_redo_args(redo_args),
+                        seq,
+                    ])
+            for username, frames in state.get("redo", {}).items():
+                stack = self._reverted_action_stack_by_user[username]
+                self._clear_frames(stack)
+                for redo_name, kwargs, redo_args in frames:
+                    stack.append([
+                        getattr(Model, redo_name),
+                        self._restore_frame_kwargs(kwargs),
+                        self._restore_redo_args(redo_args),
+                    ])
+        self._edit_seq = state.get("edit_seq", self._edit_seq)
+
+    def _frame_kwargs_state(self, kwargs):
+        state = {key: value for key, value in kwargs.items()
+                 if key != "self"}
+        if "parts" in state:
+            state["parts"] = [
+                self._frame_kwargs_state(part) for part in state["parts"]]
+        return state
+
+    # positions become markers again, so they follow replayed edits
+    def _restore_frame_kwargs(self, state):
+        kwargs = self._new_frame_kwargs(state["username"])
+        kwargs["self"] = self
+        for key, value in state.items():
+            if key in self._FRAME_POS_GRAVITY and value is not None:
+                value = tuple(value)
+            elif key == "parts":
+                value = [self._restore_frame_kwargs(part) for part in value]
+            kwargs[key] = value
+        return kwargs
+
+    def _restore_redo_args(self, args):
+        username, user_pos, shifted_pos, *rest = args
+        return (
+            self,
+            username,
+            tuple(user_pos),
+            tuple(shifted_pos) if shifted_pos is not None else None,
+            *rest,
+        )
+
+    async def _restore_uploaded_positions(self, finished):
+        async with self._users_pos_m:
+            for username, pos in self._uploaded_positions.items():
+                if username in self.user_positions:
+                    self.user_positions[username] = pos
+            if finished:
+                self._uploaded_positions.clear()
 
+    @_signals_view
     async def user_pos_update(self, username, new_x, new_y):
         async with self._users_pos_m:
             self.user_positions[username] = (new_x, new_y)
+            self._uploaded_positions[username] = (new_x, new_y)
 
     async def stop_view(self):
         self._stop = True
+        self._signal_change()
 
     async def _get_correct_top_bot_orientation(self, pos1, pos2):
         if pos2[1] < pos1[1] or pos2[1] == pos1[1] and pos2[0] < pos1[0]:
@@ -77,213 +254,31 @@ class Model:
         bot = self.shift_user_positions[username]
         return await self._get_correct_top_bot_orientation(top, bot)
 
-    async def _cut_selected_text(self, top, bot):
-        top, bot = await self._get_correct_top_bot_orientation(top, bot)
-        bot_x, bot_y = bot
-        top_x, top_y = top
+    # markers of username frames keep their place on his own edits,
+    # his later edits are reverted before these frames are used
+    async def _cut_selected_text(self, top, bot, username=None):
         async with self._text_m:
-            if bot_y == top_y:
-                self.text_lines[bot_y] = (
-                    self.text_lines[bot_y][:top_x]
-                    + self.text_lines[bot_y][bot_x:]
-                )
-            else:
-                self.text_lines[top_y] = (
-                    self.text_lines[top_y][:top_x]
-                    + self.text_lines[bot_y][bot_x:]
-                )
-                self.text_lines.pop(bot_y)
-            for y in range(bot_y - 1, top_y, -1):
-                self.text_lines.pop(y)
-
-    async def _correct_all_frames_and_pos_on_cut(self, username, top, bot):
-        for user in self.users:
-            if user == username:
-                continue
-            for frame in self._action_stack_by_user[user]:
-                await self._correct_undo_frame_on_cut(frame, top, bot)
-            for frame in self._reverted_action_stack_by_user[user]:
-                await self._correct_redo_frame_on_cut(frame, top, bot)
-            await self._correct_pos_on_cut(user, top, bot)
-
-    async def _make_pos_correct_after_cut(
-        self, top, bot, pos, shifted_pos=None
-    ):
-        if await self._is_pos_in_range(pos, top, bot):
-            pos = top
-        if pos[1] > bot[1]:
-            pos = (pos[0], pos[1] - (bot[1] - top[1]))
-        if pos[1] == bot[1] and pos[0] >= bot[0]:
-            pos = (pos[0] - (bot[0] - top[0]), top[1])
-        if shifted_pos:
-            if await self._is_pos_in_range(shifted_pos, top, bot):
-                shifted_pos = top
-            if shifted_pos[1] > bot[1]:
-                shifted_pos = (
-                    shifted_pos[0],
-                    shifted_pos[1] - (bot[1] - top[1]),
-                )
-            if shifted_pos[1] == bot[1] and shifted_pos[0] >= bot[0]:
-                shifted_pos = (shifted_pos[0] - (bot[0] - top[0]), top[1])
-        return (pos, shifted_pos)
-
-    async def _correct_pos_on_cut(self, username_to_correct, top, bot):
-        user_pos = self.user_positions[username_to_correct]
-        user_shifted_pos = self.shift_user_positions.get(username_to_correct)
-        new_pos = await self._make_pos_correct_after_cut(
-            top, bot, user_pos, user_shifted_pos
-        )
-        await self._set_user_pos(username_to_correct, *new_pos)
-
-    async def _correct_redo_frame_on_cut(self, frame, top, bot):
-        s, frame_username, frame_pos, frame_shifted_pos, *rest = frame[1]
-        new_pos = await self._make_pos_correct_after_cut(
-            top, bot, frame_pos, frame_shifted_pos
-        )
-        frame[1] = [s, frame_username, new_pos[0], new_pos[1]]
-
-    async def _correct_undo_frame_on_cut(self, frame, top, bot):
-        undo_func, undo_kwargs, redo_func, redo_args = frame
-        frame_pos = undo_kwargs["user_pos"]
-        frame_shifted_pos = undo_kwargs.get("shifted_pos")
-        new_pos = await self._make_pos_correct_after_cut(
-            top, bot, frame_pos, frame_shifted_pos
-        )
-        undo_kwargs["user_pos"] = new_pos[0]
-        undo_kwargs["shifted_pos"] = new_pos[1]
-        frame[3] = (redo_args[0], redo_args[1], new_pos[0], new_pos[1])
+            self.text_lines.delete_range(top, bot, username)
 
     async def _get_range(self, top, bot):
-        if bot[1] < top[1] or bot[1] == top[1] and bot[0] < top[0]:
-            t = top
-            top = bot
-            bot = t
-        top_x, top_y = top
-        bot_x, bot_y = bot
-        if bot_y == top_y:
-            return self.text_lines[bot_y][top_x:bot_x]
-        t = (
-            ""
-            if bot_y - top_y <= 1
-            else "\n".join(self.text_lines[top_y + 1: bot_y]) + "\n"
-        )
-        return (
-            self.text_lines[top_y][top_x:]
-            + "\n"
-            + t
-            + self.text_lines[bot_y][:bot_x]
-        )
+        return self.text_lines.get_range(top, bot)
 
-    async def _is_pos_in_range(self, pos, top, bot):
-        return (
-            top[1] < pos[1]
-            and pos[1] < bot[1]
-            or top[1] == pos[1]
-            and top[0] < pos[0]
-            and (bot[1] > pos[1] or bot[1] == pos[1] and pos[0] < bot[0])
-            or bot[1] == pos[1]
-            and bot[0] > pos[0]
-            and (top[1] < pos[1] or top[1] == pos[1] and top[0] < pos[0])
-        )
-
-    async def _get_bot_pos_on_insert(self, pos, text):
-        lines = text.split("\n")
-        moved_x, moved_y = pos
-        moved_x += len(lines[0])
-        if len(lines) != 1:
-            moved_x = len(lines[-1])
-        moved_y += len(lines) - 1
-        return (moved_x, moved_y)
-
-    async def _insert(self, text, pos):
-        lines_to_paste = text.split("\n")
-        user_x, user_y = pos
-        moved_user_x, moved_user_y = pos
-        moved_user_x += len(lines_to_paste[0])
-        if len(lines_to_paste) != 1:
-            moved_user_x = len(lines_to_paste[-1])
-        lines_to_paste[-1] = (
-            lines_to_paste[-1] + self.text_lines[user_y][user_x:]
-        )
+    async def _insert(self, text, pos, username=None):
         async with self._text_m:
-            self.text_lines[user_y] = (
-                self.text_lines[user_y][:user_x] + lines_to_paste[0]
-            )
-            for i in range(1, len(lines_to_paste)):
-                user_y += 1
-                self.text_lines.insert(user_y, lines_to_paste[i])
-        moved_user_y = user_y
-        return (moved_user_x, moved_user_y)
-
-    async def _make_pos_correct_on_insert(
-        self, action_top, action_bot, pos, shifted_pos=None
-    ):
-        if shifted_pos:
-            if (
-                shifted_pos[1] == action_top[1]
-                and shifted_pos[0] >= action_top[0]
-            ):
-                shifted_pos = (
-                    shifted_pos[0] + action_bot[0] - action_top[0],
-                    shifted_pos[1] + action_bot[1] - action_top[1],
-                )
-            elif shifted_pos[1] > action_top[1]:
-                shifted_pos = (
-                    shifted_pos[0],
-                    shifted_pos[1] + action_bot[1] - action_top[1],
-                )
-        if pos[1] == action_top[1] and pos[0] >= action_top[0]:
-            pos = (
-                pos[0] + action_bot[0] - action_top[0],
-                pos[1] + action_bot[1] - action_top[1],
-            )
-        elif pos[1] > action_top[1]:
-            pos = (pos[0], pos[1] + action_bot[1] - action_top[1])
-        return (pos, shifted_pos)
+            return self.text_lines.insert_text(pos, text, username)
 
-    async def _correct_redo_frame_on_insert(
-        self, frame, action_top, action_bot
-    ):
-        s, frame_username, frame_pos, frame_shifted_pos = frame[1]
-        new_pos = await self._make_pos_correct_on_insert(
-            action_top, action_bot, frame_pos, frame_shifted_pos
-        )
-        frame[1] = [s, frame_username, new_pos[0], new_pos[1]]
+    # undo is not an op of changes log, but versions of session
+    # go through it
+    async def _undo_cut(self, top, bot, username):
+        await self._history_handler.undo_cut_save_version(
+            username, self.text_lines, top, bot)
+        await self._cut_selected_text(top, bot, username)
 
-    async def _correct_undo_frame_on_insert(
-        self, frame, action_top, action_bot
-    ):
-        undo_func, undo_kwargs, redo_func, redo_args = frame
-        frame_pos = undo_kwargs["user_pos"]
-        frame_shifted_pos = undo_kwargs.get("shifted_pos")
-        new_pos = await self._make_pos_correct_on_insert(
-            action_top, action_bot, frame_pos, frame_shifted_pos
-        )
-        undo_kwargs["user_pos"] = new_pos[0]
-        undo_kwargs["shifted_pos"] = new_pos[1]
-        frame[3] = (redo_args[0], redo_args[1], new_pos[0], new_pos[1])
-
-    async def _correct_all_frames_and_pos_on_insert(
-        self, username, text_top, text_bot
-    ):
-        for user in self.users:
-            if user == username:
-                continue
-            for frame in self._action_stack_by_user[user]:
-                await self._correct_undo_frame_on_insert(
-                    frame, text_top, text_bot
-                )
-            for frame in self._reverted_action_stack_by_user[user]:
-                await self._correct_redo_frame_on_insert(
-                    frame, text_top, text_bot
-                )
-            new_pos = await self._make_pos_correct_on_insert(
-                text_top,
-                text_bot,
-                self.user_positions[user],
-                self.shift_user_positions.get(user),
-            )
-            await self._set_user_pos(user, *new_pos)
+    async def _undo_insert(self, text, pos, username):
+        new_pos = await self._insert(text, pos, username)
+        await self._history_handler.undo_insert_save_version(
+            username, pos, new_pos)
+        return new_pos
 
     async def _set_user_pos(self, username, user_pos, shifted_pos=None):
         async with self._users_pos_m:
@@ -291,12 +286,38 @@ class Model:
             if shifted_pos:
                 self.shift_user_positions[username] = shifted_pos
 
+    def _new_frame_kwargs(self, username):
+        return MarkerMap(
+            self.text_lines,
+            username,
+            gravity_by_key=self._FRAME_POS_GRAVITY,
+        )
+
+    # oldest frame is forgotten, when stack is full
+    def _push_frame(self, stack, frame):
+        if len(stack) >= self._max_undo_depth:
+            self._release_frame_kwargs(stack.popleft()[1])
+        stack.append(frame)
+
+    def _clear_frames(self, stack):
+        for frame in stack:
+            self._release_frame_kwargs(frame[1])
+        stack.clear()
+
+    # chars merged into word keep markers of their own frames
+    def _release_frame_kwargs(self, kwargs):
+        for part in kwargs.get("parts", ()):
+            part.release()
+        kwargs.release()
+
     async def _append_to_action_stack(
         self, username, undo_func, undo_kwargs, redo_func, redo_kwargs
     ):
         async with self._action_stack_m:
-            self._action_stack_by_user[username].append(
-                [undo_func, undo_kwargs, redo_func, redo_kwargs]
+            self._push_frame(
+                self._action_stack_by_user[username],
+                [undo_func, undo_kwargs, redo_func, redo_kwargs,
+                 self._edit_seq]
             )
 
     async def _undo_selected_cut(
@@ -314,25 +335,38 @@ class Model:
             t = bot
             bot = top
             top = t
-        await self._insert(text_cut, top)
+        await self._undo_insert(text_cut, top, username)
 
-    def run_view(self, stdscr):
+    # view is imported only here, headless host never loads curses
+    # view is drawn in the loop thread between edits,
+    # so it never sees half applied one
+    async def render_view(self, stdscr):
+        from view import View
         self.view = View(stdscr, self._owner_username)
         while not self._stop:
+            self._changed.clear()
             self.view.draw_text(
                 self.text_lines,
                 self.user_positions,
                 self.users,
                 self.shift_user_positions,
+                dirty=self.text_lines.take_dirty(),
+                status=self.status,
             )
-            time.sleep(0.05)
+            await asyncio.sleep(self._FRAME_INTERVAL)
+            await self._changed.wait()
+
+    # terminal was resized
+    def redraw(self):
+        self._signal_change()
 
+    @_signals_view
     async def add_user(self, username):
         async with self._users_m, self._users_pos_m:
             self.users.append(username)
             self.user_positions[username] = (0, 0)
-            self._action_stack_by_user[username] = []
-            self._reverted_action_stack_by_user[username] = []
+            self._action_stack_by_user[username] = deque()
+            self._reverted_action_stack_by_user[username] = deque()
 
     async def _restore_user_pos(
         self, username, direction, user_pos_sh, user_pos
@@ -407,109 +441,24 @@ class Model:
 
         return dec
 
-    async def _correct_user_pos(
-        self, username_to_correct, username, pos_correction_func, args
-    ):
-        new_pos = await pos_correction_func(
-            self,
-            self.user_positions[username],
-            self.user_positions[username_to_correct],
-            self.shift_user_positions.get(username_to_correct),
-            args,
-        )
-        await self._set_user_pos(username_to_correct, *new_pos)
-
-    async def _correct_redo_frame(
-        self, frame, action_pos, pos_correction_func, args
-    ):
-        s, frame_username, frame_pos, frame_shifted_pos = frame[1]
-        new_pos = await pos_correction_func(
-            self, action_pos, frame_pos, frame_shifted_pos, args
-        )
-        frame[1] = [s, frame_username, new_pos[0], new_pos[1]]
-
-    async def _correct_undo_frame(
-        self, username, pos_correction_func, frame, args
-    ):
-        undo_kwargs = frame[1]
-        redo_args = frame[3]
-        frame_pos = undo_kwargs["user_pos"]
-        frame_shifted_pos = undo_kwargs["shifted_pos"]
-        new_pos = await pos_correction_func(
-            self,
-            self.user_positions[username],
-            frame_pos,
-            frame_shifted_pos,
-            args,
-        )
-        undo_kwargs["user_pos"] = new_pos[0]
-        undo_kwargs["shifted_pos"] = new_pos[1]
-        frame[3] = (redo_args[0], redo_args[1], new_pos[0], new_pos[1])
-
-    async def _correct_frames_and_posision(
-        self, username, pos_correction_func, action_pos, args
-    ):
-        for user in self.users:
-            if user == username:
-                continue
-            for frame in self._action_stack_by_user[user]:
-                await self._correct_undo_frame(
-                    username, pos_correction_func, frame, args
-                )
-            for frame in self._reverted_action_stack_by_user[user]:
-                await self._correct_redo_frame(
-                    frame, action_pos, pos_correction_func, args
-                )
-            await self._correct_user_pos(
-                user, username, pos_correction_func, args
-            )
-
-    async def _correct_frames_and_posisitions_shifted(
-        self, username, pos_correction_func, action_top, action_bot, args
-    ):
-        for user in self.users:
-            if user == username:
-                continue
-            for frame in self._action_stack_by_user[user]:
-                await self._correct_undo_frame_on_cut(
-                    frame, action_top, action_bot
-                )
-                await self._correct_undo_frame(
-                    username, pos_correction_func, frame, args
-                )
-            for frame in self._reverted_action_stack_by_user[user]:
-                await self._correct_redo_frame_on_cut(
-                    frame, action_top, action_bot
-                )
-                await self._correct_redo_frame(
-                    frame, action_top, pos_correction_func, args
-                )
-            await self._correct_pos_on_cut(user, action_top, action_bot)
-            await self._correct_user_pos(
-                user, username, pos_correction_func, args
-            )
-
     # all functions using this decorator,
     # must have this arguments in specified order:
     # self, username, user_pos,
     #  shifted_pos for making correct action frames
-    # pos_correction func must take
-    # (self, action_pos: tuple, pos: tuple, shifted_pos: tuple, args: list)
-    def _handle_edit_decorator(undo_func, redo_func_name, pos_correction_func):
+    # positions of other users and their frames are markers,
+    # that follow the edit by themselves
+    def _handle_edit_decorator(undo_func, redo_func_name):
         def dec(func):
             @wraps(func)
             async def wrapper(*args):
                 self, username, user_pos, shifted_pos, *rest = args
-                undo_kwargs = {
-                    "username": username,
-                    "user_pos": user_pos,
-                    "self": self,
-                }
+                self._edit_seq += 1
+                undo_kwargs = self._new_frame_kwargs(username)
+                undo_kwargs["username"] = username
+                undo_kwargs["user_pos"] = user_pos
+                undo_kwargs["self"] = self
                 undo_kwargs["op_cnt"] = self._history_handler._op_cnt + 1
                 if not shifted_pos:
-                    await self._correct_frames_and_posision(
-                        username, pos_correction_func, user_pos, args
-                    )
                     await self._append_to_action_stack(
                         username,
                         undo_func,
@@ -534,10 +483,7 @@ class Model:
                     getattr(Model, redo_func_name),
                     args,
                 )
-                await self._cut_selected_text(top, bot)
-                await self._correct_frames_and_posisitions_shifted(
-                    username, pos_correction_func, top, bot, args
-                )
+                await self._cut_selected_text(top, bot, username)
                 async with self._users_pos_m:
                     if username in self.shift_user_positions:
                         self.shift_user_positions.pop(username)
@@ -552,7 +498,8 @@ class Model:
         async def wrapper(*args):
             self, username, *rest = args
             async with self._action_stack_m:
-                self._reverted_action_stack_by_user[username].clear()
+                self._clear_frames(
+                    self._reverted_action_stack_by_user[username])
             await func(*args)
 
         return wrapper
@@ -580,7 +527,7 @@ class Model:
                 and shifted_pos[0] < user_pos[0]
             ):
                 top = shifted_pos
-        await self._cut_selected_text(top, new_pos)
+        await self._undo_cut(top, new_pos, username)
         await self._history_handler.correct_history_on_undo_paste(
             username, op_cnt + 1 if shifted_pos else op_cnt
         )
@@ -588,31 +535,17 @@ class Model:
             await self._history_handler.correct_history_on_undo_cut(
                 username, op_cnt
             )
-        await self._correct_all_frames_and_pos_on_cut(username, top, new_pos)
         await self._undo_selected_cut(
             username, user_pos, shifted_pos, text_cut
         )
         await self._set_user_pos(username, user_pos, shifted_pos)
 
-    async def _make_pos_correct_after_paste(
-        self, action_pos, pos, shifted_pos, args
-    ):
-        text = args[4]
-        return await self._make_pos_correct_on_insert(
-            action_pos,
-            await self._get_bot_pos_on_insert(action_pos, text),
-            pos,
-            shifted_pos,
-        )
-
-    @_handle_edit_decorator(
-        _undo_paste, "_make_paste", _make_pos_correct_after_paste
-    )
+    @_handle_edit_decorator(_undo_paste, "_make_paste")
     async def _make_paste(
         self, username, user_pos, shifted_pos, text_to_paste
     ):
         new_pos = await self._insert(
-            text_to_paste, self.user_positions[username]
+            text_to_paste, self.user_positions[username], username
         )
         await self._history_handler.new_text_save_history(
             username, user_pos, new_pos
@@ -622,10 +555,11 @@ class Model:
         async with self._users_pos_m:
             self.user_positions[username] = new_pos
 
+    @_signals_view
     @_after_edit_corrector_decor
     async def paste(self, username, text_to_paste):
         async with self._action_stack_m:
-            self._reverted_action_stack_by_user[username].clear()
+            self._clear_frames(self._reverted_action_stack_by_user[username])
         user_pos = self.user_positions[username]
         shifted_pos = self.shift_user_positions.get(username, None)
         await self._make_paste(username, user_pos, shifted_pos, text_to_paste)
@@ -642,69 +576,97 @@ class Model:
             await self.copy_to_buffer()
         await self.user_deleted_char(username)
 
+    # grouped frame undoes every merged char by its own markers,
+    # so chars inserted inside the word by others are kept
     async def _undo_user_wrote_char(
-        self, username, user_pos, op_cnt, shifted_pos=None, text_cut=None
+        self,
+        username,
+        user_pos,
+        op_cnt,
+        new_pos,
+        shifted_pos=None,
+        text_cut=None,
+        ops=1,
+        parts=(),
     ):
-        top = user_pos
-        bot = await self._shift_pos_right(user_pos)
-        await self._cut_selected_text(top, bot)
-        await self._correct_all_frames_and_pos_on_cut(username, top, bot)
-        await self._history_handler.correct_history_on_undo_paste(
-            username, op_cnt
-        )
-        if shifted_pos:
-            top, bot = await self._get_correct_top_bot_orientation(
-                user_pos, shifted_pos
-            )
-            await self._correct_all_frames_and_pos_on_insert(
-                username, top, bot
+        # later chars first, cut does not move markers of the user
+        for part in reversed(parts):
+            await self._undo_cut(part["user_pos"], part["new_pos"], username)
+        await self._undo_cut(user_pos, new_pos, username)
+        for i in range(ops):
+            await self._history_handler.correct_history_on_undo_paste(
+                username, op_cnt + i
             )
         await self._undo_selected_cut(
             username, user_pos, shifted_pos, text_cut
         )
         await self._set_user_pos(username, user_pos, shifted_pos)
 
-    async def _make_pos_correct_after_write(
-        self, action_pos, pos, shifted_pos, args
-    ):
-        if shifted_pos:
-            if (
-                action_pos[1] == shifted_pos[1]
-                and action_pos[0] <= shifted_pos[0]
-            ):
-                shifted_pos = (shifted_pos[0] + 1, shifted_pos[1])
-        if action_pos[1] == pos[1] and action_pos[0] <= pos[0]:
-            pos = (pos[0] + 1, pos[1])
-        return (pos, shifted_pos)
-
-    @_handle_edit_decorator(
-        _undo_user_wrote_char,
-        "_make_write_char",
-        _make_pos_correct_after_write,
-    )
+    # char is a whole word, when grouped frame is redone
+    @_handle_edit_decorator(_undo_user_wrote_char, "_make_write_char")
     async def _make_write_char(self, username, user_pos, shifted_pos, char):
         user_x, user_y = user_pos
         await self._history_handler.new_text_save_history(
-            username, user_pos, await self._shift_pos_right(user_pos)
+            username,
+            user_pos,
+            (user_x + len(char), user_y)
+            if len(char) > 1
+            else await self._shift_pos_right(user_pos),
         )
         async with self._text_m:
             if user_y == len(self.text_lines):
                 self.text_lines.append(char)
+                new_pos = (len(char), user_y)
             else:
-                self.text_lines[user_y] = (
-                    self.text_lines[user_y][:user_x]
-                    + char
-                    + self.text_lines[user_y][user_x:]
-                )
-        await self.user_pos_shifted_right(username)
+                new_pos = self.text_lines.insert_text(
+                    user_pos, char, username)
+        async with self._action_stack_m:
+            self._action_stack_by_user[username][-1][1]["new_pos"] = new_pos
+        if len(char) == 1:
+            await self.user_pos_shifted_right(username)
+            return
+        user_x, user_y = self.user_positions[username]
+        await self._set_user_pos(username, (user_x + len(char), user_y))
 
+    # merges just written char into previous frame of the user,
+    # so undo reverts typed text word by word
+    async def _group_written_char(self, username):
+        async with self._action_stack_m:
+            stack = self._action_stack_by_user[username]
+            if len(stack) < 2:
+                return
+            prev, last = stack[-2], stack[-1]
+            if (
+                prev[0] is not Model._undo_user_wrote_char
+                or last[0] is not Model._undo_user_wrote_char
+            ):
+                return
+            prev_kwargs, last_kwargs = prev[1], last[1]
+            text, char = prev[3][4], last[3][4]
+            prev_x, prev_y = prev_kwargs["user_pos"]
+            if (
+                prev_kwargs.get("shifted_pos")
+                or last_kwargs.get("shifted_pos")
+                or last[4] != prev[4] + 1
+                or last_kwargs["user_pos"] != (prev_x + len(text), prev_y)
+                or text[-1].isspace() and not char.isspace()
+            ):
+                return
+            stack.pop()
+            prev_kwargs["parts"] = [*prev_kwargs.get("parts", ()), last_kwargs]
+            prev_kwargs["ops"] = prev_kwargs.get("ops", 1) + 1
+            prev[3] = (*prev[3][:4], text + char)
+            prev[4] = last[4]
+
+    @_signals_view
     @_after_edit_corrector_decor
     async def user_wrote_char(self, username, char):
         async with self._action_stack_m:
-            self._reverted_action_stack_by_user[username].clear()
+            self._clear_frames(self._reverted_action_stack_by_user[username])
         user_pos = self.user_positions[username]
         shifted_pos = self.shift_user_positions.get(username, None)
         await self._make_write_char(username, user_pos, shifted_pos, char)
+        await self._group_written_char(username)
 
     async def _shift_pos_left(self, user_pos):
         user_x, user_y = user_pos
@@ -744,18 +706,22 @@ class Model:
             user_x = min(user_x, len(self.text_lines[user_y]))
         return (user_x, user_y)
 
+    @_signals_view
     @_user_pos_shifted_decor(_shift_pos_left, "l")
     async def user_pos_shifted_left(self, username, user_shifted=False):
         pass
 
+    @_signals_view
     @_user_pos_shifted_decor(_shift_pos_right, "r")
     async def user_pos_shifted_right(self, username, user_shifted=False):
         pass
 
+    @_signals_view
     @_user_pos_shifted_decor(_shift_pos_down, "d")
     async def user_pos_shifted_down(self, username, user_shifted=False):
         pass
 
+    @_signals_view
     @_user_pos_shifted_decor(_shift_pos_up, "u")
     async def user_pos_shifted_up(self, username, user_shifted=False):
         pass
@@ -784,69 +750,18 @@ class Model:
         await self._undo_selected_cut(
             username, user_pos, shifted_pos, text_cut
         )
-        if shifted_pos:
-            top, bot = await self._get_correct_top_bot_orientation(
-                user_pos, shifted_pos
-            )
-            await self._correct_all_frames_and_pos_on_insert(
-                username, top, bot
-            )
-        else:
+        if not shifted_pos:
             if text_cut == "\n":
-                top = line_cut_pos
-                bot = await self._get_bot_pos_on_insert(line_cut_pos, "\n")
-                await self._insert(text_cut, line_cut_pos)
-                await self._correct_all_frames_and_pos_on_insert(
-                    username, top, bot
-                )
+                await self._undo_insert(text_cut, line_cut_pos, username)
             else:
                 top = await self._shift_pos_left(user_pos)
-                bot = user_pos
-                await self._insert(text_cut, top)
-                await self._correct_all_frames_and_pos_on_insert(
-                    username, top, bot
-                )
+                await self._undo_insert(text_cut, top, username)
         await self._history_handler.correct_history_on_undo_cut(
             username, op_cnt
         )
         await self._set_user_pos(username, user_pos, shifted_pos)
 
-    async def _make_pos_correct_after_del(
-        self, action_pos, user_pos, shifted_pos, args
-    ):
-        if args[3]:
-            return (user_pos, shifted_pos)
-        if shifted_pos:
-            if action_pos[0] == 0 and action_pos[1] > 0:
-                if action_pos[1] < shifted_pos[1]:
-                    shifted_pos = (shifted_pos[0], shifted_pos[1] - 1)
-                elif action_pos[1] == shifted_pos[1]:
-                    shifted_pos = (
-                        len(self.text_lines[action_pos[1] - 1])
-                        + shifted_pos[0],
-                        shifted_pos[1] - 1,
-                    )
-            elif (
-                action_pos[1] == shifted_pos[1]
-                and shifted_pos[0] >= action_pos[0]
-            ):
-                shifted_pos = await self._shift_pos_left(shifted_pos)
-            pass
-        if action_pos[0] == 0 and action_pos[1] > 0:
-            if action_pos[1] < user_pos[1]:
-                user_pos = (user_pos[0], user_pos[1] - 1)
-            elif action_pos[1] == user_pos[1]:
-                user_pos = (
-                    len(self.text_lines[action_pos[1] - 1]) + user_pos[0],
-                    user_pos[1] - 1,
-                )
-        elif action_pos[1] == user_pos[1] and user_pos[0] >= action_pos[0]:
-            user_pos = await self._shift_pos_left(user_pos)
-        return (user_pos, shifted_pos)
-
-    @_handle_edit_decorator(
-        _undo_delete_char, "_make_delete_char", _make_pos_correct_after_del
-    )
+    @_handle_edit_decorator(_undo_delete_char, "_make_delete_char")
     async def _make_delete_char(self, username, user_pos, shifted_pos):
         if shifted_pos:
             return
@@ -871,25 +786,27 @@ class Model:
                 return
             user_x = len(self.text_lines[user_y - 1])
             async with self._text_m:
-                self.text_lines[user_y - 1] += self.text_lines.pop(user_y)
+                self.text_lines.delete_range(
+                    (user_x, user_y - 1), user_pos, username
+                )
             user_y -= 1
             async with self._users_pos_m:
                 self.user_positions[username] = (user_x, user_y)
             return
         else:
             async with self._text_m:
-                self.text_lines[user_y] = (
-                    self.text_lines[user_y][: user_x - 1]
-                    + self.text_lines[user_y][user_x:]
+                self.text_lines.delete_range(
+                    (user_x - 1, user_y), user_pos, username
                 )
         await self._set_user_pos(
             username, await self._shift_pos_left(user_pos)
         )
 
+    @_signals_view
     @_after_edit_corrector_decor
     async def user_deleted_char(self, username):
         async with self._action_stack_m:
-            self._reverted_action_stack_by_user[username].clear()
+            self._clear_frames(self._reverted_action_stack_by_user[username])
         await self._make_delete_char(
             username,
             self.user_positions[username],
@@ -905,18 +822,11 @@ class Model:
     ):
         top = user_pos
         bot = (0, user_pos[1] + 1)
-        await self._cut_selected_text(top, bot)
+        await self._undo_cut(top, bot, username)
         await self._history_handler.correct_history_on_undo_cut(
             username, op_cnt + 1 if shifted_pos else op_cnt
         )
-        await self._correct_all_frames_and_pos_on_cut(username, top, bot)
         if shifted_pos:
-            top, bot = await self._get_correct_top_bot_orientation(
-                user_pos, shifted_pos
-            )
-            await self._correct_all_frames_and_pos_on_insert(
-                username, top, bot
-            )
             await self._history_handler.correct_history_on_undo_cut(
                 username, op_cnt
             )
@@ -925,53 +835,18 @@ class Model:
         )
         await self._set_user_pos(username, user_pos, shifted_pos)
 
-    # returns (corrected_user_pos, corrected_user_shift_pos)
-
-    async def _make_pos_correct_after_new_line(
-        self, action_pos, user_pos, shifted_pos, args
-    ):
-        if shifted_pos:
-            top, bot = await self._get_correct_top_bot_orientation(
-                user_pos, shifted_pos
-            )
-            top_is_user_pos = top == user_pos
-            if action_pos[1] < top[1]:
-                top = (top[0], top[1] + 1)
-                bot = (bot[0], bot[1] + 1)
-            if action_pos[1] == top[1] and top[0] > action_pos[0]:
-                if bot[1] == top[1]:
-                    bot = (bot[0] - action_pos[0], bot[1] + 1)
-                else:
-                    bot = (bot[0], bot[1] + 1)
-                top = (top[0] - action_pos[0], top[1] + 1)
-            if await self._is_pos_in_range(action_pos, top, bot):
-                if bot[1] == action_pos[1]:
-                    bot = (bot[0] - action_pos[0], bot[1] + 1)
-                else:
-                    bot = (bot[0], bot[1] + 1)
-            return (top, bot) if top_is_user_pos else (bot, top)
-        if action_pos[1] < user_pos[1]:
-            user_pos = (user_pos[0], user_pos[1] + 1)
-        elif action_pos[1] == user_pos[1] and user_pos[0] > action_pos[0]:
-            user_pos = (user_pos[0] - action_pos[0], user_pos[1] + 1)
-        return (user_pos, shifted_pos)
-
-    @_handle_edit_decorator(
-        _undo_new_line, "_make_new_line", _make_pos_correct_after_new_line
-    )
+    @_handle_edit_decorator(_undo_new_line, "_make_new_line")
     async def _make_new_line(self, username, user_pos, shifted_pos):
-        user_x, user_y = user_pos
-        bot = (0, user_y + 1)
+        bot = (0, user_pos[1] + 1)
         await self._history_handler.new_text_save_history(
             username, user_pos, bot
         )
         async with self._text_m:
-            self.text_lines.insert(user_y, "")
-            self.text_lines[user_y] = self.text_lines[user_y + 1][:user_x]
-            self.text_lines[user_y + 1] = self.text_lines[user_y + 1][user_x:]
+            self.text_lines.insert_text(user_pos, "\n", username)
         async with self._users_pos_m:
             self.user_positions[username] = bot
 
+    @_signals_view
     @_after_edit_corrector_decor
     async def user_added_new_line(self, username):
         user_pos = self.user_positions[username]
@@ -981,26 +856,38 @@ class Model:
             shifted_pos = None
         await self._make_new_line(username, user_pos, shifted_pos)
 
+    @_signals_view
     async def undo(self, username):
         if len(self._action_stack_by_user[username]) == 0:
             return
+        self._edit_seq += 1
         async with self._action_stack_m:
-            revert_func, revert_kwargs, redo_func, redo_args = (
+            revert_func, revert_kwargs, redo_func, redo_args, _ = (
                 self._action_stack_by_user[username].pop()
             )
-            self._reverted_action_stack_by_user[username].append(
-                [redo_func, redo_args]
+            self._push_frame(
+                self._reverted_action_stack_by_user[username],
+                [redo_func, revert_kwargs, redo_args],
             )
         await revert_func(**revert_kwargs)
 
+    @_signals_view
     async def redo(self, username):
         if len(self._reverted_action_stack_by_user[username]) == 0:
             return
         async with self._action_stack_m:
-            redo_func, redo_args = self._reverted_action_stack_by_user[
+            redo_func, kwargs, redo_args = self._reverted_action_stack_by_user[
                 username
             ].pop()
-        await redo_func(*redo_args)
+        # positions of the frame could be moved by edits of other users
+        await redo_func(
+            redo_args[0],
+            redo_args[1],
+            kwargs["user_pos"],
+            kwargs.get("shifted_pos"),
+            *redo_args[4:],
+        )
+        self._release_frame_kwargs(kwargs)
 
     async def save_changes_history(self):
         if not self._file_path:
@@ -1,8 +1,30 @@
 import asyncio
+import concurrent.futures
 import curses
+import os
+import signal
+import sqlite3
+import sys
+import threading
+from collections import deque
+from client_writer import ClientWriter
+from codec import (
+    BATCHABLE_OPS,
+    CODECS,
+    DOCUMENT_PREFIX,
+    SNAPSHOT_CHUNKS,
+    TEXT_DELIMITER,
+    BinaryCodec,
+    TextCodec,
+    make_batch,
+    message_from_args,
+)
 from history_handler import HistoryHandler
+from history_retention import HistoryCompactor
+from journal import Journal
 from message_parser import MessageParser
 from model import Model
+from time_travel import CHECKPOINT_EVERY
 from convert import TextExporter
 
 
@@ -10,25 +32,72 @@ class MtTextEditApp():
     _model: Model
     _username: str
     _writer = None
-    _writers = []
-    _reader_to_writer = {}
-    _DELIMITER = b' \n\x1E'
+    _DELIMITER = TEXT_DELIMITER
     _PERMISSION_FILE_PATH = "/tmp/lib/mttext/permissions"
+    # put into send queue to wake producer up and let it finish
+    _STOP_MESSAGE = None
+    _STOP_FLUSH_TIMEOUT = 0.5
+    _MAX_BATCH_SIZE = 256
+    _SNAPSHOT_CHUNK_SIZE = 1 << 15
+    _HOST_ADDRESS = '127.0.0.1'
+    _PORT = 12000
+    # seconds without edits, after which host compacts history
+    _COMPACT_IDLE = 300
 
     def __init__(
         self,
         username: str,
         filetext: str = "",
         debug: bool = False,
-        file_path: str = None
+        file_path: str = None,
+        client_queue_size: int = 256,
+        client_queue_bytes: int = 8 << 20,
+        slow_client_policy: str = ClientWriter.RESYNC,
+        batch_window: float = 0.005,
+        binary_protocol: bool = True,
+        max_undo_depth: int = 1000,
+        document: str = None,
+        journal: bool = True,
+        history_policy=None
     ):
+        if slow_client_policy not in ClientWriter.POLICIES:
+            raise ValueError(
+                f"unknown slow client policy: {slow_client_policy}")
         self.debug = debug
-        self._model = Model(filetext, username, file_path)
+        self._client_queue_size = client_queue_size
+        self._client_queue_bytes = client_queue_bytes
+        self._slow_client_policy = slow_client_policy
+        self._batch_window = batch_window
+        self._binary_protocol = binary_protocol
+        # document to ask multi-document host for
+        self._document = document
+        self._writers = []
+        self._reader_to_writer = {}
+        # every connection starts with text protocol
+        self._codec = TextCodec()
+        self._model = Model(
+            filetext, username, file_path, max_undo_depth=max_undo_depth)
         self.history_handler = None
         self._file_path = file_path
         self._is_host = file_path is not None
+        # applied ops survive host crash, replayed on next start
+        self._journal = (
+            Journal(file_path, self._model)
+            if self._is_host and journal else None)
+        # old history of the document is compacted while host is idle
+        self._compactor = (
+            HistoryCompactor(history_policy)
+            if self._is_host and history_policy else None)
+        self._compact_task = None
         self._can_write = True
-        self._converter = TextExporter(self._model.text_lines)
+        # exports run in threads over snapshot of the text,
+        # format -> (lines written, lines in snapshot)
+        self._export_pool = None
+        self._export_tasks = {}
+        self._export_progress = {}
+        self._export_m = threading.Lock()
+        self._export_loop = None
+        self._render_task = None
         self._non_edit_func_by_key = {
             curses.KEY_LEFT: self._model.user_pos_shifted_left,
             curses.KEY_RIGHT: self._model.user_pos_shifted_right,
@@ -63,34 +132,104 @@ class MtTextEditApp():
             25: lambda x: f"{x} -REDO"  # CTRL + Y
         }
         self._func_by_special_key = {
-            19: self._model.save_file,  # CTRL + S
+            19: self.save_file,  # CTRL + S
             27: self.stop,  # ESC
             3: self._model.copy_to_buffer,  # CTRL + C
             22: self._model.paste_from_buffer,  # CTRL + V
             16: self.save_as_pdf,  # +p
             8: self.save_as_html,  # +h
-            4:  self.save_as_doc  # +d
+            4:  self.save_as_doc,  # +d
+            5: self.export_all  # CTRL + E
+        }
+        # history viewer steps through versions of the session
+        self._version_step_by_key = {
+            ord("["): -1,
+            ord("]"): 1,
+            ord("{"): -CHECKPOINT_EVERY,
+            ord("}"): CHECKPOINT_EVERY,
         }
         self._username = username
         self._msg_parser = MessageParser(self._model, self._is_host, username)
         self._send_queue = asyncio.Queue()
         self._msg_queue = asyncio.Queue()
+        self._producer_task = None
+        self._stopped = asyncio.Event()
+        self._pending_keys = deque()
+        self._keys_ready = asyncio.Event()
+        self._shutdown_task = None
+        # item taken from send queue, that didn't fit into last batch
+        self._held_items = []
         self._load_permissions()
 
     async def save_as_pdf(self):
-        if not self._file_path:
-            return
-        self._converter.to_pdf(self._file_path)
+        self._start_export(("pdf",))
 
     async def save_as_html(self):
-        if not self._file_path:
-            return
-        self._converter.to_html(self._file_path)
+        self._start_export(("html",))
 
     async def save_as_doc(self):
+        self._start_export(("doc",))
+
+    async def export_all(self):
+        self._start_export(("pdf", "html", "doc"))
+
+    # returns at once, event loop keeps serving clients
+    def _start_export(self, formats):
         if not self._file_path:
             return
-        self._converter.to_doc(self._file_path)
+        formats = [fmt for fmt in formats if fmt not in self._export_tasks]
+        if not formats:
+            return
+        if self._export_pool is None:
+            self._export_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=3, thread_name_prefix="export")
+        lines = self._model.text_lines.snapshot()
+        exporter = TextExporter(lines)
+        loop = self._export_loop = asyncio.get_running_loop()
+        for fmt in formats:
+            with self._export_m:
+                self._export_progress[fmt] = (0, len(lines))
+            self._export_tasks[fmt] = asyncio.ensure_future(
+                loop.run_in_executor(
+                    self._export_pool, self._export, exporter, fmt))
+            self._export_tasks[fmt].add_done_callback(
+                lambda task, fmt=fmt: self._export_finished(fmt, task))
+        self._show_export_status()
+
+    def _export(self, exporter, fmt):
+        def progress(done):
+            with self._export_m:
+                total = self._export_progress[fmt][1]
+                self._export_progress[fmt] = (done, total)
+            self._show_export_status()
+
+        getattr(exporter, "to_" + fmt)(self._file_path, progress=progress)
+
+    def _export_finished(self, fmt, task):
+        self._export_tasks.pop(fmt)
+        failed = not task.cancelled() and task.exception() is not None
+        with self._export_m:
+            if failed:
+                self._export_progress.pop(fmt)
+            if not self._export_tasks:
+                self._export_progress.clear()
+        if failed:
+            self._model.set_status(f"export {fmt} failed")
+        else:
+            self._show_export_status()
+
+    # called from export threads too, model is changed in loop thread
+    def _show_export_status(self):
+        with self._export_m:
+            status = " ".join(
+                f"{fmt} {done * 100 // max(total, 1)}%"
+                for fmt, (done, total) in self._export_progress.items())
+        self._export_loop.call_soon_threadsafe(
+            self._model.set_status, "export " + status if status else None)
+
+    async def wait_exports(self):
+        await asyncio.gather(*self._export_tasks.values(),
+                             return_exceptions=True)
 
     def _load_permissions(self):
         if not self._is_host:
@@ -109,34 +248,139 @@ class MtTextEditApp():
     def run(self):
         curses.wrapper(self._main)
 
+    # host without terminal, only network, model and history run,
+    # SIGTERM or SIGINT saves the file and ends the session
+    def run_headless(self):
+        asyncio.run(self._headless_main())
+
+    # recovers crashed session and starts sending to clients,
+    # connections are accepted by caller
+    async def start_hosting(self):
+        self._stop = False
+        if self._journal:
+            await self._journal.recover()
+            self._journal.start()
+        if self._compactor:
+            self._compact_task = asyncio.create_task(
+                self._compact_when_idle())
+        self._producer_task = asyncio.create_task(
+            self._server_producer_handler())
+
+    async def _compact_when_idle(self):
+        compacted_seq = None
+        while not self._stop:
+            seq = self._model._edit_seq
+            await asyncio.sleep(self._COMPACT_IDLE)
+            if seq != self._model._edit_seq or seq == compacted_seq:
+                continue
+            compacted_seq = seq
+            await self.compact_history()
+
+    async def compact_history(self):
+        if not self._compactor:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._compact_history)
+        except (OSError, sqlite3.Error):
+            pass
+
+    def _compact_history(self):
+        self._compactor.compact_document(self._file_path)
+        self._compactor.collect_chunks()
+
+    def client_count(self):
+        return sum(not client.closed for client in self._writers)
+
+    async def _headless_main(self):
+        await self.start_hosting()
+        server = await asyncio.start_server(
+            self._connection_handler, self._HOST_ADDRESS, self._PORT)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self._on_stop_signal)
+        print(f"hosting {self._file_path} on "
+              f"{self._HOST_ADDRESS}:{self._PORT}", flush=True)
+        async with server:
+            await self._stopped.wait()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        if self._shutdown_task:
+            await self._shutdown_task
+
+    def _on_stop_signal(self):
+        if self._shutdown_task is None:
+            self._shutdown_task = asyncio.create_task(self.shutdown())
+
+    async def save_file(self):
+        await self._model.save_file()
+        if self._journal:
+            self._journal.snapshot()
+
+    async def shutdown(self):
+        await self.save_file()
+        await self.stop()
+
     def connect(self, conn_ip):
         curses.wrapper(self._main, True, conn_ip)
 
-    def show_changes(self, filename, changes_file):
+    def show_changes(self, filename, changes_file, at=None):
         self._can_write = False
-        curses.wrapper(self._show_changes_main, filename, changes_file)
+        curses.wrapper(
+            self._show_changes_main, filename, changes_file, at)
 
     def show_blame(self, filename, changes_file):
         self._can_write = False
         curses.wrapper(self._show_blame_main, filename, changes_file)
 
     async def stop(self):
+        await self.wait_exports()
+        if self._compact_task:
+            self._compact_task.cancel()
         if not self.history_handler:
             await self._model.save_changes_history()
+            if self._journal:
+                await self._journal.close()
         else:
             self.history_handler.stop_view()
         await self.send(f"{self._username} "
                         + ("-DCH" if self._is_host else "-DC"))
-        await asyncio.sleep(0.1)
+        await self.send(self._STOP_MESSAGE)
+        if self._producer_task:
+            _, pending = await asyncio.wait(
+                [self._producer_task], timeout=self._STOP_FLUSH_TIMEOUT)
+            for task in pending:
+                task.cancel()
         if self._writer:
             self._writer.close()
         self._stop = True
+        self._stopped.set()
+        self._keys_ready.set()
         await self._model.stop_view()
 
-    async def send(self, item):
-        await self._send_queue.put(item)
+    # host can address message to single client instead of everyone
+    async def send(self, item, client=None):
+        if self._journal and client is None and isinstance(item, str):
+            self._journal.record(item)
+        await self._send_queue.put(item if client is None else (client, item))
+
+    def client_queue_stats(self):
+        return {client.username: client.stats() for client in self._writers}
+
+    def _remove_client(self, client):
+        if client in self._writers:
+            self._writers.remove(client)
+        if client is not None:
+            client.close()
 
     async def _parse_key(self, key):
+        if key == curses.KEY_RESIZE:
+            self._model.redraw()
+            return
+        if self.history_handler and key in self._version_step_by_key:
+            await self.history_handler.step_version(
+                self._model, self._version_step_by_key[key])
+            return
         if key in self._non_edit_func_by_key:
             await self._non_edit_func_by_key[key](self._username)
             await self.send(self._get_msg_by_key[key](self._username))
@@ -157,125 +401,286 @@ class MtTextEditApp():
                     f"{'/s' if key_str == ' ' else key_str}"
                 )
 
+    # called by loop when stdin is readable, curses can hold
+    # several keys at once, so all of them are read
+    def _read_keys(self):
+        while (key := self.stdscr.getch()) != -1:
+            self._pending_keys.append(key)
+        if self._pending_keys:
+            self._keys_ready.set()
+
     async def _input_handler(self):
         curses.raw()
         curses.cbreak()
         self.stdscr.nodelay(True)
         self.stdscr.keypad(True)
-        while True:
-            if self._stop:
-                return
-            key = self.stdscr.getch()
-            if key != -1:
-                if self.debug:
-                    print(key)
-                await self._parse_key(key)
-            await asyncio.sleep(0.01)
-
-    async def _consumer_handler(self, reader):
+        loop = asyncio.get_running_loop()
+        fd = sys.stdin.fileno()
+        loop.add_reader(fd, self._read_keys)
+        # resize does not make stdin readable
+        loop.add_signal_handler(signal.SIGWINCH, self._on_resize)
+        try:
+            # keys typed before reader was added
+            self._read_keys()
+            while not self._stop:
+                await self._keys_ready.wait()
+                self._keys_ready.clear()
+                while self._pending_keys and not self._stop:
+                    key = self._pending_keys.popleft()
+                    if self.debug:
+                        print(key)
+                    await self._parse_key(key)
+        finally:
+            loop.remove_reader(fd)
+            loop.remove_signal_handler(signal.SIGWINCH)
+
+    # loop handler replaces the one of curses,
+    # so new size of terminal is passed to curses here
+    def _on_resize(self):
+        try:
+            size = os.get_terminal_size(sys.stdin.fileno())
+            curses.resizeterm(size.lines, size.columns)
+        except (OSError, curses.error):
+            pass
+        self._model.redraw()
+
+    async def _consumer_handler(self, reader, codec=None):
+        codec = codec or self._codec
         while True:
             if self._stop:
                 return
             try:
-                data = await reader.readuntil(self._DELIMITER)
+                args = await codec.read_args(reader)
             except (ConnectionError, asyncio.IncompleteReadError):
                 if self._is_host:
-                    self._writers.remove(self._reader_to_writer[reader])
+                    self._remove_client(self._reader_to_writer.pop(reader))
                 break
-            message = data.decode()
-            args = message.split(' ')
-            if self.debug:
-                print(message)
-            if args[1] == '-DCH':
-                await self.stop()
+            if not await self._handle_message(args):
                 return
-            if args[1] == '-WNACK' and not self._is_host:
-                self._can_write = False
-                self._msg_parser.can_write = False
-            await self._msg_parser.parse_message(args)
-            if self._is_host:
-                await self.send(message)
+
+    # returns False when connection should not be read anymore
+    async def _handle_message(self, args):
+        message = message_from_args(args)
+        if self.debug:
+            print(message)
+        if args[1] == '-DCH':
+            await self.stop()
+            return False
+        if args[1] == '-WNACK' and not self._is_host:
+            self._can_write = False
+            self._msg_parser.can_write = False
+        await self._msg_parser.parse_message(args)
+        if self._is_host:
+            await self.send(message)
+        return True
+
+    # client offers binary protocol in -C message,
+    # host answers with -PROTO before anything else if it agrees,
+    # old hosts ignore extra arguments and start sending snapshot
+    async def _handshake(self, reader, writer):
+        protocols = [BinaryCodec.NAME] if self._binary_protocol else []
+        document = [DOCUMENT_PREFIX + self._document] if self._document else []
+        writer.write(self._codec.encode(" ".join(
+            [self._username, "-C", self._username, *protocols,
+             SNAPSHOT_CHUNKS, *document])))
+        await writer.drain()
+        if not protocols:
+            return
+        try:
+            args = await self._codec.read_args(reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+        if args[1] == '-PROTO' and args[2] in CODECS:
+            self._codec = CODECS[args[2]]()
+            return
+        await self._handle_message(args)
+
+    def _is_batchable(self, item):
+        if not isinstance(item, str):
+            return False
+        args = item.split(' ', 2)
+        return len(args) > 1 and args[1] in BATCHABLE_OPS
+
+    # edit ops of one user, queued within batch window,
+    # are packed into single -B message
+    async def _next_outgoing(self):
+        if self._held_items:
+            item = self._held_items.pop()
+        else:
+            item = await self._send_queue.get()
+        if not self._is_batchable(item):
+            return item
+        batch = [item]
+        sender = item.split(' ', 1)[0]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._batch_window
+        while len(batch) < self._MAX_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            try:
+                if not self._send_queue.empty() or timeout <= 0:
+                    item = self._send_queue.get_nowait()
+                else:
+                    item = await asyncio.wait_for(
+                        self._send_queue.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            if (not self._is_batchable(item)
+                    or item.split(' ', 1)[0] != sender):
+                self._held_items.append(item)
+                break
+            batch.append(item)
+        return batch[0] if len(batch) == 1 else make_batch(batch)
 
     async def _producer_handler(self, writer):
-        while True:
-            if self._stop:
+        while not self._stop:
+            message = await self._next_outgoing()
+            if message is self._STOP_MESSAGE:
                 return
             try:
-                message = self._send_queue.get_nowait()
-            except asyncio.QueueEmpty:
-                await asyncio.sleep(0.15)
-                continue
-            try:
-                writer.write(message.encode() + self._DELIMITER)
+                writer.write(self._codec.encode(message))
                 await writer.drain()
             except (ConnectionError, asyncio.IncompleteReadError):
                 break
 
+    # every client has its own writer task and queue,
+    # so slow client can't hold back the others
     async def _server_producer_handler(self):
-        while True:
-            if self._stop:
+        while not self._stop:
+            item = await self._next_outgoing()
+            if item is self._STOP_MESSAGE:
+                await asyncio.gather(
+                    *(client.finish() for client in self._writers))
                 return
-            try:
-                message = self._send_queue.get_nowait()
-            except asyncio.QueueEmpty:
-                await asyncio.sleep(0.15)
-                continue
-            for connection in self._writers:
-                try:
-                    connection.write(message.encode() + self._DELIMITER)
-                    await connection.drain()
-                except (ConnectionError, asyncio.IncompleteReadError):
-                    connection.close()
-                    self._writers.remove(connection)
+            if isinstance(item, tuple):
+                client, message = item
+                client.offer(message)
+            else:
+                for client in list(self._writers):
+                    if not client.offer(item):
+                        self._remove_client(client)
+            # snapshot is consistent with clients only
+            # when every applied message is already sent
+            if self._send_queue.empty() and not self._held_items:
+                await self._resync_clients()
 
-    async def _connection_handler(self, reader, writer):
+    async def _resync_clients(self):
+        for client in self._writers:
+            if client.needs_resync:
+                client.resync(await self._snapshot_messages())
+            elif client.positions_stale:
+                client.refresh_positions(await self._users_message())
+
+    async def _users_message(self):
         user_pos = [await self._model.get_user_pos(
             x) for x in self._model.users]
         user_pos_strings = [f"{x[0]} {x[1]}" for x in user_pos]
+        return (
+            f"{self._username} -U " +
+            " ".join(f"{u} {p}" for u, p in zip(self._model.users,
+                                                user_pos_strings))
+        )
+
+    async def _snapshot_messages(self):
+        return [
+            await self._users_message(),
+            f"{self._username} -T {self._model.text_lines.get_text()}"
+        ]
+
+    def _snapshot_chunks(self, lines):
+        size = self._SNAPSHOT_CHUNK_SIZE
+        chunk = []
+        chunk_len = 0
+        for i, line in enumerate(lines):
+            if i:
+                chunk.append("\n")
+                chunk_len += 1
+            start = 0
+            while True:
+                piece = line[start: start + size - chunk_len]
+                start += len(piece)
+                chunk.append(piece)
+                chunk_len += len(piece)
+                if chunk_len >= size:
+                    yield "".join(chunk)
+                    chunk = []
+                    chunk_len = 0
+                if start >= len(line):
+                    break
+        if chunk_len:
+            yield "".join(chunk)
+
+    # lines are captured at once, then sent in bounded chunks,
+    # edits made meanwhile are queued after -TS and applied by client
+    # when -TE comes, so host keeps serving other users
+    async def _stream_snapshot(self, client):
+        # rope snapshot is O(1), edits made while it is streamed
+        # don't change it
+        lines = self._model.text_lines.snapshot()
+        version = self._model.text_lines.generation
+        resyncs = client.resyncs
+        await self.send(f"{self._username} -TS {version}", client)
+        for chunk in self._snapshot_chunks(lines):
+            await asyncio.sleep(0)
+            await client.wait_for_room()
+            # resync sends full -T, rest of stream is not needed
+            if client.closed or client.resyncs != resyncs:
+                return
+            await self.send(f"{self._username} -TC {chunk}", client)
+        await self.send(f"{self._username} -TE {version}", client)
+
+    async def _connection_handler(self, reader, writer):
+        try:
+            args = await self._codec.read_args(reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+        if args[1] != '-C':
+            return
+        await self.accept_client(args, reader, writer)
+
+    # args are -C message, already read from connection
+    async def accept_client(self, args, reader, writer):
         can_write = False
         try:
-            data = await reader.readuntil(self._DELIMITER)
-            message = data.decode()
-            args = message.split(' ')
-            if args[1] != '-C':
-                return
             permissions = self._permissions.get(args[0], "")
             if permissions == "":
                 try:
                     writer.write(
-                        f'{self._username} -DCH'.encode() + self._DELIMITER)
+                        self._codec.encode(f'{self._username} -DCH'))
                     await writer.drain()
                 except (ConnectionError, asyncio.IncompleteReadError):
                     writer.close()
                 return
-            if "r" in permissions:
-                self._writers.append(writer)
-                self._reader_to_writer[reader] = writer
-                if "w" in permissions:
-                    can_write = True
-                else:
-                    try:
-                        writer.write(
-                            f'{self._username} -WNACK'.encode()
-                            + self._DELIMITER)
-                        await writer.drain()
-                    except (ConnectionError, asyncio.IncompleteReadError):
-                        writer.close()
+            if "r" not in permissions:
+                return
+            client = ClientWriter(
+                writer,
+                args[0],
+                TextCodec(),
+                self._client_queue_size,
+                self._slow_client_policy,
+                self._client_queue_bytes,
+            )
+            if self._binary_protocol and BinaryCodec.NAME in args[3:]:
+                client.offer(f'{self._username} -PROTO {BinaryCodec.NAME}')
+                client.codec = BinaryCodec()
+            client.start()
+            self._writers.append(client)
+            self._reader_to_writer[reader] = client
+            if "w" in permissions:
+                can_write = True
+            else:
+                await self.send(f'{self._username} -WNACK', client)
         except (ConnectionError, asyncio.IncompleteReadError):
-            if self._is_host:
-                self._writers.remove(self._reader_to_writer[reader])
             return
-        await self.send(
-            f"{self._username} -U " +
-            " ".join(f"{u} {p}" for u, p in zip(self._model.users,
-                                                user_pos_strings))
-        )
-        await self.send(
-            f"{self._username} -T {'\n'.join(self._model.text_lines)}"
-        )
+        if SNAPSHOT_CHUNKS in args[3:]:
+            await self.send(await self._users_message(), client)
+            await self._stream_snapshot(client)
+        else:
+            for message in await self._snapshot_messages():
+                await self.send(message, client)
         if can_write:
             await self._model.add_user(args[0])
-            await self._consumer_handler(reader)
+            await self._consumer_handler(reader, client.codec)
 
     def _main(self, *args, **kwargs):
         asyncio.run(self._async_main(*args, **kwargs))
@@ -296,13 +701,14 @@ class MtTextEditApp():
     def _show_changes_main(self, *args, **kwargs):
         asyncio.run(self._show_changes_async_main(*args, **kwargs))
 
-    async def _show_changes_async_main(self, stdscr, filename, changes_file):
+    async def _show_changes_async_main(
+            self, stdscr, filename, changes_file, at=None):
         self.stdscr = stdscr
         self._stop = False
         self.history_handler = HistoryHandler()
         await asyncio.gather(
             self.history_handler.show_changes(
-                filename, changes_file, self._model, stdscr),
+                filename, changes_file, self._model, stdscr, at),
             self._input_handler()
         )
 
@@ -310,23 +716,21 @@ class MtTextEditApp():
         self.stdscr = stdscr
         self._stop = False
         if not self.debug:
-            asyncio.get_event_loop().run_in_executor(
-                None, self._model.run_view, stdscr
-            )
+            self._render_task = asyncio.create_task(
+                self._model.render_view(stdscr))
         if not should_connect:
+            await self.start_hosting()
             await asyncio.start_server(
-                self._connection_handler, '127.0.0.1', 12000)
-            await asyncio.gather(
-                self._input_handler(),
-                self._server_producer_handler()
-            )
+                self._connection_handler, self._HOST_ADDRESS, self._PORT)
+            await self._input_handler()
         else:
             reader, writer = await asyncio.open_connection(
-                conn_ip, 12000)
+                conn_ip, self._PORT)
             self._writer = writer
-            await self.send(f"{self._username} -C {self._username}")
+            await self._handshake(reader, writer)
+            self._producer_task = asyncio.create_task(
+                self._producer_handler(writer))
             await asyncio.gather(
                 self._consumer_handler(reader),
-                self._producer_handler(writer),
                 self._input_handler()
             )
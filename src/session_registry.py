@@ -0,0 +1,247 @@
+import asyncio
+import os
+import signal
+import socket
+from codec import DOCUMENT_PREFIX, TextCodec
+from mttext_app import MtTextEditApp
+
+_STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+def document_from_args(args):
+    for arg in args[3:]:
+        if arg.startswith(DOCUMENT_PREFIX):
+            return normalize_document(arg[len(DOCUMENT_PREFIX):])
+    return None
+
+
+# same document is always known by the same name
+def normalize_document(name):
+    return os.path.normpath(name) if name else name
+
+
+class DocumentSession:
+    # one hosted document with its own model, history and clients
+
+    def __init__(self, name, file_path, app):
+        self.name = name
+        self.file_path = file_path
+        self.app = app
+        self.last_active = asyncio.get_running_loop().time()
+
+    def touch(self):
+        self.last_active = asyncio.get_running_loop().time()
+
+    def is_idle(self, timeout):
+        return (
+            self.app.client_count() == 0
+            and asyncio.get_running_loop().time() - self.last_active
+            >= timeout
+        )
+
+
+class SessionRegistry:
+    # serves every file of root directory from one listener,
+    # document is loaded by first client, that names it in -C message,
+    # and unloaded when nobody used it for idle_timeout seconds
+    _IDLE_CHECK_INTERVAL = 5
+    # -C message and anything client sent after it,
+    # passed with connection by acceptor process
+    MAX_HANDOFF_SIZE = 1 << 16
+
+    def __init__(
+        self,
+        root_dir,
+        username,
+        debug=False,
+        idle_timeout=300,
+        default_document=None,
+        **app_kwargs,
+    ):
+        self._root_dir = os.path.realpath(root_dir)
+        self._username = username
+        self._debug = debug
+        self._idle_timeout = idle_timeout
+        self._default_document = default_document
+        self._app_kwargs = app_kwargs
+        self._codec = TextCodec()
+        self._sessions = {}
+        self._sessions_m = asyncio.Lock()
+        # name -> event set, when unloaded document is saved
+        self._unloading = {}
+        self._stopped = asyncio.Event()
+        self._handoff_tasks = set()
+
+    @property
+    def sessions(self):
+        return dict(self._sessions)
+
+    # document must stay inside root directory
+    def resolve(self, name):
+        if not name:
+            return None
+        path = os.path.realpath(os.path.join(self._root_dir, name))
+        if os.path.commonpath([path, self._root_dir]) != self._root_dir:
+            return None
+        if not os.path.isfile(path):
+            return None
+        return path
+
+    def _read_file(self, path):
+        with open(path, "r") as f:
+            return f.read()
+
+    async def get_session(self, name):
+        name = normalize_document(name)
+        # unloaded document is read again only after it is saved
+        while (unloading := self._unloading.get(name)) is not None:
+            await unloading.wait()
+        async with self._sessions_m:
+            session = self._sessions.get(name)
+            if session is not None:
+                return session
+            path = self.resolve(name)
+            if path is None:
+                return None
+            text = await asyncio.get_running_loop().run_in_executor(
+                None, self._read_file, path)
+            app = MtTextEditApp(
+                self._username,
+                text,
+                debug=self._debug,
+                file_path=path,
+                **self._app_kwargs,
+            )
+            await app.start_hosting()
+            session = self._sessions[name] = DocumentSession(name, path, app)
+            return session
+
+    # documents are saved and compacted outside of the lock,
+    # so other documents are opened meanwhile
+    async def unload_idle(self):
+        async with self._sessions_m:
+            idle = [
+                self._sessions.pop(name)
+                for name, session in list(self._sessions.items())
+                if session.is_idle(self._idle_timeout)
+            ]
+            for session in idle:
+                self._unloading[session.name] = asyncio.Event()
+        for session in idle:
+            try:
+                await session.app.shutdown()
+                # document is unloaded before app gets idle
+                # long enough to compact its history itself
+                await session.app.compact_history()
+            finally:
+                self._unloading.pop(session.name).set()
+
+    async def close_all(self):
+        async with self._sessions_m:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            for session in sessions:
+                await session.app.shutdown()
+
+    async def _connection_handler(self, reader, writer):
+        try:
+            args = await self._codec.read_args(reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+        if args[1] != '-C':
+            writer.close()
+            return
+        name = document_from_args(args) or self._default_document
+        session = await self.get_session(name)
+        if session is None:
+            try:
+                writer.write(self._codec.encode(f'{self._username} -DCH'))
+                await writer.drain()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            writer.close()
+            return
+        session.touch()
+        try:
+            await session.app.accept_client(args, reader, writer)
+        finally:
+            session.touch()
+
+    async def _unload_idle_loop(self):
+        while True:
+            await asyncio.sleep(
+                min(self._IDLE_CHECK_INTERVAL, self._idle_timeout))
+            await self.unload_idle()
+
+    async def serve(
+        self,
+        address=MtTextEditApp._HOST_ADDRESS,
+        port=MtTextEditApp._PORT,
+    ):
+        server = await asyncio.start_server(
+            self._connection_handler, address, port)
+        print(f"hosting {self._root_dir} on {address}:{port}", flush=True)
+        async with server:
+            await self._run_until_stopped()
+
+    # connections come from acceptor process through control socket,
+    # every packet is handshake data with client socket attached
+    async def serve_handoffs(self, control, signals=_STOP_SIGNALS):
+        loop = asyncio.get_running_loop()
+        control.setblocking(False)
+        loop.add_reader(control.fileno(), self._on_handoff, control)
+        try:
+            await self._run_until_stopped(signals)
+        finally:
+            loop.remove_reader(control.fileno())
+
+    def _on_handoff(self, control):
+        try:
+            data, fds, _, _ = socket.recv_fds(
+                control, self.MAX_HANDOFF_SIZE, 1)
+        except BlockingIOError:
+            return
+        except OSError:
+            fds = []
+            data = b""
+        if not fds:
+            # acceptor is gone
+            if not data:
+                self.stop()
+            return
+        conn = socket.socket(fileno=fds[0])
+        task = asyncio.create_task(self._accept_handoff(conn, data))
+        self._handoff_tasks.add(task)
+        task.add_done_callback(self._handoff_tasks.discard)
+
+    async def _accept_handoff(self, conn, data):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        conn.setblocking(False)
+        transport, protocol = await loop.connect_accepted_socket(
+            lambda: asyncio.StreamReaderProtocol(reader), conn)
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        await self._connection_handler(reader, writer)
+
+    # unloads idle documents until stop signal, then saves everything,
+    # signals are handled until documents are saved, so repeated
+    # signal doesn't kill process in the middle
+    async def _run_until_stopped(self, signals=_STOP_SIGNALS):
+        loop = asyncio.get_running_loop()
+        for sig in signals:
+            loop.add_signal_handler(sig, self._stopped.set)
+        unload_task = asyncio.create_task(self._unload_idle_loop())
+        try:
+            await self._stopped.wait()
+            unload_task.cancel()
+            await self.close_all()
+        finally:
+            for sig in signals:
+                loop.remove_signal_handler(sig)
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        asyncio.run(self.serve())
@@ -0,0 +1,39 @@
+import unittest
+from bench_model import (
+    make_document,
+    make_session,
+    make_workload,
+    parse_size,
+    run_benchmark,
+)
+
+
+class TestBenchModel(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(parse_size("512"), 512)
+        self.assertEqual(parse_size("1K"), 1024)
+        self.assertEqual(parse_size("100MB"), 100 << 20)
+        self.assertEqual(parse_size("1.5k"), 1536)
+
+    def test_make_document(self):
+        self.assertEqual(len(make_document(5000)), 5000)
+        self.assertEqual(make_document(100, 1), make_document(100, 1))
+
+    def test_workload_is_repeatable(self):
+        users = ["a", "b"]
+        workload = make_workload(users, 50, 3)
+        self.assertEqual(workload, make_workload(users, 50, 3))
+        self.assertEqual(len(make_session(workload)), 50)
+
+    def test_run_benchmark(self):
+        for replay in (False, True):
+            result = run_benchmark(2048, 3, 200, replay=replay)
+            self.assertEqual(
+                sum(op["count"] for op in result["by_op"].values()), 200)
+            self.assertGreater(result["ops_per_sec"], 0)
+            self.assertLessEqual(result["p50_us"], result["p99_us"])
+            self.assertGreater(result["peak_mem_mb"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
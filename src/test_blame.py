@@ -0,0 +1,96 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+from blame import RUNS_HEADER, BlameRuns
+from history_catalog import HistoryCatalog
+from history_handler import HistoryHandler
+from test_support import use_temp_data_dir
+
+
+class TestBlameRuns(unittest.TestCase):
+    def test_lines_are_kept_as_runs(self):
+        blame = BlameRuns.from_lines(["a"] * 1000 + ["b"] * 1000)
+        self.assertEqual(blame.run_count, 2)
+        self.assertEqual(len(blame), 2000)
+        self.assertEqual(blame[999], "a")
+        self.assertEqual(blame[1000], "b")
+        self.assertEqual(blame[-1], "b")
+        with self.assertRaises(IndexError):
+            blame[2000]
+
+    def test_insert_and_cut(self):
+        blame = BlameRuns.from_lines(["o"] * 5)
+        blame.inserted((3, 1), (0, 3), "u")
+        self.assertEqual(list(blame), ["o", "u", "u", "u", "o", "o", "o"])
+        blame.cut((2, 2), (0, 5), "v")
+        self.assertEqual(list(blame), ["o", "u", "v", "o"])
+        blame.inserted((0, 0), (1, 0), "v")
+        self.assertEqual(blame.run_count, 4)
+        self.assertEqual(blame.users, ["o", "u", "v"])
+
+    def test_reversed_range(self):
+        blame = BlameRuns.from_lines(["o"] * 3)
+        blame.cut((0, 2), (1, 0), "u")
+        self.assertEqual(list(blame), ["u"])
+
+    def test_dumps_and_parse(self):
+        blame = BlameRuns.from_lines(["a", "a", "b b", "a"])
+        text = blame.dumps()
+        self.assertEqual(text, f"{RUNS_HEADER}\n2\ta\n1\tb b\n1\ta\n")
+        self.assertEqual(BlameRuns.parse(text.split("\n")), blame)
+        self.assertEqual(BlameRuns.parse(["a\n", "b\n"]), ["a", "b"])
+
+    def _edit_time(self, runs):
+        blame = BlameRuns.from_lines(
+            [f"u{i % 2}" for i in range(runs)])
+        start = time.perf_counter()
+        for i in range(2000):
+            y = i * 7919 % runs
+            blame.inserted((0, y), (0, y + 1), "e")
+            blame.cut((0, y), (0, y + 1), f"u{i % 3}")
+        return time.perf_counter() - start
+
+    def test_edit_time_does_not_follow_run_count(self):
+        small = self._edit_time(2000)
+        large = self._edit_time(200000)
+        # list splicing would be 100 times slower
+        self.assertLess(large / small, 5)
+
+
+class TestLiveBlame(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        use_temp_data_dir(self)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.blame_path = os.path.join(self.tmp.name, "old.blame.cache")
+        with open(self.blame_path, "w") as f:
+            f.write(BlameRuns.from_lines(["a", "b", "c"]).dumps())
+        self.handler = HistoryHandler(os.path.join(self.tmp.name, "f.txt"))
+        self.handler._HISTORY_DIR_PATH = self.tmp.name + "/"
+        self.handler._catalog = HistoryCatalog(
+            self.tmp.name + "/catalog.sqlite", self.tmp.name + "/")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def test_blame_is_read_on_first_edit(self):
+        with patch("builtins.open") as mock_open:
+            self.handler.load_blame(
+                ["1", "2", "3"], "owner", "old.o.cache", "")
+            mock_open.assert_not_called()
+        await self.handler.new_text_save_history("u", (1, 1), (0, 2))
+        self.assertEqual(list(self.handler._last_edited_by),
+                         ["a", "u", "u", "c"])
+
+    async def test_undo_reverts_lines(self):
+        self.handler.load_blame(["1", "2", "3"], "owner")
+        op = await self.handler.new_text_save_history("u", (1, 1), (0, 3))
+        self.assertEqual(len(self.handler._last_edited_by), 5)
+        await self.handler.correct_history_on_undo_paste("u", op)
+        self.assertEqual(list(self.handler._last_edited_by),
+                         ["owner", "u", "owner"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import tempfile
+import unittest
+import change_log
+from history_catalog import HistoryCatalog
+from history_handler import HistoryHandler
+from test_support import use_temp_data_dir
+
+FRAMES = [
+    ["insert", (0, 0), (3, 1), "user"],
+    ["cut", (1, 0), (2, 2), "multi line\ntext with spaces", "other user"],
+    ["insert", (0, 5), (0, 6), "юзер"],
+]
+
+
+class TestChangeLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "changes.cache")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_frames_round_trip(self):
+        change_log.append_records(
+            self.path,
+            [change_log.encode_frame(op, f) for op, f in enumerate(FRAMES)])
+        self.assertTrue(change_log.is_change_log(self.path))
+        self.assertEqual(change_log.read_frames(self.path), FRAMES)
+
+    def test_appends_keep_one_header(self):
+        for op, frame in enumerate(FRAMES):
+            change_log.append_records(
+                self.path, [change_log.encode_frame(op, frame)])
+        self.assertEqual(change_log.read_frames(self.path), FRAMES)
+        change_log.append_records(self.path, [], truncate=True)
+        self.assertEqual(change_log.read_frames(self.path), [])
+
+    def test_tombstone_removes_frame(self):
+        change_log.append_records(
+            self.path,
+            [change_log.encode_frame(op, f) for op, f in enumerate(FRAMES)]
+            + [change_log.encode_tombstone(1)])
+        self.assertEqual(change_log.read_frames(self.path),
+                         [FRAMES[0], FRAMES[2]])
+
+    def test_torn_tail_is_ignored(self):
+        change_log.append_records(
+            self.path,
+            [change_log.encode_frame(op, f) for op, f in enumerate(FRAMES)])
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 3)
+        self.assertEqual(change_log.read_frames(self.path), FRAMES[:2])
+
+    def test_legacy_file_is_not_change_log(self):
+        with open(self.path, "w") as f:
+            f.write("insert 0 0 1 0 user b' \\n\\x1e'")
+        self.assertFalse(change_log.is_change_log(self.path))
+
+
+class TestHistoryChangeLog(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        use_temp_data_dir(self)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.tmp.name, "doc.txt")
+        with open(self.file_path, "w") as f:
+            f.write("text")
+        self.handler = HistoryHandler(self.file_path)
+        self.handler._HISTORY_DIR_PATH = self.tmp.name + "/"
+        self.handler._CHANGES_CACHE_PATH = self.tmp.name + "/changes.cache"
+        self.handler._catalog = HistoryCatalog(
+            self.tmp.name + "/catalog.sqlite", self.tmp.name + "/")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def test_save_appends_only_new_frames(self):
+        await self.handler.new_text_save_history("a", (0, 0), (1, 0))
+        await self.handler.save_file(["text"])
+        size = os.path.getsize(self.handler._CHANGES_CACHE_PATH)
+        await self.handler.save_file(["text"])
+        self.assertEqual(
+            os.path.getsize(self.handler._CHANGES_CACHE_PATH), size)
+        await self.handler.new_text_save_history("b", (1, 0), (2, 0))
+        await self.handler.save_file(["text"])
+        frames = change_log.read_frames(self.handler._CHANGES_CACHE_PATH)
+        self.assertEqual([frame[3] for frame in frames], ["a", "b"])
+
+    async def test_undo_of_saved_op_is_tombstoned(self):
+        op = await self.handler.new_text_save_history("a", (0, 0), (1, 0))
+        await self.handler.new_text_save_history("b", (1, 0), (2, 0))
+        await self.handler.save_file(["text"])
+        await self.handler.correct_history_on_undo_paste("a", op)
+        await self.handler.save_file(["text"])
+        await self.handler._read_changes(self.handler._CHANGES_CACHE_PATH)
+        self.assertEqual(self.handler._changes_frames,
+                         [["insert", (1, 0), (2, 0), "b"]])
+
+    async def test_session_history_is_change_log(self):
+        self.handler._last_edited_by = ["owner"]
+        await self.handler.new_text_save_history("a", (0, 0), (1, 0))
+        await self.handler.save_file(["text"])
+        await self.handler.session_ended()
+        path = (self.handler._HISTORY_DIR_PATH
+                + str(self.handler._session_start) + ".cache")
+        self.assertEqual(change_log.read_frames(path),
+                         [["insert", (0, 0), (1, 0), "a"]])
+        self.assertFalse(os.path.exists(self.handler._CHANGES_CACHE_PATH))
+
+    async def test_legacy_changes_are_read(self):
+        path = self.tmp.name + "/legacy.cache"
+        delimiter = str(HistoryHandler._DELIMITER)
+        with open(path, "w") as f:
+            f.write(f"insert 0 0 1 0 a {delimiter}"
+                    f"cut 0 0 2 0 x/sy b {delimiter}")
+        await self.handler._read_changes(path)
+        self.assertEqual(self.handler._changes_frames, [
+            ["insert", (0, 0), (1, 0), "a"],
+            ["cut", (0, 0), (2, 0), "x y", "b"],
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import random
+import time
+import unittest
+from change_pieces import ChangePieces
+
+
+class TestChangePieces(unittest.TestCase):
+    def _frames(self, frames):
+        return ChangePieces.from_frames(frames).frames()
+
+    def test_typing_is_one_frame(self):
+        frames = [["insert", (x, 0), (x + 1, 0), "u"] for x in range(5)]
+        self.assertEqual(self._frames(frames),
+                         [["insert", (0, 0), (5, 0), "u"]])
+
+    def test_insert_goes_after_cut_text(self):
+        frames = [
+            ["cut", (6, 0), (11, 0), "world", "a"],
+            ["insert", (6, 0), (11, 0), "b"],
+        ]
+        self.assertEqual(self._frames(frames), [
+            ["cut", (6, 0), (11, 0), "world", "a"],
+            ["insert", (11, 0), (16, 0), "b"],
+        ])
+
+    def test_cut_of_inserted_text_is_not_history(self):
+        frames = [
+            ["insert", (0, 0), (3, 0), "a"],
+            ["cut", (1, 0), (2, 0), "b", "a"],
+        ]
+        self.assertEqual(self._frames(frames),
+                         [["insert", (0, 0), (2, 0), "a"]])
+
+    def test_cut_over_inserted_text_keeps_original(self):
+        frames = [
+            ["insert", (1, 0), (3, 0), "a"],
+            ["cut", (0, 0), (4, 0), "xaby", "b"],
+        ]
+        self.assertEqual(self._frames(frames),
+                         [["cut", (0, 0), (2, 0), "xy", "b"]])
+
+    def test_backspaces_are_joined(self):
+        frames = [
+            ["cut", (2, 0), (3, 0), "c", "a"],
+            ["cut", (1, 0), (2, 0), "b", "a"],
+        ]
+        self.assertEqual(self._frames(frames),
+                         [["cut", (1, 0), (3, 0), "bc", "a"]])
+
+    def test_multiline_positions(self):
+        frames = [
+            ["insert", (0, 1), (0, 2), "u"],
+            ["cut", (1, 2), (1, 3), "2\nl", "v"],
+            ["insert", (2, 0), (0, 1), "w"],
+        ]
+        self.assertEqual(self._frames(frames), [
+            ["insert", (2, 0), (0, 1), "w"],
+            ["insert", (0, 2), (0, 3), "u"],
+            ["cut", (1, 3), (1, 4), "2\nl", "v"],
+        ])
+
+    def test_long_session_is_fast(self):
+        frames = []
+        for i in range(5000):
+            y = i % 100
+            frames.append(["insert", (0, y), (1, y), "u"])
+            frames.append(["cut", (3, y), (4, y), "x", "v"])
+        start = time.perf_counter()
+        ChangePieces.from_frames(frames).frames()
+        self.assertLess(time.perf_counter() - start, 10)
+
+    def _replay_time(self, count):
+        rnd = random.Random(count)
+        frames = []
+        for _ in range(count):
+            x, y = rnd.randrange(20), rnd.randrange(1000)
+            if rnd.random() < 0.6:
+                frames.append(["insert", (x, y), (x + 1, y), "u"])
+            else:
+                frames.append(["cut", (x, y), (x + 1, y), "x", "v"])
+        start = time.perf_counter()
+        ChangePieces.from_frames(frames).frames()
+        return time.perf_counter() - start
+
+    def test_replay_time_grows_near_linearly(self):
+        small = self._replay_time(4000)
+        large = self._replay_time(16000)
+        # quadratic replay would take 16 times longer
+        self.assertLess(large / small, 8)
+
+    def test_backspaces_do_not_pile_up(self):
+        frames = [["cut", (x - 1, 0), (x, 0), "x", "u"]
+                  for x in range(1000, 0, -1)]
+        pieces = ChangePieces.from_frames(frames)
+        self.assertEqual(len(list(pieces)), 2)
+        self.assertEqual(pieces.frames(),
+                         [["cut", (0, 0), (1000, 0), "x" * 1000, "u"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
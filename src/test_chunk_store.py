@@ -0,0 +1,88 @@
+import os
+import random
+import tempfile
+import unittest
+from chunk_store import MAGIC, ChunkStore, split_chunks
+from history_catalog import HistoryCatalog
+from history_handler import HistoryHandler
+from test_support import use_temp_data_dir
+
+
+def _document(line_count, seed=1):
+    rnd = random.Random(seed)
+    return "".join(
+        f"line {i} {rnd.random()}\n" for i in range(line_count)).encode()
+
+
+class TestChunkStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ChunkStore(self.tmp.name + "/chunks/")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _chunk_count(self):
+        return sum(len(files) for _, _, files in
+                   os.walk(self.tmp.name + "/chunks/"))
+
+    def test_chunks_join_to_data(self):
+        data = _document(20000) + b"x" * 600000 + b"\nend"
+        chunks = split_chunks(data)
+        self.assertEqual(b"".join(chunks), data)
+        self.assertTrue(all(len(chunk) <= 256 * 1024 for chunk in chunks))
+        self.assertEqual(split_chunks(b""), [])
+
+    def test_edit_keeps_other_chunks(self):
+        data = _document(50000)
+        edited = data[:len(data) // 2] + b"new line\n" + data[len(data) // 2:]
+        first = self.store.put(data)
+        second = self.store.put(edited)
+        self.assertGreater(len(first), 10)
+        self.assertLessEqual(len(set(second) - set(first)), 2)
+        self.assertEqual(self._chunk_count(), len(set(first + second)))
+        self.assertEqual(self.store.get(second), edited)
+
+    def test_snapshot_round_trip(self):
+        path = self.tmp.name + "/s.o.cache"
+        self.store.write_snapshot(path, "текст\n".encode() * 10)
+        with open(path, "rb") as f:
+            self.assertTrue(f.read().startswith(MAGIC))
+        self.assertEqual(self.store.read_snapshot(path), "текст\n" * 10)
+
+    def test_plain_copy_is_read(self):
+        path = self.tmp.name + "/old.o.cache"
+        with open(path, "w") as f:
+            f.write("old snapshot")
+        self.assertEqual(self.store.read_snapshot(path), "old snapshot")
+
+
+class TestHistorySnapshots(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        use_temp_data_dir(self)
+
+    async def test_sessions_share_chunks(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = os.path.join(tmp, "doc.txt")
+            store = ChunkStore(tmp + "/chunks/")
+            sizes = []
+            for i in range(2):
+                handler = HistoryHandler(file_path)
+                handler._HISTORY_DIR_PATH = tmp + "/"
+                handler._CHANGES_CACHE_PATH = tmp + "/changes.cache"
+                handler._catalog = HistoryCatalog(
+                    tmp + "/catalog.sqlite", tmp + "/")
+                handler._chunks = store
+                text = _document(10000).decode() + "edit" * i
+                await handler.save_file(text.split("\n"))
+                snapshot = tmp + f"/{handler._session_start}.o.cache"
+                self.assertEqual(store.read_snapshot(snapshot), text)
+                sizes.append(sum(
+                    os.path.getsize(os.path.join(root, file))
+                    for root, _, files in os.walk(tmp + "/chunks/")
+                    for file in files))
+            self.assertLess(sizes[1] - sizes[0], sizes[0] / 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+from client_writer import ClientWriter
+
+
+class PipeCodec:
+    def encode(self, message):
+        return message.encode() + b"|"
+
+
+class TestClientWriter(unittest.IsolatedAsyncioTestCase):
+    def make_client(self, policy, max_bytes=1024):
+        self.writer = MagicMock()
+        self.writer.drain = AsyncMock()
+        return ClientWriter(
+            self.writer, "client", PipeCodec(), 2, policy, max_bytes)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            ClientWriter(MagicMock(), "client", PipeCodec(), 2, "ignore")
+
+    async def test_writes_pending_frames_at_once(self):
+        client = self.make_client(ClientWriter.COALESCE)
+        client.offer("a")
+        client.offer("b")
+        client.start()
+        await client.finish()
+        self.writer.write.assert_called_once_with(b"a|b|")
+        self.writer.close.assert_called_once()
+
+    async def test_coalesce(self):
+        client = self.make_client(ClientWriter.COALESCE)
+        for message in "abcd":
+            self.assertTrue(client.offer(message))
+        self.assertEqual(client.depth, 2)
+        self.assertEqual(client.stats()["coalesced"], 2)
+        client.start()
+        await client.finish()
+        self.writer.write.assert_called_once_with(b"a|b|c|d|")
+
+    async def test_coalesce_drops_cursor_moves(self):
+        client = self.make_client(ClientWriter.COALESCE)
+        client.offer("x -E a")
+        client.offer("x -E b")
+        self.assertTrue(client.offer("y -M l"))
+        self.assertTrue(client.offer("y -B -MS l \x1F -M r"))
+        self.assertTrue(client.positions_stale)
+        self.assertTrue(client.offer("x -E c"))
+        self.assertEqual(client.stats()["coalesced"], 3)
+        client.refresh_positions("host -U x 2 0 y 0 0")
+        self.assertFalse(client.positions_stale)
+        client.start()
+        await client.finish()
+        self.writer.write.assert_called_once_with(
+            b"x -E a|x -E b|x -E c|host -U x 2 0 y 0 0|")
+
+    async def test_coalesce_resyncs_edit_after_dropped_move(self):
+        client = self.make_client(ClientWriter.COALESCE)
+        client.offer("x -E a")
+        client.offer("x -E b")
+        client.offer("y -M l")
+        self.assertTrue(client.offer("y -E c"))
+        self.assertTrue(client.needs_resync)
+        self.assertFalse(client.positions_stale)
+        self.assertEqual(client.depth, 0)
+
+    async def test_byte_cap(self):
+        client = self.make_client(ClientWriter.COALESCE, max_bytes=4)
+        self.assertTrue(client.offer("abc"))
+        self.assertTrue(client.offer("d"))
+        self.assertTrue(client.needs_resync)
+        self.assertEqual(client.stats()["dropped"], 2)
+        client = self.make_client(ClientWriter.DISCONNECT, max_bytes=4)
+        self.assertFalse(client.offer("abcd"))
+        self.assertTrue(client.closed)
+
+    async def test_resync(self):
+        client = self.make_client(ClientWriter.RESYNC)
+        for message in "abc":
+            self.assertTrue(client.offer(message))
+        self.assertTrue(client.needs_resync)
+        self.assertEqual(client.depth, 0)
+        client.offer("d")
+        client.resync(["snapshot"])
+        self.assertFalse(client.needs_resync)
+        self.assertEqual(client.stats()["dropped"], 4)
+        self.assertEqual(client.stats()["resyncs"], 1)
+        client.start()
+        await client.finish()
+        self.writer.write.assert_called_once_with(b"snapshot|")
+
+    async def test_wait_for_room(self):
+        client = self.make_client(ClientWriter.RESYNC)
+        client.offer("a")
+        waiter = asyncio.create_task(client.wait_for_room())
+        await asyncio.sleep(0)
+        self.assertFalse(waiter.done())
+        client.start()
+        await asyncio.wait_for(waiter, 1)
+        self.assertEqual(client.depth, 0)
+        await client.finish()
+
+    async def test_disconnect(self):
+        client = self.make_client(ClientWriter.DISCONNECT)
+        self.assertTrue(client.offer("a"))
+        self.assertTrue(client.offer("b"))
+        self.assertFalse(client.offer("c"))
+        self.assertTrue(client.closed)
+        self.writer.close.assert_called_once()
+        self.assertFalse(client.offer("d"))
+
+    async def test_connection_lost(self):
+        client = self.make_client(ClientWriter.RESYNC)
+        self.writer.drain = AsyncMock(side_effect=ConnectionResetError)
+        client.start()
+        client.offer("a")
+        await asyncio.wait_for(client._task, 1)
+        self.assertTrue(client.closed)
+        self.assertEqual(client.stats()["max_depth"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
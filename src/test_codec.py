@@ -0,0 +1,79 @@
+import asyncio
+import unittest
+from codec import (
+    FRAME_TAIL,
+    BinaryCodec,
+    TextCodec,
+    decode_varint,
+    encode_varint,
+    make_batch,
+    message_from_args,
+)
+
+
+class TestCodec(unittest.IsolatedAsyncioTestCase):
+    messages = [
+        "u -E a",
+        "u -E /s",
+        "u -M l",
+        "u -MS d",
+        "u -D",
+        "host -T first line\n  second  line ",
+        "host -T ",
+        "u -PASTE x y",
+        "host -U host 0 0 u 200 70000",
+        "u -C u binary",
+        "host -PROTO binary",
+        "host -TS 12",
+        "host -TC  chunk\nwith  spaces ",
+        "host -TE 12",
+        "host -WNACK",
+        "u -DC",
+        make_batch(["u -E a", "u -E /s", "u -NL", "u -M r", "u -D"]),
+        "u -SOMETHING new",
+        "u -U broken",
+        "u -E",
+    ]
+
+    async def read_all(self, codec, data):
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return [await codec.read_args(reader) for _ in self.messages]
+
+    async def test_round_trip(self):
+        for codec in (TextCodec(), BinaryCodec()):
+            data = b"".join(codec.encode(m) for m in self.messages)
+            for message, args in zip(self.messages,
+                                     await self.read_all(codec, data)):
+                self.assertEqual(args[-1], FRAME_TAIL)
+                self.assertEqual(message_from_args(args), message)
+
+    async def test_codecs_agree_on_args(self):
+        text = await self.read_all(
+            TextCodec(), b"".join(TextCodec().encode(m)
+                                  for m in self.messages))
+        binary = await self.read_all(
+            BinaryCodec(), b"".join(BinaryCodec().encode(m)
+                                    for m in self.messages))
+        self.assertEqual(text, binary)
+
+    def test_binary_frames_are_smaller(self):
+        message = "user -E a"
+        self.assertLess(len(BinaryCodec().encode(message)),
+                        len(TextCodec().encode(message)))
+
+    def test_varint(self):
+        for value in (0, 1, 127, 128, 300, 1 << 40):
+            data = b"x" + encode_varint(value)
+            self.assertEqual(decode_varint(data, 1), (value, len(data)))
+
+    async def test_broken_frame_length(self):
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"\x00")
+        with self.assertRaises(ConnectionError):
+            await BinaryCodec().read_args(reader)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,7 @@
+import os
+import re
+import tempfile
+import tracemalloc
 import unittest
 from unittest import mock
 from convert import TextExporter
@@ -15,5 +19,50 @@ class TestVConverter(unittest.TestCase):
         mock_open.assert_called()
 
 
+class TestStreamingExport(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "doc")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_pdf_is_paginated_with_xref(self):
+        lines = [f"line (n) {i}" for i in range(150)]
+        TextExporter(lines).to_pdf(self.path)
+        with open(self.path + ".pdf", "rb") as f:
+            data = f.read()
+        self.assertIn(b"/Count 3 >>", data)
+        self.assertIn(b"(line \\(n\\) 149) Tj", data)
+        xref = int(re.search(rb"startxref\n(\d+)", data).group(1))
+        self.assertTrue(data[xref:].startswith(b"xref\n0 10\n"))
+        entries = data[xref:].split(b"\n")[3:12]
+        for number, entry in enumerate(entries, 1):
+            offset = int(entry[:10])
+            self.assertTrue(data[offset:].startswith(
+                f"{number} 0 obj".encode()))
+
+    def test_html_and_doc_are_escaped(self):
+        exporter = TextExporter(["<b>&</b>", "{\\}", "ёж"])
+        exporter.to_html(self.path)
+        exporter.to_doc(self.path)
+        with open(self.path + ".html", encoding="utf-8") as f:
+            self.assertIn("<p>&lt;b&gt;&amp;&lt;/b&gt;</p>", f.read())
+        with open(self.path + ".doc", encoding="utf-8") as f:
+            doc = f.read()
+        self.assertIn("\\{\\\\\\}\\par", doc)
+        self.assertIn("\\u1105?\\u1078?\\par", doc)
+
+    def test_export_memory_does_not_grow_with_document(self):
+        lines = ["some text of the document line"] * 200000
+        exporter = TextExporter(lines)
+        for export in (exporter.to_pdf, exporter.to_html, exporter.to_doc):
+            tracemalloc.start()
+            export(self.path)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.assertLess(peak, 4 << 20)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,55 @@
+import datetime
+import os
+import tempfile
+import unittest
+from history_catalog import HistoryCatalog
+
+
+class TestHistoryCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.history_dir = self.tmp.name + "/history/"
+        self.catalog = HistoryCatalog(
+            self.history_dir + "catalog.sqlite", self.history_dir)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_sessions_are_listed_in_order(self):
+        start = datetime.datetime(2026, 1, 1)
+        for i in range(3):
+            self.catalog.record_session(
+                "/docs/a.txt", start + datetime.timedelta(hours=i),
+                {"bob", "alice"}, i, 10 * i)
+        sessions = self.catalog.sessions("/docs/a.txt")
+        self.assertEqual([s.index for s in sessions], [1, 2, 3])
+        self.assertEqual(sessions[0].authors, ["alice", "bob"])
+        second = self.catalog.session("/docs/a.txt", "2")
+        self.assertEqual(second.started, "2026-01-01 01:00:00")
+        self.assertEqual(second.original_file, "2026-01-01 01:00:00.o.cache")
+        self.assertEqual(second.op_count, 1)
+        self.assertEqual(self.catalog.latest("/docs/a.txt").index, 3)
+        self.assertIsNone(self.catalog.session("/docs/a.txt", 4))
+
+    def test_same_name_in_other_dir_is_apart(self):
+        self.catalog.record_session("/docs/a.txt", "s1", [], 0, 0)
+        self.assertEqual(self.catalog.sessions("/other/a.txt"), [])
+        self.assertNotEqual(
+            HistoryCatalog.history_dir_name("/docs/a.txt"),
+            HistoryCatalog.history_dir_name("/other/a.txt"))
+        self.assertIsNone(self.catalog.latest("/other/a.txt"))
+
+    def test_legacy_sessions_are_imported_once(self):
+        os.makedirs(self.history_dir + "a.txt")
+        for name in ("s2.o.cache", "s1.o.cache", "s1.cache"):
+            open(self.history_dir + "a.txt/" + name, "w").close()
+        self.catalog.record_session("/docs/a.txt", "s3", ["u"], 1, 1)
+        sessions = self.catalog.sessions("/docs/a.txt")
+        self.assertEqual([(s.index, s.started, s.dir_name) for s in sessions],
+                         [(1, "s1", "a.txt"), (2, "s2", "a.txt"),
+                          (3, "s3", HistoryCatalog.history_dir_name(
+                              "/docs/a.txt"))])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import datetime
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import change_log
+import history_pack
+import time_travel
+from chunk_store import ChunkStore
+from history_catalog import HistoryCatalog, HistorySession
+from history_retention import HistoryCompactor, RetentionPolicy
+
+NOW = datetime.datetime(2026, 6, 30, 12, 0)
+
+
+def _session(index, days_ago, hours=0):
+    started = NOW - datetime.timedelta(days=days_ago, hours=hours)
+    return HistorySession(index, str(started), [], 0, 0, "dir")
+
+
+class TestRetentionPolicy(unittest.TestCase):
+    def test_recent_and_last_sessions_are_kept(self):
+        sessions = [_session(i, 20 - i) for i in range(1, 21)]
+        kept = RetentionPolicy(keep_last=2, daily_after_days=30).kept(
+            sessions, NOW)
+        self.assertEqual(kept, set(range(1, 21)))
+        kept = RetentionPolicy(keep_last=2, keep_days=5,
+                               daily_after_days=30).kept(sessions, NOW)
+        self.assertEqual(kept, set(range(15, 21)))
+
+    def test_old_sessions_are_thinned_to_daily(self):
+        sessions = [_session(1, 10, 3), _session(2, 10, 2),
+                    _session(3, 9, 1), _session(4, 1, 2), _session(5, 1, 1)]
+        kept = RetentionPolicy(keep_last=1, daily_after_days=7).kept(
+            sessions, NOW)
+        self.assertEqual(kept, {2, 3, 4, 5})
+
+
+class TestHistoryCompactor(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.history = self.tmp.name + "/"
+        self.catalog = HistoryCatalog(self.history + "catalog.sqlite",
+                                      self.history)
+        self.chunks = ChunkStore(self.history + "chunks/")
+        self.file_path = os.path.join(self.tmp.name, "doc.txt")
+        self.dir_path = self.history + HistoryCatalog.history_dir_name(
+            self.file_path)
+        os.makedirs(self.dir_path)
+        self.compactor = HistoryCompactor(
+            RetentionPolicy(keep_last=1, keep_days=5, daily_after_days=30,
+                            pack_after_days=1),
+            self.catalog, self.chunks, self.history)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _add_session(self, days_ago, text):
+        started = NOW - datetime.timedelta(days=days_ago)
+        path = os.path.join(self.dir_path, str(started))
+        self.chunks.write_snapshot(path + ".o.cache", text.encode())
+        change_log.append_records(path + ".cache", [change_log.encode_frame(
+            0, ["insert", (0, 0), (1, 0), "u"])], truncate=True)
+        with open(path + ".blame.cache", "w") as f:
+            f.write("u\n")
+        self.catalog.record_session(self.file_path, started, ["u"], 1, 1)
+        return str(started)
+
+    def test_sessions_are_dropped_and_packed(self):
+        old = self._add_session(10, "old text")
+        packed = self._add_session(3, "kept text")
+        latest = self._add_session(0, "new text")
+        removed, packed_sessions = self.compactor.compact_document(
+            self.file_path, NOW)
+        self.assertEqual([s.started for s in removed], [old])
+        self.assertEqual([s.started for s in packed_sessions], [packed])
+        self.assertEqual([s.index for s in self.catalog.sessions(
+            self.file_path)], [2, 3])
+        names = set(os.listdir(self.dir_path))
+        self.assertNotIn(old + ".o.cache", names)
+        self.assertNotIn(packed + ".cache", names)
+        self.assertIn(packed + ".o.cache", names)
+        self.assertIn(latest + ".cache", names)
+        path = os.path.join(self.dir_path, packed)
+        self.assertEqual(change_log.read_frames(path + ".cache"),
+                         [["insert", (0, 0), (1, 0), "u"]])
+        with history_pack.open_file(path + ".blame.cache", "r") as f:
+            self.assertEqual(f.read(), "u\n")
+        self.assertEqual(self.chunks.read_snapshot(path + ".o.cache"),
+                         "kept text")
+
+    def test_unused_chunks_are_collected(self):
+        self._add_session(10, "old text")
+        self._add_session(0, "new text")
+        self.compactor.compact_document(self.file_path, NOW)
+        self.assertEqual(self.compactor.collect_chunks(), 0)
+        with patch("history_retention._CHUNK_GRACE", -1):
+            self.assertEqual(self.compactor.collect_chunks(), 1)
+        self.assertEqual(len(list(self.chunks.chunk_files())), 1)
+
+    def test_checkpoint_chunks_are_kept(self):
+        started = self._add_session(3, "kept text")
+        self._add_session(0, "new text")
+        path = os.path.join(self.dir_path, started)
+        frame = ["insert", (0, 0), (4, 0), "u"]
+        change_log.append_records(path + ".ops.cache", [
+            change_log.encode_frame(0, frame)], truncate=True)
+        time_travel.write_checkpoints(
+            path + ".checkpoints.cache", "kept text", [(0, frame)],
+            self.chunks)
+        self.compactor.compact_document(self.file_path, NOW)
+        self.assertIn(started + ".checkpoints.cache",
+                      history_pack.packed_names(self.dir_path))
+        with patch("history_retention._CHUNK_GRACE", -1):
+            self.compactor.collect_chunks()
+        versions = time_travel.Versions.load(path, self.chunks)
+        self.assertEqual(list(versions.lines(0)), [" text"])
+
+    def test_removed_session_leaves_pack(self):
+        first = self._add_session(3, "a")
+        second = self._add_session(2, "b")
+        self._add_session(0, "c")
+        self.compactor.compact_document(self.file_path, NOW)
+        history_pack.remove_files(
+            self.dir_path, history_pack.session_files(first))
+        names = history_pack.packed_names(self.dir_path)
+        self.assertIn(second + ".cache", names)
+        self.assertNotIn(first + ".cache", names)
+
+
+if __name__ == "__main__":
+    unittest.main()
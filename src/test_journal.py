@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+from journal import Journal
+from message_parser import MessageParser
+from model import Model
+from test_support import use_temp_data_dir
+
+TEXT = "qwer\nasdf\nzxcv"
+MESSAGES = [
+    "owner -E a",
+    "client -M d",
+    "client -E b",
+    "client -NL",
+    "owner -MS r",
+    "owner -CUT",
+    "client -PASTE xy",
+    "owner -UNDO",
+    "client -D",
+]
+
+
+class TestJournal(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        use_temp_data_dir(self)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.tmp.name, "doc.txt")
+        with open(self.file_path, "w") as f:
+            f.write(TEXT)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _model(self):
+        model = Model(TEXT, "owner", self.file_path)
+        return model, Journal(self.file_path, model, self.tmp.name)
+
+    async def _apply(self, model, journal, messages):
+        parser = MessageParser(model, True, None)
+        for message in messages:
+            args = message.split(" ")
+            if args[0] not in model.users:
+                await model.add_user(args[0])
+            await parser.parse_message(args)
+            journal.record(message)
+
+    def _state(self, model):
+        history = model._history_handler.journal_state()
+        history.pop("session_start")
+        # replayed ops are timed by recovery
+        history["timeline"] = [frame for frame, _ in history["timeline"]]
+        return (
+            model.text_lines.get_text(),
+            dict(model.user_positions),
+            history,
+        )
+
+    async def test_replay_restores_document_and_history(self):
+        model, journal = self._model()
+        await self._apply(model, journal, MESSAGES)
+        journal.record("client -U 0 0")
+        await journal.flush()
+        restored, restored_journal = self._model()
+        self.assertTrue(await restored_journal.recover())
+        self.assertEqual(self._state(restored), self._state(model))
+        self.assertEqual(restored_journal.seq, len(MESSAGES))
+
+    async def test_snapshot_compacts_journal(self):
+        model, journal = self._model()
+        journal._SNAPSHOT_EVERY = 4
+        await self._apply(model, journal, MESSAGES)
+        await journal.flush()
+        with open(journal._log_path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+        restored, restored_journal = self._model()
+        await restored_journal.recover()
+        self.assertEqual(self._state(restored), self._state(model))
+        self.assertEqual(restored._history_handler._session_start,
+                         model._history_handler._session_start)
+
+    async def test_undo_after_snapshot(self):
+        model, journal = self._model()
+        journal._SNAPSHOT_EVERY = 2
+        await self._apply(model, journal, [
+            "owner -E a", "owner -E /s", "client -M d", "client -E b",
+            "owner -UNDO", "client -UNDO", "client -REDO",
+        ])
+        await journal.flush()
+        self.assertEqual(model.text_lines.get_text(), "qwer\nbasdf\nzxcv")
+        restored, restored_journal = self._model()
+        await restored_journal.recover()
+        self.assertEqual(self._state(restored), self._state(model))
+        await model.redo("owner")
+        await restored.redo("owner")
+        self.assertEqual(restored.text_lines.get_text(),
+                         model.text_lines.get_text())
+
+    async def test_torn_tail_is_ignored(self):
+        model, journal = self._model()
+        await self._apply(model, journal, MESSAGES[:3])
+        await journal.flush()
+        with open(journal._log_path, "a") as f:
+            f.write('[4, "client -E')
+        restored, restored_journal = self._model()
+        await restored_journal.recover()
+        self.assertEqual(self._state(restored), self._state(model))
+
+    async def test_closed_journal_has_nothing_to_recover(self):
+        model, journal = self._model()
+        journal.start()
+        await self._apply(model, journal, MESSAGES)
+        await journal.flush()
+        await journal.close()
+        _, restored_journal = self._model()
+        self.assertFalse(await restored_journal.recover())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,7 @@ import os
 import sys
 
 import main as cli
+from history_catalog import HistorySession
 
 
 class TestCLIModule(unittest.TestCase):
@@ -76,60 +77,90 @@ class TestCLIModule(unittest.TestCase):
         cli.host_session(False, "missing.txt", "user")
         mock_print.assert_called_once_with("File does not exist :(")
 
-    @patch("os.makedirs")
-    @patch("os.listdir",
-           return_value=["file1.o.cache", "file2.o.cache", "other.txt"])
+    @patch("main.SessionRegistry")
+    @patch("os.path.isdir", return_value=True)
+    def test_host_session_directory(self, mock_isdir, mock_registry):
+        """Тест запуска сессии для каталога документов"""
+        cli.host_session(False, "docs", "host")
+        mock_registry.assert_called_once_with(
+            "docs", "host", debug=False, history_policy=None)
+        mock_registry.return_value.run.assert_called_once()
+
+    @patch("main.WorkerPool")
+    @patch("os.path.isdir", return_value=True)
+    def test_host_session_workers(self, mock_isdir, mock_pool):
+        """Тест запуска сессии для каталога в нескольких процессах"""
+        cli.host_session(False, "docs", "host", workers=4)
+        mock_pool.assert_called_once_with(
+            "docs", "host", 4, debug=False, history_policy=None)
+        mock_pool.return_value.run.assert_called_once()
+
+    @patch("main.MtTextEditApp")
+    @patch("builtins.open", new_callable=mock_open, read_data="text")
+    def test_host_session_headless(self, mock_file, mock_app):
+        """Тест запуска сессии без терминала"""
+        cli.host_session(False, "file.txt", "host", headless=True)
+        mock_app.return_value.run_headless.assert_called_once()
+        mock_app.return_value.run.assert_not_called()
+
+    @patch("main.HistoryCatalog")
     @patch("builtins.print")
-    def test_list_all_saved_history(
-            self, mock_print, mock_listdir, mock_makedirs):
+    def test_list_all_saved_history(self, mock_print, mock_catalog):
         """Тест вывода истории изменений"""
+        mock_catalog.return_value.sessions.return_value = [
+            HistorySession(1, "file1", [], 0, 0, "dir"),
+            HistorySession(2, "file2", [], 0, 0, "dir"),
+        ]
         cli.list_all_saved_history("/path/to/file.txt")
-        mock_makedirs.assert_called_once_with(
-            os.path.dirname(
-                cli.HISTORY_FILE_PATH +
-                "/file.txt/"), exist_ok=True
-        )
+        mock_catalog.return_value.sessions.assert_called_once_with(
+            "/path/to/file.txt")
         self.assertEqual(mock_print.call_count, 2)
         mock_print.assert_any_call("file1\t1")
         mock_print.assert_any_call("file2\t2")
 
     @patch("main.MtTextEditApp")
-    @patch("builtins.open", mock_open(read_data="history content"))
-    @patch("os.listdir", return_value=["file1.o.cache", "file2.o.cache"])
-    def test_show_changes_success(self, mock_listdir, mock_app):
+    @patch("builtins.open", mock_open(read_data=b"history content"))
+    @patch("main.HistoryCatalog")
+    def test_show_changes_success(self, mock_catalog, mock_app):
         """Тест просмотра изменений"""
+        mock_catalog.return_value.session.return_value = HistorySession(
+            1, "file1", [], 0, 0, "dir")
         cli.show_changes("/path/to/file.txt", "1")
+        mock_catalog.return_value.session.assert_called_once_with(
+            "/path/to/file.txt", "1")
         mock_app.assert_called_once_with("view_changes", "history content")
         mock_app.return_value.show_changes.assert_called_once_with(
-            "/file.txt", "file1.o.cache"
+            "dir", "file1.o.cache", at=None
         )
 
     @patch("builtins.print")
-    @patch("builtins.open", side_effect=FileExistsError)
-    # Возвращаем непустой список
-    @patch("os.listdir", return_value=["file1.o.cache"])
-    def test_show_changes_failure(self, mock_listdir, mock_open, mock_print):
+    @patch("builtins.open", side_effect=FileNotFoundError)
+    @patch("main.HistoryCatalog")
+    def test_show_changes_failure(self, mock_catalog, mock_open, mock_print):
         """Тест просмотра несуществующих изменений"""
+        mock_catalog.return_value.session.return_value = HistorySession(
+            1, "file1", [], 0, 0, "dir")
         cli.show_changes("/path/to/file.txt", "1")
         mock_print.assert_called_once_with("no such changes file found, :(")
 
     @patch("main.MtTextEditApp")
-    @patch("builtins.open", mock_open(read_data="blame content"))
-    @patch("os.listdir", return_value=["file1.o.cache", "file2.o.cache"])
-    def test_show_blame_success(self, mock_listdir, mock_app):
+    @patch("builtins.open", mock_open(read_data=b"blame content"))
+    @patch("main.HistoryCatalog")
+    def test_show_blame_success(self, mock_catalog, mock_app):
         """Тест просмотра blame"""
+        mock_catalog.return_value.session.return_value = HistorySession(
+            1, "file1", [], 0, 0, "dir")
         cli.show_blame("/path/to/file.txt", "1")
         mock_app.assert_called_once_with("view_blame", "blame content")
         mock_app.return_value.show_blame.assert_called_once_with(
-            "/file.txt", "file1.o.cache"
+            "dir", "file1.o.cache"
         )
 
     @patch("builtins.print")
-    @patch("builtins.open", side_effect=Exception)
-    # Возвращаем непустой список
-    @patch("os.listdir", return_value=["file1.o.cache"])
-    def test_show_blame_failure(self, mock_listdir, mock_open, mock_print):
+    @patch("main.HistoryCatalog")
+    def test_show_blame_failure(self, mock_catalog, mock_print):
         """Тест просмотра несуществующего blame"""
+        mock_catalog.return_value.session.return_value = None
         cli.show_blame("/path/to/file.txt", "1")
         mock_print.assert_called_once_with("no such changes file found, :(")
 
@@ -162,7 +193,17 @@ class TestCLIModule(unittest.TestCase):
         # Создаем фейковые аргументы командной строки
         with patch.object(sys, 'argv', ['prog', '-C', '192.168.0.1', 'user']):
             cli.main()
-            mock_connect.assert_called_once_with(False, '192.168.0.1', 'user')
+            mock_connect.assert_called_once_with(
+                False, '192.168.0.1', 'user', None)
+
+    @patch("main.connect_to_session")
+    def test_main_c_document(self, mock_connect):
+        """Тест обработки аргумента -C с --doc"""
+        with patch.object(sys, 'argv', ['prog', '-C', '192.168.0.1', 'user',
+                                        '--doc', 'notes.txt']):
+            cli.main()
+            mock_connect.assert_called_once_with(
+                False, '192.168.0.1', 'user', 'notes.txt')
 
     @patch("main.host_session")
     def test_main_h(self, mock_host):
@@ -170,7 +211,17 @@ class TestCLIModule(unittest.TestCase):
         # Создаем фейковые аргументы командной строки
         with patch.object(sys, 'argv', ['prog', '-H', 'file.txt', 'host']):
             cli.main()
-            mock_host.assert_called_once_with(False, 'file.txt', 'host')
+            mock_host.assert_called_once_with(
+                False, 'file.txt', 'host', False, 1, None)
+
+    @patch("main.host_session")
+    def test_main_h_headless(self, mock_host):
+        """Тест обработки аргумента -H с --headless"""
+        with patch.object(
+                sys, 'argv', ['prog', '-H', 'file.txt', 'host', '--headless']):
+            cli.main()
+            mock_host.assert_called_once_with(
+                False, 'file.txt', 'host', True, 1, None)
 
     @patch("main.list_all_saved_history")
     def test_main_chh(self, mock_list):
@@ -186,7 +237,7 @@ class TestCLIModule(unittest.TestCase):
         # Создаем фейковые аргументы командной строки
         with patch.object(sys, 'argv', ['prog', '-CH', 'file.txt', '1']):
             cli.main()
-            mock_show.assert_called_once_with('file.txt', '1')
+            mock_show.assert_called_once_with('file.txt', '1', None)
 
     @patch("main.show_blame")
     def test_main_b(self, mock_show):
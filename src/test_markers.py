@@ -0,0 +1,139 @@
+import random
+import unittest
+from markers import LEFT, RIGHT, MarkerIndex, MarkerMap
+from text_buffer import ListTextBuffer, RopeTextBuffer
+
+
+class TestMarkerIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = MarkerIndex()
+
+    def test_insert_gravity(self):
+        left = self.index.add(5, LEFT)
+        right = self.index.add(5, RIGHT)
+        before = self.index.add(2)
+        self.index.insert(5, 3)
+        self.assertEqual(self.index.offset(left), 5)
+        self.assertEqual(self.index.offset(right), 8)
+        self.assertEqual(self.index.offset(before), 2)
+
+    def test_delete_collapses_markers(self):
+        markers = [self.index.add(i) for i in range(10)]
+        self.index.delete(3, 6)
+        self.assertEqual(
+            [self.index.offset(m) for m in markers],
+            [0, 1, 2, 3, 3, 3, 3, 4, 5, 6],
+        )
+
+    def test_keep_group(self):
+        own = self.index.add(4, group="owner")
+        other = self.index.add(4, group="client")
+        self.index.insert(0, 2, keep_group="owner")
+        self.assertEqual(self.index.offset(own), 4)
+        self.assertEqual(self.index.offset(other), 6)
+        self.index.delete(0, 2, keep_group="client")
+        self.assertEqual(self.index.offset(own), 2)
+        self.assertEqual(self.index.offset(other), 6)
+
+    def test_move_and_remove(self):
+        marker = self.index.add(4)
+        self.index.insert(0, 10)
+        self.index.move(marker, 1)
+        self.assertEqual(self.index.offset(marker), 1)
+        self.index.remove(marker)
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index._trees, {})
+
+    def test_random_edits(self):
+        rnd = random.Random(7)
+        markers = []
+        expected = []
+        for _ in range(100):
+            offset = rnd.randrange(200)
+            gravity = rnd.choice((LEFT, RIGHT))
+            markers.append(self.index.add(offset, gravity))
+            expected.append([offset, gravity])
+        for _ in range(300):
+            start = rnd.randrange(200)
+            length = rnd.randrange(1, 10)
+            if rnd.random() < 0.5:
+                self.index.insert(start, length)
+                for item in expected:
+                    if item[0] > start or (
+                        item[0] == start and item[1] == RIGHT
+                    ):
+                        item[0] += length
+            else:
+                stop = start + length
+                self.index.delete(start, stop)
+                for item in expected:
+                    if item[0] >= stop:
+                        item[0] -= length
+                    elif item[0] > start:
+                        item[0] = start
+            if rnd.random() < 0.1:
+                i = rnd.randrange(len(markers))
+                self.index.remove(markers.pop(i))
+                expected.pop(i)
+        self.assertEqual(
+            [self.index.offset(m) for m in markers],
+            [item[0] for item in expected],
+        )
+
+
+class TestMarkerMap(unittest.TestCase):
+    buffer_cls = ListTextBuffer
+
+    def setUp(self):
+        self.buffer = self.buffer_cls("qwer\nasdf\nzxcv")
+        self.positions = MarkerMap(self.buffer)
+
+    def test_positions_follow_edits(self):
+        self.positions["a"] = (2, 1)
+        self.positions["b"] = (0, 2)
+        self.buffer.insert_text((1, 1), "12\n3")
+        self.assertEqual(self.positions["a"], (2, 2))
+        self.assertEqual(self.positions["b"], (0, 3))
+        self.buffer.delete_range((0, 0), (1, 2))
+        self.assertEqual(self.positions["a"], (1, 0))
+        self.assertEqual(self.positions["b"], (0, 1))
+
+    def test_plain_values(self):
+        frame = MarkerMap(self.buffer, gravity_by_key={"user_pos": RIGHT})
+        frame["user_pos"] = (1, 0)
+        frame["text_cut"] = "qw"
+        frame["shifted_pos"] = None
+        self.buffer.insert_text((0, 0), "12")
+        self.assertEqual(
+            dict(frame),
+            {"user_pos": (3, 0), "text_cut": "qw", "shifted_pos": None},
+        )
+        frame.release()
+        self.assertEqual(len(self.buffer.markers), 0)
+
+    def test_group_by_key(self):
+        positions = MarkerMap(self.buffer, group_by_key=True)
+        positions["owner"] = (2, 0)
+        positions["client"] = (2, 0)
+        self.buffer.insert_text((0, 0), "1", "owner")
+        self.assertEqual(positions["owner"], (2, 0))
+        self.assertEqual(positions["client"], (3, 0))
+        del positions["client"]
+        # tree of gone group is not visited by later edits
+        self.assertEqual(
+            [group for group, _ in self.buffer.markers._trees], ["owner"])
+
+    def test_set_text_keeps_positions(self):
+        self.positions["a"] = (3, 2)
+        self.buffer.set_text("q\nw")
+        self.assertEqual(self.positions["a"], (1, 1))
+        del self.positions["a"]
+        self.assertEqual(len(self.positions), 0)
+
+
+class TestRopeMarkerMap(TestMarkerMap):
+    buffer_cls = RopeTextBuffer
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -30,6 +30,27 @@ class TestMessageParser(unittest.IsolatedAsyncioTestCase):
         await self.msg_parser.parse_message("owner -T text\n text".split(' '))
         self.assertEqual(self.model.text_lines[0], "text")
 
+    async def test_streamed_snapshot(self):
+        await self.msg_parser.parse_message(
+            "owner -U owner 0 0 \n\x1E".split(' '))
+        await self.msg_parser.parse_message("owner -TS 3".split(' '))
+        await self.msg_parser.parse_message("owner -TC ab c\nd".split(' '))
+        self.assertEqual(list(self.model.text_lines), ["ab c", "d"])
+        self.assertEqual(self.model.user_positions["oo"], (0, 0))
+        await self.msg_parser.parse_message("owner -E z".split(' '))
+        self.assertEqual(list(self.model.text_lines), ["ab c", "d"])
+        await self.msg_parser.parse_message("owner -TC ef".split(' '))
+        await self.msg_parser.parse_message("owner -TE 3".split(' '))
+        self.assertEqual(list(self.model.text_lines), ["zab c", "def"])
+
+    async def test_full_snapshot_cancels_stream(self):
+        await self.msg_parser.parse_message("owner -TS 3".split(' '))
+        await self.msg_parser.parse_message("owner -E z".split(' '))
+        await self.msg_parser.parse_message("owner -T new".split(' '))
+        await self.msg_parser.parse_message("owner -TC old".split(' '))
+        await self.msg_parser.parse_message("owner -TE 3".split(' '))
+        self.assertEqual(list(self.model.text_lines), ["new"])
+
     async def test_user_wrote(self):
         await self.msg_parser.parse_message("owner -E z".split(' '))
         self.assertEqual(self.model.text_lines[0][0], 'z')
@@ -61,6 +82,19 @@ class TestMessageParser(unittest.IsolatedAsyncioTestCase):
         await self.msg_parser.parse_message("owner -CUT".split(' '))
         self.assertEqual(self.model.text_lines[0][0], 'w')
 
+    async def test_batch(self):
+        await self.msg_parser.parse_message(
+            "owner -B -E a \x1F -E /s \x1F -M r \x1F -D \x1F -NL \n\x1E"
+            .split(' '))
+        self.assertEqual(self.model.text_lines[0], "a ")
+        self.assertEqual(self.model.text_lines[1], "wer")
+        self.assertEqual(self.model.user_positions["owner"], (0, 1))
+
+    async def test_batch_skips_payload_ops(self):
+        await self.msg_parser.parse_message(
+            "owner -B -T x \x1F -E a".split(' '))
+        self.assertEqual(self.model.text_lines[0], "aqwer")
+
     async def test_undo_redo(self):
         await self.msg_parser.parse_message("owner -MS r".split(' '))
         await self.msg_parser.parse_message("owner -CUT".split(' '))
@@ -1,11 +1,17 @@
 # test_view_module.py
+import asyncio
+import os
+import subprocess
+import sys
 import unittest
 from unittest import mock
 from model import Model
+from test_support import use_temp_data_dir
 
 
 class TestModel(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
+        use_temp_data_dir(self)
         self.model = Model("qwer\nqwer\nqwer", "owner", "./testfile")
 
     @mock.patch('builtins.open', new_callable=mock.mock_open)
@@ -21,12 +27,14 @@ class TestModel(unittest.IsolatedAsyncioTestCase):
         await self.model.undo("owner")
         await self.model.redo("owner")
         self.assertEqual(self.model.text_lines[0][0], 'q')
-        with mock.patch("shutil.copy") as mock_copy:
+        with mock.patch("chunk_store.ChunkStore.copy_snapshot") as mock_copy, \
+                mock.patch("time_travel.write_checkpoints") as mock_versions:
             with mock.patch("os.remove") as mock_os_remove:
                 await self.model.save_file()
                 await self.model.save_changes_history()
                 mock_open.assert_called()
                 mock_copy.assert_called()
+                mock_versions.assert_called_once()
                 mock_os_remove.assert_called()
 
     @mock.patch('builtins.open', new_callable=mock.mock_open)
@@ -51,16 +59,123 @@ class TestModel(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(self.model.text_lines[2], "")
         self.assertEqual(self.model.text_lines[3], "cwer")
         self.assertEqual(self.model.text_lines[4], "qwer")
-        with mock.patch("shutil.copy") as mock_copy:
+        with mock.patch("chunk_store.ChunkStore.copy_snapshot") as mock_copy, \
+                mock.patch("time_travel.write_checkpoints") as mock_versions:
             with mock.patch("os.remove") as mock_os_remove:
                 await self.model.save_file()
                 await self.model.save_changes_history()
                 mock_open.assert_called()
                 mock_copy.assert_called()
+                mock_versions.assert_called_once()
                 mock_os_remove.assert_called()
         await self.model.user_disconnected("client")
         self.assertTrue("client" not in self.model.users)
 
+    async def test_edits_signal_view(self):
+        self.model.text_lines.take_dirty()
+        self.model._changed.clear()
+        await self.model.user_pos_shifted_right("owner")
+        self.assertTrue(self.model._changed.is_set())
+        self.assertEqual(self.model.text_lines.take_dirty(), (set(), None))
+        self.model._changed.clear()
+        await self.model.user_wrote_char("owner", "c")
+        self.assertTrue(self.model._changed.is_set())
+        self.assertEqual(self.model.text_lines.take_dirty(), ({0}, None))
+
+    @mock.patch("view.View")
+    async def test_view_is_drawn_only_after_changes(self, mock_view):
+        self.model._FRAME_INTERVAL = 0.01
+        draw = mock_view.return_value.draw_text
+        task = asyncio.create_task(self.model.render_view(mock.Mock()))
+        await asyncio.sleep(0.05)
+        self.assertEqual(draw.call_count, 1)
+        for char in "abc":
+            await self.model.user_wrote_char("owner", char)
+        await asyncio.sleep(0.05)
+        # edits made within one frame are drawn together
+        self.assertEqual(draw.call_count, 2)
+        self.model.set_status("status")
+        await asyncio.sleep(0.05)
+        self.assertEqual(draw.call_args.kwargs["status"], "status")
+        await self.model.stop_view()
+        await asyncio.wait_for(task, 1)
+
+    async def test_typed_words_are_undone_at_once(self):
+        for char in "ab cd":
+            await self.model.user_wrote_char("owner", char)
+        self.assertEqual(self.model.text_lines[0], "ab cdqwer")
+        self.assertEqual(len(self.model._action_stack_by_user["owner"]), 2)
+        await self.model.undo("owner")
+        self.assertEqual(self.model.text_lines[0], "ab qwer")
+        self.assertEqual(await self.model.get_user_pos("owner"), (3, 0))
+        await self.model.undo("owner")
+        self.assertEqual(self.model.text_lines[0], "qwer")
+        await self.model.redo("owner")
+        await self.model.redo("owner")
+        self.assertEqual(self.model.text_lines[0], "ab cdqwer")
+        self.assertEqual(await self.model.get_user_pos("owner"), (5, 0))
+
+    async def test_remote_edit_breaks_group(self):
+        await self.model.add_user("client")
+        await self.model.user_wrote_char("owner", "a")
+        await self.model.user_pos_shifted_down("client")
+        await self.model.user_wrote_char("client", "c")
+        await self.model.user_wrote_char("owner", "b")
+        await self.model.undo("owner")
+        self.assertEqual(self.model.text_lines[0], "aqwer")
+        await self.model.undo("owner")
+        await self.model.redo("owner")
+        self.assertEqual(self.model.text_lines[0], "aqwer")
+        self.assertEqual(self.model.text_lines[1], "qcwer")
+
+    async def test_frames_follow_remote_edits(self):
+        await self.model.add_user("client")
+        await self.model.user_pos_shifted_right("owner")
+        await self.model.user_wrote_char("owner", "a")
+        await self.model.user_wrote_char("client", "1")
+        await self.model.user_wrote_char("client", "\n")
+        self.assertEqual(list(self.model.text_lines)[:2], ["1", "qawer"])
+        await self.model.undo("owner")
+        self.assertEqual(list(self.model.text_lines)[:2], ["1", "qwer"])
+        self.assertEqual(await self.model.get_user_pos("owner"), (1, 1))
+        await self.model.redo("owner")
+        self.assertEqual(list(self.model.text_lines)[:2], ["1", "qawer"])
+        self.assertEqual(await self.model.get_user_pos("owner"), (2, 1))
+        self.assertEqual(len(self.model.text_lines.markers), 8)
+
+    async def test_grouped_undo_follows_remote_edits(self):
+        await self.model.add_user("client")
+        for char in "hello":
+            await self.model.user_wrote_char("owner", char)
+        await self.model.user_pos_update("client", 2, 0)
+        await self.model.user_wrote_char("client", "Z")
+        await self.model.user_pos_update("client", 6, 0)
+        await self.model.user_wrote_char("client", "!")
+        self.assertEqual(self.model.text_lines[0], "heZllo!qwer")
+        await self.model.undo("owner")
+        # chars of other user inside and after the word stay
+        self.assertEqual(self.model.text_lines[0], "Z!qwer")
+        await self.model.redo("owner")
+        self.assertEqual(self.model.text_lines[0], "helloZ!qwer")
+
+    def test_model_does_not_import_curses(self):
+        code = "import sys, model; sys.exit('curses' in sys.modules)"
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        self.assertEqual(result.returncode, 0)
+
+    async def test_undo_depth_is_limited(self):
+        model = Model("qwer", "owner", max_undo_depth=3)
+        for i in range(5):
+            await model.user_added_new_line("owner")
+        self.assertEqual(len(model._action_stack_by_user["owner"]), 3)
+        for i in range(5):
+            await model.undo("owner")
+        self.assertEqual(len(model.text_lines), 3)
+
+
 
 if __name__ == '__main__':
     unittest.main()
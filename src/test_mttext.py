@@ -1,12 +1,22 @@
+import os
+import signal
+import tempfile
 import unittest
-from unittest.mock import patch, MagicMock, AsyncMock
+from unittest.mock import patch, ANY, MagicMock, AsyncMock
 import asyncio
 import curses
+from client_writer import ClientWriter
+from codec import BinaryCodec, TextCodec
+from model import Model
+from message_parser import MessageParser
 from mttext_app import MtTextEditApp
+from text_buffer import ListTextBuffer, RopeTextBuffer
+from test_support import use_temp_data_dir
 
 
 class TestMtTextEditApp(unittest.IsolatedAsyncioTestCase):
     async def asyncSetUp(self):
+        use_temp_data_dir(self)
         self.app = MtTextEditApp(
             "test_user", "test\ntext", file_path="/tmp/test.txt")
         self.app.stdscr = MagicMock()
@@ -62,6 +72,18 @@ class TestMtTextEditApp(unittest.IsolatedAsyncioTestCase):
         await self.app.stop()
         self.assertTrue(self.app._stop)
 
+    async def test_headless_main_stops_on_signal(self):
+        self.app._PORT = 0
+        self.app._server_producer_handler = AsyncMock()
+        with patch('builtins.print'):
+            task = asyncio.create_task(self.app._headless_main())
+            await asyncio.sleep(0.01)
+            self.app._on_stop_signal()
+            await asyncio.wait_for(task, 1)
+        self.app._model.save_file.assert_called_once()
+        self.app._model.save_changes_history.assert_called_once()
+        self.assertTrue(self.app._stop)
+
     async def test_send(self):
         with patch.object(self.app._send_queue,
                           'put', new_callable=AsyncMock) as mock_put:
@@ -88,13 +110,66 @@ class TestMtTextEditApp(unittest.IsolatedAsyncioTestCase):
         await self.app._parse_key(65)  # 'A'
         mock_send.assert_called_once()
 
-    @patch('asyncio.sleep', new_callable=AsyncMock)
     @patch('curses.raw')
     @patch('curses.cbreak')
-    async def test_input_handler(self, mock_cbreak, mock_raw, mock_sleep):
-        self.app.stdscr.getch = MagicMock(side_effect=[65, -1, -1, -1, -1])
-        self.app._stop = True
-        await self.app._input_handler()
+    async def test_input_handler(self, mock_cbreak, mock_raw):
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+
+        def getch():
+            try:
+                return os.read(read_fd, 1)[0]
+            except BlockingIOError:
+                return -1
+
+        parsed = []
+
+        async def parse_key(key):
+            parsed.append(key)
+            if len(parsed) == 3:
+                self.app._stop = True
+
+        self.app.stdscr.getch = MagicMock(side_effect=getch)
+        self.app._parse_key = parse_key
+        with patch('sys.stdin') as mock_stdin:
+            mock_stdin.fileno.return_value = read_fd
+            task = asyncio.create_task(self.app._input_handler())
+            await asyncio.sleep(0.05)
+            self.assertFalse(task.done())
+            os.write(write_fd, b"ABC")
+            await asyncio.wait_for(task, 1)
+        # all pending keys are handled in one wakeup
+        self.assertEqual(parsed, [65, 66, 67])
+        # one empty read at start and one after the keys
+        self.assertEqual(self.app.stdscr.getch.call_count, 5)
+
+    @patch('curses.resizeterm')
+    @patch('curses.raw')
+    @patch('curses.cbreak')
+    async def test_resize_is_drawn_without_key(
+            self, mock_cbreak, mock_raw, mock_resizeterm):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        self.app.stdscr.getch = MagicMock(return_value=-1)
+        with patch('sys.stdin') as mock_stdin, \
+                patch('os.get_terminal_size',
+                      return_value=os.terminal_size((100, 40))):
+            mock_stdin.fileno.return_value = read_fd
+            task = asyncio.create_task(self.app._input_handler())
+            await asyncio.sleep(0.01)
+            os.kill(os.getpid(), signal.SIGWINCH)
+            for _ in range(100):
+                if self.app._model.redraw.called:
+                    break
+                await asyncio.sleep(0.01)
+            self.app._stop = True
+            self.app._keys_ready.set()
+            await asyncio.wait_for(task, 1)
+        mock_resizeterm.assert_called_once_with(40, 100)
+        self.app._model.redraw.assert_called_once()
 
     async def test_consumer_handler(self):
         mock_reader = MagicMock()
@@ -119,6 +194,60 @@ class TestMtTextEditApp(unittest.IsolatedAsyncioTestCase):
         self.app._stop = True
         await self.app._server_producer_handler()
 
+    async def test_producer_handler_waits_for_queue(self):
+        mock_writer = MagicMock()
+        mock_writer.drain = AsyncMock()
+        task = asyncio.create_task(self.app._producer_handler(mock_writer))
+        await asyncio.sleep(0)
+        mock_writer.write.assert_not_called()
+        await self.app.send("test")
+        await self.app.send(MtTextEditApp._STOP_MESSAGE)
+        await asyncio.wait_for(task, 1)
+        mock_writer.write.assert_called_once_with(
+            b"test" + MtTextEditApp._DELIMITER)
+
+    async def test_producer_handler_batches_edits(self):
+        mock_writer = MagicMock()
+        mock_writer.drain = AsyncMock()
+        for message in ["u -E a", "u -E /s", "u -D", "u -PASTE x y",
+                        "u -NL", MtTextEditApp._STOP_MESSAGE]:
+            await self.app.send(message)
+        await self.app._producer_handler(mock_writer)
+        frames = [c.args[0] for c in mock_writer.write.call_args_list]
+        self.assertEqual(frames, [
+            b"u -B -E a \x1f -E /s \x1f -D" + MtTextEditApp._DELIMITER,
+            b"u -PASTE x y" + MtTextEditApp._DELIMITER,
+            b"u -NL" + MtTextEditApp._DELIMITER,
+        ])
+
+    @patch('asyncio.sleep', new_callable=AsyncMock)
+    async def test_stop_flushes_producer(self, mock_sleep):
+        mock_writer = MagicMock()
+        mock_writer.drain = AsyncMock()
+        client = ClientWriter(mock_writer, "client", TextCodec())
+        client.start()
+        self.app._writers = [client]
+        self.app._producer_task = asyncio.create_task(
+            self.app._server_producer_handler())
+        await self.app.stop()
+        self.assertTrue(self.app._producer_task.done())
+        mock_writer.write.assert_called_once_with(
+            b"test_user -DCH" + MtTextEditApp._DELIMITER)
+        mock_writer.close.assert_called_once()
+
+    async def test_server_producer_handler_targeted_message(self):
+        first, second = MagicMock(), MagicMock()
+        self.app._writers = [first, second]
+        await self.app.send("everyone")
+        await self.app.send("only first", first)
+        await self.app.send(MtTextEditApp._STOP_MESSAGE)
+        first.finish = AsyncMock()
+        second.finish = AsyncMock()
+        await self.app._server_producer_handler()
+        first.offer.assert_any_call("everyone")
+        first.offer.assert_any_call("only first")
+        second.offer.assert_called_once_with("everyone")
+
     @patch.object(MtTextEditApp, 'send', new_callable=AsyncMock)
     async def test_connection_handler_valid(self, mock_send):
         mock_reader = MagicMock()
@@ -131,6 +260,105 @@ class TestMtTextEditApp(unittest.IsolatedAsyncioTestCase):
         await self.app._connection_handler(mock_reader, mock_writer)
         mock_send.assert_called()
 
+    @patch.object(MtTextEditApp, 'send', new_callable=AsyncMock)
+    async def test_connection_handler_negotiates_binary(self, mock_send):
+        mock_reader = MagicMock()
+        mock_reader.readuntil = AsyncMock(
+            return_value=b"user -C user binary" + MtTextEditApp._DELIMITER)
+        mock_writer = MagicMock()
+        mock_writer.drain = AsyncMock()
+        self.app._permissions = {"user": "rw"}
+        self.app._writers = []
+        self.app._consumer_handler = AsyncMock()
+        await self.app._connection_handler(mock_reader, mock_writer)
+        client = self.app._writers[0]
+        self.assertIsInstance(client.codec, BinaryCodec)
+        self.app._consumer_handler.assert_called_once_with(
+            mock_reader, client.codec)
+        await client.finish()
+        mock_writer.write.assert_called_once_with(
+            b"test_user -PROTO binary" + MtTextEditApp._DELIMITER)
+
+    @patch.object(MtTextEditApp, 'send', new_callable=AsyncMock)
+    async def test_connection_handler_streams_snapshot(self, mock_send):
+        mock_reader = MagicMock()
+        mock_reader.readuntil = AsyncMock(
+            return_value=b"user -C user chunks" + MtTextEditApp._DELIMITER)
+        mock_writer = MagicMock()
+        mock_writer.drain = AsyncMock()
+        self.app._permissions = {"user": "rw"}
+        self.app._writers = []
+        self.app._consumer_handler = AsyncMock()
+        self.app._model.users = ["test_user"]
+        self.app._model.text_lines = ListTextBuffer("abc def\n\nghijklm")
+        self.app._model.text_lines.generation = 7
+        self.app._SNAPSHOT_CHUNK_SIZE = 4
+        await self.app._connection_handler(mock_reader, mock_writer)
+        client = self.app._writers[0]
+        sent = [call.args[0] for call in mock_send.call_args_list]
+        self.assertEqual(sent, [
+            "test_user -U test_user 0 0",
+            "test_user -TS 7",
+            "test_user -TC abc ",
+            "test_user -TC def\n",
+            "test_user -TC \nghi",
+            "test_user -TC jklm",
+            "test_user -TE 7",
+        ])
+        self.assertTrue(all(
+            call.args[1] is client for call in mock_send.call_args_list))
+        await client.finish()
+
+    @patch.object(MtTextEditApp, 'send', new_callable=AsyncMock)
+    async def test_streamed_snapshot_ignores_later_edits(self, mock_send):
+        lines = RopeTextBuffer("abc def\n\nghijklm")
+        self.app._model.text_lines = lines
+        self.app._SNAPSHOT_CHUNK_SIZE = 4
+        client = ClientWriter(MagicMock(), "client", TextCodec())
+
+        async def edit(message, _):
+            if " -TC " in message:
+                lines.insert_text((0, 0), "x")
+
+        mock_send.side_effect = edit
+        with patch.object(RopeTextBuffer, "snapshot",
+                          wraps=lines.snapshot) as mock_snapshot:
+            await self.app._stream_snapshot(client)
+        mock_snapshot.assert_called_once()
+        chunks = [call.args[0].split(" -TC ", 1)[1]
+                  for call in mock_send.call_args_list
+                  if " -TC " in call.args[0]]
+        self.assertEqual("".join(chunks), "abc def\n\nghijklm")
+
+    def test_snapshot_chunks_split_long_lines(self):
+        self.app._SNAPSHOT_CHUNK_SIZE = 3
+        chunks = list(self.app._snapshot_chunks(["abcdefg", "h"]))
+        self.assertEqual(chunks, ["abc", "def", "g\nh"])
+        self.assertEqual(list(self.app._snapshot_chunks([""])), [])
+
+    async def test_handshake_switches_to_binary(self):
+        mock_reader = MagicMock()
+        mock_reader.readuntil = AsyncMock(
+            return_value=b"host -PROTO binary" + MtTextEditApp._DELIMITER)
+        mock_writer = MagicMock()
+        mock_writer.drain = AsyncMock()
+        await self.app._handshake(mock_reader, mock_writer)
+        mock_writer.write.assert_called_once_with(
+            b"test_user -C test_user binary chunks"
+            + MtTextEditApp._DELIMITER)
+        self.assertIsInstance(self.app._codec, BinaryCodec)
+
+    async def test_handshake_with_old_host(self):
+        mock_reader = MagicMock()
+        mock_reader.readuntil = AsyncMock(
+            return_value=b"host -U host 0 0" + MtTextEditApp._DELIMITER)
+        mock_writer = MagicMock()
+        mock_writer.drain = AsyncMock()
+        self.app._msg_parser.parse_message = AsyncMock()
+        await self.app._handshake(mock_reader, mock_writer)
+        self.assertIsInstance(self.app._codec, TextCodec)
+        self.app._msg_parser.parse_message.assert_called_once()
+
     @patch('builtins.open')
     def test_load_permissions_exists(self, mock_open):
         mock_file = MagicMock()
@@ -149,26 +377,77 @@ class TestMtTextEditApp(unittest.IsolatedAsyncioTestCase):
         self.app._load_permissions()
         self.assertEqual(self.app._permissions, {})
 
-    @patch('convert.TextExporter')
+    @patch('mttext_app.TextExporter')
     async def test_save_as_html(self, mock_exporter):
-        self.app._converter = mock_exporter.return_value
         await self.app.save_as_html()
+        await self.app.wait_exports()
         mock_exporter.return_value.to_html.assert_called_once_with(
-            "/tmp/test.txt")
+            "/tmp/test.txt", progress=ANY)
 
-    @patch('convert.TextExporter')
+    @patch('mttext_app.TextExporter')
     async def test_save_as_doc(self, mock_exporter):
-        self.app._converter = mock_exporter.return_value
         await self.app.save_as_doc()
+        await self.app.wait_exports()
         mock_exporter.return_value.to_doc.assert_called_once_with(
-            "/tmp/test.txt")
+            "/tmp/test.txt", progress=ANY)
 
-    @patch('convert.TextExporter')
+    @patch('mttext_app.TextExporter')
     async def test_save_as_pdf(self, mock_exporter):
-        self.app._converter = mock_exporter.return_value
         await self.app.save_as_pdf()
+        await self.app.wait_exports()
         mock_exporter.return_value.to_pdf.assert_called_once_with(
-            "/tmp/test.txt")
+            "/tmp/test.txt", progress=ANY)
+
+    async def test_export_all_uses_snapshot(self):
+        self.app._model = Model("test\ntext", "testuser")
+        with tempfile.TemporaryDirectory() as tmp:
+            self.app._file_path = os.path.join(tmp, "doc")
+            await self.app.export_all()
+            self.assertEqual(set(self.app._export_tasks),
+                             {"pdf", "html", "doc"})
+            await self.app._model.user_wrote_char("testuser", "Z")
+            await self.app.wait_exports()
+            with open(self.app._file_path + ".html") as f:
+                self.assertIn("<p>test</p>", f.read())
+            self.assertTrue(os.path.exists(self.app._file_path + ".pdf"))
+            self.assertTrue(os.path.exists(self.app._file_path + ".doc"))
+        self.assertIsNone(self.app._model.status)
+
+    async def test_resync_of_initialized_client(self):
+        self.app._model = Model("qwer\nqwer", "test_user")
+        snapshot = await self.app._snapshot_messages()
+        await self.app._model.add_user("client")
+        reader = asyncio.StreamReader()
+        writer = MagicMock()
+        writer.write = reader.feed_data
+        writer.drain = AsyncMock()
+        client = ClientWriter(
+            writer, "client", TextCodec(), 2, ClientWriter.RESYNC)
+        self.app._writers = [client]
+        client_model = Model("", "client")
+        parser = MessageParser(client_model, False, "client")
+        client.start()
+        for message in snapshot:
+            client.offer(message)
+        while client.depth:
+            await asyncio.sleep(0)
+        for _ in snapshot:
+            await parser.parse_message(await TextCodec().read_args(reader))
+        for char in "abc":
+            await self.app._model.user_wrote_char("test_user", char)
+        await self.app._model.user_pos_update("client", 1, 1)
+        # client is too slow for these edits, queue overflows
+        for char in "abc":
+            client.offer(f"test_user -E {char}")
+        self.assertTrue(client.needs_resync)
+        await self.app._resync_clients()
+        await client.finish()
+        reader.feed_eof()
+        while not reader.at_eof():
+            await parser.parse_message(await TextCodec().read_args(reader))
+        self.assertEqual(list(client_model.text_lines), ["abcqwer", "qwer"])
+        self.assertEqual(client_model.user_positions["test_user"], (3, 0))
+        self.assertEqual(client_model.user_positions["client"], (1, 1))
 
 
 if __name__ == '__main__':
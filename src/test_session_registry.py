@@ -0,0 +1,118 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+from codec import TextCodec
+from history_retention import RetentionPolicy
+from session_registry import SessionRegistry, document_from_args
+from test_support import use_temp_data_dir
+
+
+class TestSessionRegistry(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        use_temp_data_dir(self)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        os.makedirs(os.path.join(self.root, "sub"))
+        for name, text in (("a.txt", "first"), ("sub/b.txt", "second")):
+            with open(os.path.join(self.root, name), "w") as f:
+                f.write(text)
+        self.registry = SessionRegistry(self.root, "host", idle_timeout=60)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def asyncTearDown(self):
+        with patch("mttext_app.MtTextEditApp.shutdown", new=AsyncMock()):
+            await self.registry.close_all()
+
+    def test_document_from_args(self):
+        args = "u -C u binary chunks doc=sub/b.txt \n\x1E".split(" ")
+        self.assertEqual(document_from_args(args), "sub/b.txt")
+        self.assertIsNone(document_from_args("u -C u binary".split(" ")))
+
+    def test_resolve_stays_in_root(self):
+        self.assertEqual(
+            self.registry.resolve("sub/b.txt"),
+            os.path.join(os.path.realpath(self.root), "sub", "b.txt"))
+        self.assertIsNone(self.registry.resolve("../a.txt"))
+        self.assertIsNone(self.registry.resolve("/etc/passwd"))
+        self.assertIsNone(self.registry.resolve("missing.txt"))
+        self.assertIsNone(self.registry.resolve("sub"))
+        self.assertIsNone(self.registry.resolve(None))
+
+    async def test_documents_have_own_models(self):
+        first = await self.registry.get_session("a.txt")
+        second = await self.registry.get_session("sub/b.txt")
+        self.assertIs(first, await self.registry.get_session("a.txt"))
+        self.assertEqual(first.app._model.text_lines.get_text(), "first")
+        self.assertEqual(second.app._model.text_lines.get_text(), "second")
+        self.assertIsNot(first.app._writers, second.app._writers)
+        self.assertIsNone(await self.registry.get_session("../x"))
+
+    async def test_connection_is_routed_to_document(self):
+        session = await self.registry.get_session("sub/b.txt")
+        session.app.accept_client = AsyncMock()
+        reader = asyncio.StreamReader()
+        reader.feed_data(TextCodec().encode("u -C u doc=sub/b.txt"))
+        writer = MagicMock()
+        await self.registry._connection_handler(reader, writer)
+        args = session.app.accept_client.call_args.args[0]
+        self.assertEqual(args[:4], ["u", "-C", "u", "doc=sub/b.txt"])
+
+    async def test_unknown_document_is_refused(self):
+        reader = asyncio.StreamReader()
+        reader.feed_data(TextCodec().encode("u -C u doc=nope.txt"))
+        writer = MagicMock()
+        writer.drain = AsyncMock()
+        await self.registry._connection_handler(reader, writer)
+        writer.write.assert_called_once_with(TextCodec().encode("host -DCH"))
+        writer.close.assert_called_once()
+        self.assertEqual(self.registry.sessions, {})
+
+    async def test_idle_documents_are_unloaded(self):
+        busy = await self.registry.get_session("a.txt")
+        idle = await self.registry.get_session("sub/b.txt")
+        busy.app.client_count = MagicMock(return_value=1)
+        busy.app.shutdown = AsyncMock()
+        idle.app.shutdown = AsyncMock()
+        self.registry._idle_timeout = 0
+        await self.registry.unload_idle()
+        self.assertEqual(list(self.registry.sessions), ["a.txt"])
+        idle.app.shutdown.assert_called_once()
+        busy.app.shutdown.assert_not_called()
+
+    async def test_documents_are_opened_while_others_unload(self):
+        idle = await self.registry.get_session("a.txt")
+        saved = asyncio.Event()
+        idle.app.shutdown = AsyncMock(side_effect=saved.wait)
+        self.registry._idle_timeout = 0
+        unload = asyncio.create_task(self.registry.unload_idle())
+        await asyncio.sleep(0)
+        other = await asyncio.wait_for(
+            self.registry.get_session("sub/b.txt"), 1)
+        self.assertIsNotNone(other)
+        # unloaded document is not read before it is saved
+        reopen = asyncio.create_task(self.registry.get_session("a.txt"))
+        await asyncio.sleep(0.01)
+        self.assertFalse(reopen.done())
+        saved.set()
+        await unload
+        reopened = await asyncio.wait_for(reopen, 1)
+        self.assertIsNot(reopened, idle)
+
+    async def test_unloaded_document_history_is_compacted(self):
+        registry = SessionRegistry(
+            self.root, "host", idle_timeout=0,
+            history_policy=RetentionPolicy())
+        session = await registry.get_session("a.txt")
+        self.assertIsNotNone(session.app._compactor)
+        session.app.shutdown = AsyncMock()
+        session.app._compact_history = MagicMock()
+        await registry.unload_idle()
+        session.app._compact_history.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
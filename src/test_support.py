@@ -0,0 +1,31 @@
+import tempfile
+from unittest.mock import patch
+import chunk_store
+import history_catalog
+import journal
+from history_handler import HistoryHandler
+from mttext_app import MtTextEditApp
+
+
+# history, caches, journals and permissions of the test go to its own
+# temporary dir instead of shared /tmp/lib/mttext
+def use_temp_data_dir(test):
+    tmp = tempfile.TemporaryDirectory()
+    test.addCleanup(tmp.cleanup)
+    root = tmp.name + "/"
+    history = root + "history/"
+    patchers = (
+        patch.object(HistoryHandler, "_HISTORY_DIR_PATH", history),
+        patch.object(HistoryHandler, "_CACHE_PATH", root + "cache/"),
+        patch.object(history_catalog, "HISTORY_DIR_PATH", history),
+        patch.object(
+            history_catalog, "CATALOG_PATH", history + "catalog.sqlite"),
+        patch.object(chunk_store, "CHUNKS_DIR_PATH", history + "chunks/"),
+        patch.object(journal, "JOURNAL_DIR_PATH", root + "journal/"),
+        patch.object(
+            MtTextEditApp, "_PERMISSION_FILE_PATH", root + "permissions"),
+    )
+    for patcher in patchers:
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    return root
@@ -0,0 +1,112 @@
+import random
+import unittest
+from text_buffer import ListTextBuffer, RopeTextBuffer, get_range
+
+
+class TestTextBuffer(unittest.TestCase):
+    buffer_cls = ListTextBuffer
+
+    def setUp(self):
+        self.buffer = self.buffer_cls("qwer\nasdf\nzxcv")
+
+    def test_empty_text(self):
+        buffer = self.buffer_cls("")
+        self.assertEqual(list(buffer), [""])
+        self.assertEqual(len(buffer), 1)
+
+    def test_lines(self):
+        self.assertEqual(len(self.buffer), 3)
+        self.assertEqual(self.buffer[1], "asdf")
+        self.assertEqual(self.buffer[-1], "zxcv")
+        self.assertEqual(self.buffer[1:3], ["asdf", "zxcv"])
+        self.assertEqual(self.buffer.get_text(), "qwer\nasdf\nzxcv")
+
+    def test_line_primitives(self):
+        self.buffer[0] = "0"
+        self.buffer.insert(1, "1")
+        self.buffer.append("4")
+        self.assertEqual(self.buffer.pop(2), "asdf")
+        self.assertEqual(list(self.buffer), ["0", "1", "zxcv", "4"])
+
+    def test_insert_text(self):
+        bot = self.buffer.insert_text((2, 0), "12")
+        self.assertEqual(bot, (4, 0))
+        self.assertEqual(self.buffer[0], "qw12er")
+        bot = self.buffer.insert_text((1, 1), "a\nb\nc")
+        self.assertEqual(bot, (1, 3))
+        self.assertEqual(
+            list(self.buffer), ["qw12er", "aa", "b", "csdf", "zxcv"])
+
+    def test_delete_range(self):
+        self.buffer.delete_range((1, 0), (3, 0))
+        self.assertEqual(self.buffer[0], "qr")
+        self.buffer.delete_range((2, 2), (1, 0))
+        self.assertEqual(list(self.buffer), ["qcv"])
+
+    def test_get_range(self):
+        self.assertEqual(self.buffer.get_range((2, 0), (1, 2)),
+                         "er\nasdf\nz")
+        self.assertEqual(get_range(["Hello World"], (11, 0), (6, 0)),
+                         "World")
+
+    def test_set_text(self):
+        self.buffer.set_text("new\ntext")
+        self.assertEqual(list(self.buffer), ["new", "text"])
+
+    def test_snapshot_does_not_follow_edits(self):
+        snapshot = self.buffer.snapshot()
+        self.buffer.insert_text((0, 1), "new\n")
+        self.buffer.delete_range((0, 0), (2, 0))
+        self.assertEqual(len(snapshot), 3)
+        self.assertEqual(list(snapshot), ["qwer", "asdf", "zxcv"])
+
+    def test_dirty_lines(self):
+        self.assertEqual(self.buffer.take_dirty(), (set(), 0))
+        self.assertEqual(self.buffer.take_dirty(), (set(), None))
+        self.buffer.insert_text((1, 1), "x")
+        self.buffer[-1] = "zz"
+        self.assertEqual(self.buffer.take_dirty(), ({1, 2}, None))
+        self.buffer.insert_text((0, 0), "\n")
+        self.assertEqual(self.buffer.take_dirty(), ({0}, 1))
+        generation = self.buffer.generation
+        self.buffer.delete_range((0, 0), (0, 1))
+        self.assertGreater(self.buffer.generation, generation)
+        self.assertEqual(self.buffer.take_dirty(), ({0}, 1))
+
+    def test_random_edits(self):
+        rnd = random.Random(42)
+        reference = ["line %d" % i for i in range(200)]
+        buffer = self.buffer_cls("\n".join(reference))
+        for i in range(500):
+            y = rnd.randrange(len(reference))
+            x = rnd.randrange(len(reference[y]) + 1)
+            if rnd.random() < 0.5:
+                text = rnd.choice(["a", "\n", "b\nc", "\n\n"])
+                lines = text.split("\n")
+                lines[-1] += reference[y][x:]
+                lines[0] = reference[y][:x] + lines[0]
+                reference[y:y + 1] = lines
+                buffer.insert_text((x, y), text)
+            else:
+                bot_y = min(y + rnd.randrange(3), len(reference) - 1)
+                bot_x = rnd.randrange(len(reference[bot_y]) + 1)
+                if bot_y == y:
+                    bot_x = max(bot_x, x)
+                reference[y:bot_y + 1] = [
+                    reference[y][:x] + reference[bot_y][bot_x:]]
+                buffer.delete_range((x, y), (bot_x, bot_y))
+            self.assertEqual(len(buffer), len(reference))
+        self.assertEqual(list(buffer), reference)
+        self.assertEqual(buffer[50:60], reference[50:60])
+
+
+class TestRopeTextBuffer(TestTextBuffer):
+    buffer_cls = RopeTextBuffer
+
+    def test_index_error(self):
+        with self.assertRaises(IndexError):
+            self.buffer[3]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+import time_travel
+from chunk_store import ChunkStore
+from history_catalog import HistoryCatalog
+from history_handler import HistoryHandler
+from model import Model
+from text_buffer import RopeTextBuffer
+from test_support import use_temp_data_dir
+from time_travel import Versions, undo_frame
+
+
+def _apply(lines, frame, text=None):
+    top, bot = sorted((frame[1], frame[2]), key=lambda pos: pos[::-1])
+    if frame[0] == "cut":
+        lines[top[1]:bot[1] + 1] = [
+            lines[top[1]][:top[0]] + lines[bot[1]][bot[0]:]]
+        return
+    line = lines[top[1]]
+    new = text.split("\n")
+    new[0] = line[:top[0]] + new[0]
+    new[-1] += line[top[0]:]
+    lines[top[1]:top[1] + 1] = new
+
+
+class TestVersions(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "s.checkpoints.cache")
+        self.chunks = ChunkStore(os.path.join(self.tmp.name, "chunks"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _session(self, op_count):
+        lines = ["first line", "second", "third"]
+        texts = ["\n".join(lines)]
+        ops = []
+        for i in range(op_count):
+            y = i % len(lines)
+            if i % 3 == 2 and len(lines[y]) > 1:
+                frame = ["cut", (1, y), (0, y), lines[y][:1], "b"]
+                _apply(lines, frame)
+            else:
+                text = "\n" if i % 7 == 0 else str(i)
+                bot = (0, y + 1) if text == "\n" else (len(text), y)
+                frame = ["insert", (0, y), bot, "a"]
+                _apply(lines, frame, text)
+            ops.append((i * 2, frame))
+            texts.append("\n".join(lines))
+        return ops, texts
+
+    def test_undo_frame(self):
+        lines = RopeTextBuffer("ab\ncd")
+        undo_frame(lines, ["insert", (1, 1), (1, 0), "u"])
+        self.assertEqual(list(lines), ["ad"])
+        undo_frame(lines, ["cut", (1, 0), (2, 0), "x\ny", "u"])
+        self.assertEqual(list(lines), ["ax", "yd"])
+
+    def test_every_version_is_rebuilt(self):
+        ops, texts = self._session(50)
+        time_travel.write_checkpoints(
+            self.path, texts[-1], ops, self.chunks, every=8)
+        versions = Versions(ops, {}, self.path, self.chunks)
+        self.assertEqual(versions.last, 50)
+        for version, text in enumerate(texts):
+            self.assertEqual("\n".join(versions.lines(version)), text)
+        self.assertEqual(versions.frame(1), ops[0][1])
+
+    def test_checkpoints_are_appended_by_saves(self):
+        ops, texts = self._session(30)
+        for first, last in ((0, 12), (12, 13), (13, 30)):
+            time_travel.write_checkpoints(
+                self.path, texts[last], ops[first:last], self.chunks,
+                every=8, first=first)
+        versions = Versions(ops, {}, self.path, self.chunks)
+        self.assertEqual(versions._checkpoints, [0, 8, 12, 13, 16, 24, 30])
+        for version, text in enumerate(texts):
+            self.assertEqual("\n".join(versions.lines(version)), text)
+
+    def test_checkpoints_share_chunks(self):
+        lines = [f"line {i} of the document" for i in range(20000)]
+        ops = [(i, ["insert", (0, i * 500), (1, i * 500), "a"])
+               for i in range(40)]
+        time_travel.write_checkpoints(
+            self.path, "\n".join(lines), ops, self.chunks, every=4)
+        digests = time_travel.checkpoint_chunks(self.path)
+        # every checkpoint changes one chunk, the rest is shared
+        self.assertLess(len(set(digests)), len(digests) // 4)
+        self.assertEqual(len(list(self.chunks.chunk_files())),
+                         len(set(digests)))
+
+    def test_legacy_checkpoints_are_read(self):
+        ops, texts = self._session(3)
+        with open(self.path, "wb") as f:
+            data = zlib.compress(texts[-1].encode())
+            f.write(struct.pack("<II", 3, len(data)) + data)
+        versions = Versions(ops, {}, self.path, self.chunks)
+        self.assertEqual("\n".join(versions.lines(1)), texts[1])
+        self.assertEqual(time_travel.checkpoint_chunks(self.path), [])
+
+    def test_version_at_time(self):
+        ops, texts = self._session(4)
+        time_travel.write_checkpoints(self.path, texts[-1], ops, self.chunks)
+        times = {0: 10.0, 2: 20.0, 6: 30.0}
+        versions = Versions(ops, times, self.path, self.chunks)
+        self.assertEqual(versions.version_at(5.0), 0)
+        self.assertEqual(versions.version_at(20.0), 2)
+        self.assertEqual(versions.version_at(25.0), 2)
+        self.assertEqual(versions.version_at(99.0), 4)
+        self.assertEqual(versions.time(3), None)
+
+    def test_times_survive_torn_tail(self):
+        path = os.path.join(self.tmp.name, "times.cache")
+        time_travel.append_times(path, {0: 1.5, 1: 2.5})
+        with open(path, "ab") as f:
+            f.write(b"\x01\x02")
+        self.assertEqual(time_travel.read_times(path), {0: 1.5, 1: 2.5})
+
+
+class TestHistoryVersions(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        use_temp_data_dir(self)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.tmp.name, "doc.txt")
+        self.handler = HistoryHandler(self.file_path)
+        self.handler._HISTORY_DIR_PATH = self.tmp.name + "/doc/"
+        os.makedirs(self.handler._HISTORY_DIR_PATH)
+        self.handler._CHANGES_CACHE_PATH = self.tmp.name + "/changes.cache"
+        self.handler._catalog = HistoryCatalog(
+            self.tmp.name + "/catalog.sqlite", self.tmp.name + "/")
+        self.handler._last_edited_by = ["owner"]
+        self.chunks = ChunkStore(self.tmp.name + "/chunks/")
+        self.handler._chunks = self.chunks
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def _save(self, text):
+        with open(self.file_path, "w") as f:
+            f.write(text)
+        await self.handler.save_file([text])
+
+    async def test_session_versions_are_shown(self):
+        handler = self.handler
+        await handler.new_text_save_history("a", (0, 0), (2, 0))
+        await self._save("abcd")
+        await handler.user_cut_save_history("b", ["abcd"], (2, 0), (4, 0))
+        await self._save("ab")
+        await handler.session_ended()
+        session = str(handler._session_start)
+        self.assertTrue(os.path.exists(
+            handler._HISTORY_DIR_PATH + session + ".ops.cache"))
+
+        viewer = HistoryHandler()
+        viewer._HISTORY_DIR_PATH = self.tmp.name + "/"
+        viewer._chunks = self.chunks
+        model = Model("ab", "view_changes")
+        await viewer.load_session("doc", session + ".o.cache", model, at=0)
+        self.assertEqual(model.text_lines.get_text(), "cd")
+        self.assertEqual(viewer.version_status()[:11], "version 0/2")
+        await viewer.step_version(model, 1)
+        self.assertEqual(model.text_lines.get_text(), "abcd")
+        self.assertEqual(viewer._changes_frames,
+                         [["insert", (0, 0), (2, 0), "a"]])
+        await viewer.step_version(model, 1)
+        self.assertEqual(model.text_lines.get_text(), "abcd")
+        self.assertTrue(viewer.version_status().endswith("cut by b"))
+        await viewer.step_version(model, -5)
+        self.assertEqual(model.text_lines.get_text(), "cd")
+
+    async def test_undo_is_version_of_its_own(self):
+        handler = self.handler
+        await handler.new_text_save_history("a", (0, 0), (2, 0))
+        await handler.undo_cut_save_version("a", ["abcd"], (0, 0), (2, 0))
+        await handler.correct_history_on_undo_paste("a", 1)
+        await self._save("cd")
+        await handler.session_ended()
+        versions = time_travel.Versions.load(
+            handler._session_path, self.chunks)
+        self.assertEqual(versions.last, 2)
+        self.assertEqual(versions.lines(1).get_text(), "abcd")
+        self.assertEqual(versions.lines(2).get_text(), "cd")
+        self.assertEqual(versions.frame(2), ["cut", (0, 0), (2, 0), "ab", "a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
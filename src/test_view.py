@@ -14,11 +14,13 @@ class TestView(unittest.TestCase):
         self.start_color_patcher = patch('curses.start_color')
         self.init_pair_patcher = patch('curses.init_pair')
         self.color_pair_patcher = patch('curses.color_pair')
+        self.doupdate_patcher = patch('curses.doupdate')
 
         self.mock_curs_set = self.curs_set_patcher.start()
         self.mock_start_color = self.start_color_patcher.start()
         self.mock_init_pair = self.init_pair_patcher.start()
         self.mock_color_pair = self.color_pair_patcher.start()
+        self.mock_doupdate = self.doupdate_patcher.start()
         self.mock_color_pair.return_value = 0  # Simplify color handling
 
         self.view = View(self.mock_stdscr, "owner")
@@ -33,6 +35,7 @@ class TestView(unittest.TestCase):
         self.start_color_patcher.stop()
         self.init_pair_patcher.stop()
         self.color_pair_patcher.stop()
+        self.doupdate_patcher.stop()
 
     def test_init(self):
         self.assertEqual(self.mock_curs_set.call_count, 1)
@@ -171,6 +174,41 @@ class TestView(unittest.TestCase):
 
         self.view.draw_text(text_lines, user_positions, users, {})
         self.assertGreater(self.mock_stdscr.addstr.call_count, 5)
+        self.mock_stdscr.noutrefresh.assert_called_once()
+        self.mock_doupdate.assert_called_once()
+
+    def test_draw_text_repaints_only_dirty_lines(self):
+        text_lines = ["line%d" % i for i in range(10)]
+        user_positions = {"owner": (0, 0)}
+        self.view.draw_text(text_lines, user_positions, ["owner"], {})
+        self.mock_stdscr.addstr.reset_mock()
+
+        self.view.draw_text(text_lines, user_positions, ["owner"], {},
+                            dirty=(set(), None))
+        repainted = {c.args[0] for c in self.mock_stdscr.addstr.call_args_list}
+        self.assertEqual(repainted, {1})
+        self.mock_stdscr.addstr.reset_mock()
+
+        text_lines[5] = "changed"
+        self.view.draw_text(text_lines, user_positions, ["owner"], {},
+                            dirty=({5}, 8))
+        repainted = {c.args[0] for c in self.mock_stdscr.addstr.call_args_list}
+        self.assertEqual(repainted, {1, 6} | set(range(9, 22)))
+
+    def test_overlay_lines_are_clipped_to_screen(self):
+        self.view._offset_y = 100
+        lines = self.view._get_overlay_lines(
+            {"owner": (0, 105), "client": (0, 10)},
+            {"client": (3, 10 ** 6)})
+        self.assertEqual(lines, set(range(100, 121)))
+
+    def test_draw_text_repaints_after_resize(self):
+        text_lines = ["line1", "line2"]
+        self.view.draw_text(text_lines, {"owner": (0, 0)}, ["owner"], {})
+        self.mock_stdscr.getmaxyx.return_value = (30, 80)
+        self.view.draw_text(text_lines, {"owner": (0, 0)}, ["owner"], {},
+                            dirty=(set(), None))
+        self.mock_stdscr.erase.assert_called_once()
 
 
 if __name__ == '__main__':
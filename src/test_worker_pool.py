@@ -0,0 +1,144 @@
+import asyncio
+import signal
+import socket
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+from codec import TextCodec
+from session_registry import SessionRegistry
+from worker_pool import HashRing, WorkerPool
+
+
+class TestHashRing(unittest.TestCase):
+    def test_same_key_same_node(self):
+        ring = HashRing(range(4))
+        self.assertEqual(ring.node_for("a.txt"), ring.node_for("a.txt"))
+
+    def test_keys_are_spread(self):
+        ring = HashRing(range(4))
+        nodes = [ring.node_for(f"doc{i}") for i in range(1000)]
+        for node in range(4):
+            self.assertGreater(nodes.count(node), 100)
+
+    def test_removed_node_moves_only_its_keys(self):
+        ring = HashRing(range(4))
+        keys = [f"doc{i}" for i in range(200)]
+        before = {key: ring.node_for(key) for key in keys}
+        ring.remove(2)
+        for key in keys:
+            if before[key] != 2:
+                self.assertEqual(ring.node_for(key), before[key])
+            else:
+                self.assertNotEqual(ring.node_for(key), 2)
+
+    def test_empty_ring(self):
+        with self.assertRaises(LookupError):
+            HashRing([]).node_for("a")
+
+
+class TestWorkerPool(unittest.IsolatedAsyncioTestCase):
+    async def test_connection_is_passed_to_document_worker(self):
+        pool = WorkerPool("/tmp", "host", 2)
+        controls = []
+        for _ in range(2):
+            process = MagicMock()
+            process.is_alive.return_value = True
+            control, worker_control = socket.socketpair(
+                socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            pool._workers.append((process, control))
+            controls.append(worker_control)
+        client, conn = socket.socketpair()
+        conn.setblocking(False)
+        handshake = TextCodec().encode("u -C u doc=./a.txt")
+        client.sendall(handshake + b"extra")
+        await pool._handle_connection(conn)
+        worker = pool.worker_for("a.txt")
+        data, fds, _, _ = socket.recv_fds(controls[worker], 1024, 1)
+        self.assertEqual(data, handshake + b"extra")
+        with socket.socket(fileno=fds[0]) as passed:
+            passed.sendall(b"hello")
+        self.assertEqual(client.recv(5), b"hello")
+        client.close()
+        for control in controls:
+            control.close()
+        for _, control in pool._workers:
+            control.close()
+
+    async def test_dead_worker_is_skipped(self):
+        pool = WorkerPool("/tmp", "host", 2)
+        dead = MagicMock()
+        dead.is_alive.return_value = False
+        alive = MagicMock()
+        alive.is_alive.return_value = True
+        pool._workers = [(dead, MagicMock()), (alive, MagicMock())]
+        client, conn = socket.socketpair()
+        conn.setblocking(False)
+        client.sendall(TextCodec().encode("u -C u doc=a.txt"))
+        with patch("socket.send_fds") as mock_send_fds:
+            await pool._handle_connection(conn)
+        mock_send_fds.assert_called_once()
+        self.assertIs(mock_send_fds.call_args.args[0], pool._workers[1][1])
+        self.assertEqual(pool.worker_for("a.txt"), 1)
+        client.close()
+
+    def test_stop_terminates_only_stuck_workers(self):
+        pool = WorkerPool("/tmp", "host", 2)
+        done = MagicMock()
+        done.is_alive.return_value = False
+        stuck = MagicMock()
+        stuck.is_alive.return_value = True
+        controls = [MagicMock(), MagicMock()]
+        pool._workers = [(done, controls[0]), (stuck, controls[1])]
+        pool.stop(timeout=5)
+        for control in controls:
+            control.close.assert_called_once()
+        done.join.assert_called_once_with(5)
+        done.terminate.assert_not_called()
+        stuck.terminate.assert_called_once()
+        self.assertEqual(pool._workers, [])
+
+    async def test_signals_are_handled_until_documents_are_saved(self):
+        registry = SessionRegistry("/tmp", "host")
+        loop = asyncio.get_running_loop()
+        calls = []
+        registry.close_all = AsyncMock(
+            side_effect=lambda: calls.append("close_all"))
+        with patch.object(loop, "add_signal_handler"), patch.object(
+            loop, "remove_signal_handler",
+            side_effect=lambda sig: calls.append(sig),
+        ):
+            registry.stop()
+            await registry._run_until_stopped((signal.SIGTERM,))
+        self.assertEqual(calls, ["close_all", signal.SIGTERM])
+
+    async def test_registry_accepts_handoff(self):
+        registry = SessionRegistry("/tmp", "host")
+        registry._connection_handler = AsyncMock()
+        control, worker_control = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        client, conn = socket.socketpair()
+        serve_task = asyncio.create_task(
+            registry.serve_handoffs(worker_control))
+        await asyncio.sleep(0)
+        handshake = TextCodec().encode("u -C u doc=a.txt")
+        socket.send_fds(control, [handshake], [conn.fileno()])
+        conn.close()
+        for _ in range(100):
+            if registry._connection_handler.called:
+                break
+            await asyncio.sleep(0.01)
+        reader, writer = registry._connection_handler.call_args.args
+        args = await TextCodec().read_args(reader)
+        self.assertEqual(args[:4], ["u", "-C", "u", "doc=a.txt"])
+        writer.write(b"hi")
+        await writer.drain()
+        self.assertEqual(client.recv(2), b"hi")
+        writer.close()
+        # closed control socket means acceptor is gone
+        control.close()
+        await asyncio.wait_for(serve_task, 1)
+        client.close()
+        worker_control.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,433 @@
+import random
+import threading
+from markers import MarkerIndex
+
+
+def get_range(text_lines, top, bot):
+    if bot[1] < top[1] or bot[1] == top[1] and bot[0] < top[0]:
+        top, bot = bot, top
+    top_x, top_y = top
+    bot_x, bot_y = bot
+    if bot_y == top_y:
+        return text_lines[bot_y][top_x:bot_x]
+    t = (
+        ""
+        if bot_y - top_y <= 1
+        else "\n".join(text_lines[top_y + 1: bot_y]) + "\n"
+    )
+    return text_lines[top_y][top_x:] + "\n" + t + text_lines[bot_y][:bot_x]
+
+
+class TextBuffer:
+    # storage engines implement line primitives:
+    # _reset, __len__, __getitem__, __iter__,
+    # _set_line, _insert_lines, _delete_lines,
+    # _line_offset (chars before line, newlines included), _line_at_offset
+    # everything below is built on top of them
+    # markers follow every edit, keep_group argument of an edit
+    # leaves markers of that group in place
+
+    def __init__(self, text: str = ""):
+        # lines changed since last take_dirty(),
+        # every line starting from _dirty_from is changed too
+        self.generation = 0
+        self._dirty_lines = set()
+        self._dirty_from = None
+        self._dirty_m = threading.Lock()
+        self.markers = MarkerIndex()
+        self.set_text(text)
+
+    def _mark_dirty(self, start, stop=None):
+        with self._dirty_m:
+            self.generation += 1
+            if stop is not None:
+                self._dirty_lines.update(range(start, stop))
+            elif self._dirty_from is None or start < self._dirty_from:
+                self._dirty_from = start
+
+    # returns (changed lines, first line of changed tail or None)
+    def take_dirty(self):
+        with self._dirty_m:
+            dirty = (self._dirty_lines, self._dirty_from)
+            self._dirty_lines = set()
+            self._dirty_from = None
+        return dirty
+
+    def set_text(self, text: str):
+        # markers keep their (x, y), as far as new text allows
+        positions = [
+            (marker, self.pos_of(self.markers.offset(marker)))
+            for marker in self.markers
+        ]
+        self._reset(text.splitlines() or [""])
+        for marker, pos in positions:
+            self.markers.move(marker, self.offset_of(pos))
+        self._mark_dirty(0)
+
+    def char_count(self):
+        return self._line_offset(len(self)) - 1
+
+    # position is clamped to text bounds
+    def offset_of(self, pos):
+        x, y = pos
+        y = min(max(y, 0), len(self) - 1)
+        return self._line_offset(y) + min(max(x, 0), len(self[y]))
+
+    def pos_of(self, offset):
+        offset = min(max(offset, 0), self.char_count())
+        y, line_offset = self._line_at_offset(offset)
+        return (offset - line_offset, y)
+
+    def get_text(self):
+        return "\n".join(self)
+
+    def _index(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError("line index out of range")
+        return i
+
+    def __setitem__(self, i, line):
+        i = self._index(i)
+        start = self._line_offset(i)
+        self.markers.delete(start, start + len(self[i]))
+        self._set_line(i, line)
+        self.markers.insert(start, len(line))
+        self._mark_dirty(i, i + 1)
+
+    def insert(self, i, line):
+        n = len(self)
+        i = max(i + n, 0) if i < 0 else min(i, n)
+        self.markers.insert(
+            self._line_offset(i) - (i == n), len(line) + 1)
+        self._insert_lines(i, [line])
+        self._mark_dirty(i)
+
+    def pop(self, i=-1):
+        i = self._index(i)
+        line = self[i]
+        if len(self) > 1:
+            start = self._line_offset(i) - (i == len(self) - 1)
+            self.markers.delete(start, start + len(line) + 1)
+        else:
+            self.markers.delete(0, len(line))
+        self._delete_lines(i, i + 1)
+        self._mark_dirty(i)
+        return line
+
+    def append(self, line):
+        self.insert(len(self), line)
+
+    def get_range(self, top, bot):
+        return get_range(self, top, bot)
+
+    # returns position right after inserted text
+    def insert_text(self, pos, text, keep_group=None):
+        x, y = pos
+        self.markers.insert(self.offset_of(pos), len(text), keep_group)
+        lines = text.split("\n")
+        line = self[y]
+        if len(lines) == 1:
+            self._set_line(y, line[:x] + text + line[x:])
+            self._mark_dirty(y, y + 1)
+            return (x + len(text), y)
+        self._set_line(y, line[:x] + lines[0])
+        new_lines = lines[1:]
+        bot = (len(new_lines[-1]), y + len(new_lines))
+        new_lines[-1] += line[x:]
+        self._insert_lines(y + 1, new_lines)
+        self._mark_dirty(y, y + 1)
+        self._mark_dirty(y + 1)
+        return bot
+
+    def delete_range(self, top, bot, keep_group=None):
+        if bot[1] < top[1] or bot[1] == top[1] and bot[0] < top[0]:
+            top, bot = bot, top
+        top_x, top_y = top
+        bot_x, bot_y = bot
+        self.markers.delete(
+            self.offset_of(top), self.offset_of(bot), keep_group)
+        if bot_y == top_y:
+            line = self[top_y]
+            self._set_line(top_y, line[:top_x] + line[bot_x:])
+            self._mark_dirty(top_y, top_y + 1)
+            return
+        self._set_line(top_y, self[top_y][:top_x] + self[bot_y][bot_x:])
+        self._delete_lines(top_y + 1, bot_y + 1)
+        self._mark_dirty(top_y, top_y + 1)
+        self._mark_dirty(top_y + 1)
+
+    # lines at this moment, later edits do not change them
+    def snapshot(self):
+        return list(self)
+
+    def __eq__(self, other):
+        if isinstance(other, (TextBuffer, list)):
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other)
+            )
+        return NotImplemented
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.get_text()!r})"
+
+
+class ListTextBuffer(TextBuffer):
+    def _reset(self, lines):
+        self._lines = lines
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __getitem__(self, i):
+        return self._lines[i]
+
+    def _set_line(self, i, line):
+        self._lines[i] = line
+
+    def __iter__(self):
+        return iter(self._lines)
+
+    def _insert_lines(self, i, lines):
+        self._lines[i:i] = lines
+
+    def _delete_lines(self, start, stop):
+        del self._lines[start:stop]
+
+    def _line_offset(self, y):
+        return sum(len(line) + 1 for line in self._lines[:y])
+
+    def _line_at_offset(self, offset):
+        line_offset = 0
+        for y, line in enumerate(self._lines):
+            if offset <= line_offset + len(line):
+                return y, line_offset
+            line_offset += len(line) + 1
+        return len(self._lines) - 1, line_offset - len(self._lines[-1]) - 1
+
+
+class _Node:
+    # nodes are never modified after creation,
+    # so every edit copies only the path to the changed line
+    # chars counts line lengths of the subtree with newlines
+    __slots__ = ("line", "prio", "left", "right", "size", "chars")
+
+    def __init__(self, line, prio, left=None, right=None):
+        self.line = line
+        self.prio = prio
+        self.left = left
+        self.right = right
+        self.size = 1
+        self.chars = len(line) + 1
+        if left is not None:
+            self.size += left.size
+            self.chars += left.chars
+        if right is not None:
+            self.size += right.size
+            self.chars += right.chars
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _chars(node):
+    return node.chars if node is not None else 0
+
+
+def _split(node, k):
+    if node is None:
+        return None, None
+    left_size = _size(node.left)
+    if k <= left_size:
+        a, b = _split(node.left, k)
+        return a, _Node(node.line, node.prio, b, node.right)
+    a, b = _split(node.right, k - left_size - 1)
+    return _Node(node.line, node.prio, node.left, a), b
+
+
+def _merge(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.prio > b.prio:
+        return _Node(a.line, a.prio, a.left, _merge(a.right, b))
+    return _Node(b.line, b.prio, _merge(a, b.left), b.right)
+
+
+def _replace(node, i, line):
+    left_size = _size(node.left)
+    if i < left_size:
+        return _Node(
+            node.line, node.prio, _replace(node.left, i, line), node.right
+        )
+    if i > left_size:
+        return _Node(
+            node.line,
+            node.prio,
+            node.left,
+            _replace(node.right, i - left_size - 1, line),
+        )
+    return _Node(line, node.prio, node.left, node.right)
+
+
+# builds treap in O(n) with cartesian tree construction
+def _build(lines):
+    n = len(lines)
+    if n == 0:
+        return None
+    prios = [random.random() for _ in range(n)]
+    left = [-1] * n
+    right = [-1] * n
+    stack = []
+    for i in range(n):
+        last = -1
+        while stack and prios[stack[-1]] < prios[i]:
+            last = stack.pop()
+        left[i] = last
+        if stack:
+            right[stack[-1]] = i
+        stack.append(i)
+    root = stack[0]
+    order = []
+    to_visit = [root]
+    while to_visit:
+        i = to_visit.pop()
+        if i < 0:
+            continue
+        order.append(i)
+        to_visit.append(left[i])
+        to_visit.append(right[i])
+    nodes = [None] * n
+    for i in reversed(order):
+        nodes[i] = _Node(
+            lines[i],
+            prios[i],
+            nodes[left[i]] if left[i] >= 0 else None,
+            nodes[right[i]] if right[i] >= 0 else None,
+        )
+    return nodes[root]
+
+
+def _iter_range(root, start, stop):
+    stack = []
+    node = root
+    k = start
+    while node is not None:
+        left_size = _size(node.left)
+        if k < left_size:
+            stack.append(node)
+            node = node.left
+        elif k == left_size:
+            stack.append(node)
+            break
+        else:
+            k -= left_size + 1
+            node = node.right
+    count = stop - start
+    while stack and count > 0:
+        node = stack.pop()
+        yield node.line
+        count -= 1
+        node = node.right
+        while node is not None:
+            stack.append(node)
+            node = node.left
+
+
+class RopeSnapshot:
+    # edits of rope copy nodes instead of changing them,
+    # so snapshot only keeps the root
+    def __init__(self, root):
+        self._root = root
+
+    def __len__(self):
+        return _size(self._root)
+
+    def __iter__(self):
+        return _iter_range(self._root, 0, len(self))
+
+
+class RopeTextBuffer(TextBuffer):
+    # lines are stored in implicit treap,
+    # line lookup, insert and delete are O(log n)
+
+    def _reset(self, lines):
+        self._root = _build(lines)
+
+    def __len__(self):
+        return _size(self._root)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return list(self)[i]
+            return list(self._iter_range(start, stop))
+        i = self._index(i)
+        node = self._root
+        while True:
+            left_size = _size(node.left)
+            if i < left_size:
+                node = node.left
+            elif i > left_size:
+                i -= left_size + 1
+                node = node.right
+            else:
+                return node.line
+
+    def _set_line(self, i, line):
+        self._root = _replace(self._root, i, line)
+
+    def __iter__(self):
+        return self._iter_range(0, len(self))
+
+    def _iter_range(self, start, stop):
+        return _iter_range(self._root, start, stop)
+
+    def snapshot(self):
+        return RopeSnapshot(self._root)
+
+    def _insert_lines(self, i, lines):
+        a, b = _split(self._root, i)
+        self._root = _merge(_merge(a, _build(lines)), b)
+
+    def _line_offset(self, y):
+        offset = 0
+        node = self._root
+        while node is not None:
+            left_size = _size(node.left)
+            if y <= left_size:
+                node = node.left
+            else:
+                y -= left_size + 1
+                offset += _chars(node.left) + len(node.line) + 1
+                node = node.right
+        return offset
+
+    def _line_at_offset(self, offset):
+        y = 0
+        line_offset = 0
+        node = self._root
+        while True:
+            left_chars = _chars(node.left)
+            if offset < left_chars:
+                node = node.left
+                continue
+            offset -= left_chars
+            line_offset += left_chars
+            y += _size(node.left)
+            if offset <= len(node.line) or node.right is None:
+                return y, line_offset
+            offset -= len(node.line) + 1
+            line_offset += len(node.line) + 1
+            y += 1
+            node = node.right
+
+    def _delete_lines(self, start, stop):
+        a, rest = _split(self._root, start)
+        _, b = _split(rest, stop - start)
+        self._root = _merge(a, b)
@@ -0,0 +1,175 @@
+import bisect
+import os
+import struct
+import zlib
+import change_log
+import history_pack
+from chunk_store import ChunkStore
+from text_buffer import RopeTextBuffer
+
+# every version of a session is the text after its first n ops, undo
+# is an op too, text of every CHECKPOINT_EVERY-th and every saved
+# version is kept with the history, so any version is rebuilt by
+# undoing at most CHECKPOINT_EVERY ops
+CHECKPOINT_EVERY = 256
+# checkpoint texts are chunks of the chunk store, file lists their
+# digests, so checkpoints share chunks with each other and snapshots,
+# files without magic keep compressed texts
+MAGIC = b"#mttext-checkpoints 2\n"
+# version, length of digests or compressed text
+_CHECKPOINT = struct.Struct("<II")
+# op, unix time of the op
+_TIME = struct.Struct("<Id")
+
+
+def _ordered(top, bot):
+    return sorted((top, bot), key=lambda pos: pos[::-1])
+
+
+# frames of old sessions can point past the text, they are clamped
+def _clamp(lines, pos):
+    y = min(max(pos[1], 0), len(lines) - 1)
+    return min(max(pos[0], 0), len(lines[y])), y
+
+
+# text buffer before the frame, positions are (x, y)
+def undo_frame(lines, frame):
+    top, bot = (_clamp(lines, pos) for pos in _ordered(frame[1], frame[2]))
+    if frame[0] == "insert":
+        lines.delete_range(top, bot)
+    else:
+        lines.insert_text(top, frame[3])
+
+
+def append_times(path, times_by_op, truncate=False):
+    with open(path, "wb" if truncate else "ab") as f:
+        f.write(b"".join(_TIME.pack(op, t)
+                         for op, t in sorted(times_by_op.items())))
+
+
+def read_times(path):
+    try:
+        with history_pack.open_file(path) as f:
+            data = f.read()
+    except OSError:
+        return {}
+    # torn record of crashed write is dropped
+    end = len(data) - len(data) % _TIME.size
+    return dict(_TIME.iter_unpack(data[:end]))
+
+
+# checkpoints of versions after first, text is the text of the last one,
+# walks back over given ops only, every undo is O(log n) in rope,
+# so each save of the session adds checkpoints of its own ops
+def write_checkpoints(path, text, ops, chunks=None,
+                      every=CHECKPOINT_EVERY, first=0):
+    chunks = chunks or ChunkStore()
+    lines = RopeTextBuffer(text)
+    last = first + len(ops)
+
+    def write_checkpoint(version):
+        data = "\n".join(chunks.put(lines.get_text().encode())).encode()
+        f.write(_CHECKPOINT.pack(version, len(data)) + data)
+
+    with open(path, "ab" if first else "wb") as f:
+        if not first:
+            f.write(MAGIC)
+        for version in range(last, first, -1):
+            if version % every == 0 or version == last:
+                write_checkpoint(version)
+            undo_frame(lines, ops[version - first - 1][1])
+        if not first:
+            write_checkpoint(0)
+
+
+def _read_checkpoints(f):
+    is_chunked = f.read(len(MAGIC)) == MAGIC
+    if not is_chunked:
+        f.seek(0)
+    while header := f.read(_CHECKPOINT.size):
+        if len(header) < _CHECKPOINT.size:
+            break
+        version, length = _CHECKPOINT.unpack(header)
+        yield version, f.tell(), length, is_chunked
+        f.seek(length, os.SEEK_CUR)
+
+
+# digests of chunks checkpoints of the session use
+def checkpoint_chunks(path):
+    digests = []
+    with history_pack.open_file(path) as f:
+        for _, offset, length, is_chunked in list(_read_checkpoints(f)):
+            if is_chunked:
+                f.seek(offset)
+                digests.extend(f.read(length).decode().split())
+    return digests
+
+
+class Versions:
+    def __init__(self, ops, times, checkpoints_path, chunks=None):
+        # (op, frame) in op order, undo is an op of its own
+        self._ops = ops
+        self._times = [times.get(op) for op, _ in ops]
+        # ops are numbered in order of their time
+        self._known_versions = [
+            version for version, t in enumerate(self._times, 1)
+            if t is not None]
+        self._known_times = [
+            self._times[version - 1] for version in self._known_versions]
+        self._path = checkpoints_path
+        self._chunks = chunks or ChunkStore()
+        # version -> offset of checkpoint in checkpoints file
+        self._offsets = {}
+        with history_pack.open_file(checkpoints_path) as f:
+            for version, offset, length, is_chunked in _read_checkpoints(f):
+                self._offsets[version] = (offset, length, is_chunked)
+        self._checkpoints = sorted(self._offsets)
+
+    @classmethod
+    def load(cls, session_path, chunks=None):
+        ops_path = session_path + ".ops.cache"
+        checkpoints_path = session_path + ".checkpoints.cache"
+        if not (history_pack.exists(ops_path)
+                and history_pack.exists(checkpoints_path)):
+            return None
+        return cls(change_log.read_ops(ops_path),
+                   read_times(session_path + ".times.cache"),
+                   checkpoints_path, chunks)
+
+    def __len__(self):
+        return len(self._ops) + 1
+
+    @property
+    def last(self):
+        return len(self._ops)
+
+    # op, that made the version
+    def frame(self, version):
+        return self._ops[version - 1][1] if version else None
+
+    def time(self, version):
+        return self._times[version - 1] if version else None
+
+    # last version made before or at unix time t
+    def version_at(self, t):
+        i = bisect.bisect_right(self._known_times, t)
+        return self._known_versions[i - 1] if i else 0
+
+    def _read_checkpoint(self, version):
+        offset, length, is_chunked = self._offsets[version]
+        with history_pack.open_file(self._path) as f:
+            f.seek(offset)
+            data = f.read(length)
+        if is_chunked:
+            return self._chunks.get(data.decode().split()).decode()
+        return zlib.decompress(data).decode()
+
+    # text buffer of the version
+    def lines(self, version):
+        version = min(max(version, 0), self.last)
+        checkpoint = self._checkpoints[
+            bisect.bisect_left(self._checkpoints, version)]
+        lines = RopeTextBuffer(self._read_checkpoint(checkpoint))
+        for v in range(checkpoint, version, -1):
+            undo_frame(lines, self._ops[v - 1][1])
+        return lines
@@ -11,6 +11,13 @@ class View:
         self._draw_interface()
         self._offset_y = 0
         self._offset_x = 0
+        # state of the screen after last draw_text,
+        # unchanged rows are not repainted
+        self._drawn_size = self.stdscr.getmaxyx()
+        self._drawn_offset = None
+        self._drawn_users = None
+        self._overlay_lines = set()
+        self._drawn_status = None
 
     def _init_colors(self):
         curses.start_color()
@@ -173,6 +180,53 @@ class View:
                 color = curses.color_pair(7)
             self._paint_range(text_lines, color, frame[1], frame[2])
 
+    # lines with cursors and selections, they are repainted every frame
+    # only visible rows of selections, long selection costs
+    # no more than the screen
+    def _get_overlay_lines(self, user_positions, users_shift_pos):
+        height, _ = self.stdscr.getmaxyx()
+        first = self._offset_y
+        last = self._offset_y + height - 3
+        lines = set()
+        for user, (_, user_y) in user_positions.items():
+            shifted_y = users_shift_pos.get(user, (0, user_y))[1]
+            lines.update(range(max(min(user_y, shifted_y), first),
+                               min(max(user_y, shifted_y) + 1, last)))
+        return lines
+
+    def _get_lines_to_repaint(self, dirty, overlay_lines):
+        height, width = self.stdscr.getmaxyx()
+        first = self._offset_y
+        last = self._offset_y + height - 3
+        if dirty is None or self._drawn_offset != (
+                self._offset_x, self._offset_y):
+            return range(first, last)
+        lines, dirty_from = dirty
+        lines = lines | self._overlay_lines | overlay_lines
+        if dirty_from is not None:
+            lines.update(range(max(dirty_from, first), last))
+        return sorted(y for y in lines if first <= y < last)
+
+    def _repaint_lines(self, text_lines, lines_to_repaint):
+        height, width = self.stdscr.getmaxyx()
+        if isinstance(lines_to_repaint, range):
+            lines = text_lines[lines_to_repaint.start: lines_to_repaint.stop]
+        else:
+            lines = [
+                text_lines[y] if y < len(text_lines) else None
+                for y in lines_to_repaint
+            ]
+        for i, y in enumerate(lines_to_repaint):
+            screen_y = y - self._offset_y + 1
+            if i < len(lines) and lines[i] is not None:
+                line = lines[i][self._offset_x: self._offset_x + width - 1]
+                self.stdscr.addstr(
+                    screen_y, 0, line + " " * (width - len(line)))
+            else:
+                self.stdscr.addstr(screen_y, 0, " " * (width - 1))
+
+    # dirty is (changed lines, first line of changed tail)
+    # as returned by TextBuffer.take_dirty(), None repaints everything
     def draw_text(
         self,
         text_lines,
@@ -180,28 +234,41 @@ class View:
         users,
         users_shift_pos,
         changes_frames=None,
+        dirty=None,
+        status=None,
     ):
-        height, width = self.stdscr.getmaxyx()
+        size = self.stdscr.getmaxyx()
+        if size != self._drawn_size:
+            self._drawn_size = size
+            self._drawn_users = None
+            self._drawn_status = None
+            dirty = None
+            self.stdscr.erase()
+            self._draw_interface()
         owner_x, owner_y = (
             user_positions[self._owner_username]
             if self._owner_username not in users_shift_pos
             else users_shift_pos[self._owner_username]
         )
         self._correct_offset_by_owner_pos(owner_x, owner_y)
-        for y in range(1, height - 2):
-            line_num = y - 1 + self._offset_y
-            if line_num < len(text_lines):
-                line = text_lines[line_num][
-                    self._offset_x: self._offset_x + width - 1
-                ]
-                self.stdscr.addstr(y, 0, line + " " * (width - len(line)))
-            else:
-                self.stdscr.addstr(y, 0, " " * (width - 1))
-        self._draw_users_colors(users)
+        overlay_lines = self._get_overlay_lines(
+            user_positions, users_shift_pos)
+        if changes_frames:
+            dirty = None
+        self._repaint_lines(
+            text_lines, self._get_lines_to_repaint(dirty, overlay_lines))
+        self._drawn_offset = (self._offset_x, self._offset_y)
+        self._overlay_lines = overlay_lines
+        if users != self._drawn_users:
+            self._draw_users_colors(users)
+            self._drawn_users = list(users)
         self._draw_user_positions(text_lines, user_positions, users_shift_pos)
         if changes_frames:
             self._draw_changes(text_lines, changes_frames)
-        self.stdscr.refresh()
+        if status != self._drawn_status:
+            self._draw_status(status)
+        self.stdscr.noutrefresh()
+        curses.doupdate()
 
     def draw_blame(
             self,
@@ -217,10 +284,10 @@ class View:
             self._owner_username not in users_shift_pos else \
             users_shift_pos[self._owner_username]
         self._correct_offset_by_owner_pos(owner_x, owner_y, max_username_len)
+        visible_lines = text_lines[self._offset_y: self._offset_y + height - 3]
         for y in range(1, height-2):
-            line_num = y - 1 + self._offset_y
-            if line_num < len(text_lines):
-                line = text_lines[line_num][self._offset_x:
+            if y - 1 < len(visible_lines):
+                line = visible_lines[y - 1][self._offset_x:
                                             self._offset_x + width-1]
                 self.stdscr.addstr(y, max_username_len + 1,
                                    line + " " * (width - len(line)))
@@ -241,3 +308,11 @@ class View:
         height, width = self.stdscr.getmaxyx()
         title = " MTTEXT " + " " * (width - 8)
         self.stdscr.addstr(0, 0, title, curses.color_pair(2))
+
+    # status is shown in title bar after the name
+    def _draw_status(self, status):
+        height, width = self.stdscr.getmaxyx()
+        line = (status or "")[:max(width - 10, 0)]
+        self.stdscr.addstr(
+            0, 8, line + " " * (width - 9 - len(line)), curses.color_pair(2))
+        self._drawn_status = status
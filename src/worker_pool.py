@@ -0,0 +1,172 @@
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import os
+import signal
+import socket
+from codec import TEXT_DELIMITER
+from mttext_app import MtTextEditApp
+from session_registry import SessionRegistry, document_from_args
+
+
+class HashRing:
+    # consistent hashing, removing a node moves only its own keys
+
+    def __init__(self, nodes, replicas=64):
+        self._replicas = replicas
+        self._ring = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(
+            hashlib.md5(str(key).encode()).digest()[:8], "big")
+
+    def add(self, node):
+        for i in range(self._replicas):
+            bisect.insort(self._ring, (self._hash(f"{node}#{i}"), node))
+
+    def remove(self, node):
+        self._ring = [item for item in self._ring if item[1] != node]
+
+    def node_for(self, key):
+        if not self._ring:
+            raise LookupError("hash ring is empty")
+        i = bisect.bisect(self._ring, (self._hash(key),))
+        return self._ring[i % len(self._ring)][1]
+
+
+def _worker_main(control, root_dir, username, debug, idle_timeout,
+                 history_policy=None):
+    # acceptor handles SIGINT of terminal, worker waits for SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    registry = SessionRegistry(
+        root_dir, username, debug=debug, idle_timeout=idle_timeout,
+        history_policy=history_policy)
+    asyncio.run(registry.serve_handoffs(control, (signal.SIGTERM,)))
+
+
+class WorkerPool:
+    # acceptor reads -C message of every connection and passes socket
+    # to worker process, that owns the document, every document lives
+    # in exactly one worker, so workers share nothing
+
+    def __init__(
+        self,
+        root_dir,
+        username,
+        workers=None,
+        debug=False,
+        idle_timeout=300,
+        history_policy=None,
+    ):
+        self._root_dir = root_dir
+        self._username = username
+        self._worker_count = workers or os.cpu_count() or 1
+        self._debug = debug
+        self._idle_timeout = idle_timeout
+        self._history_policy = history_policy
+        self._workers = []
+        self._ring = HashRing(range(self._worker_count))
+        self._stopped = asyncio.Event()
+
+    def worker_for(self, document):
+        return self._ring.node_for(document or "")
+
+    def start(self):
+        for _ in range(self._worker_count):
+            control, worker_control = socket.socketpair(
+                socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            process = multiprocessing.Process(
+                target=_worker_main,
+                args=(worker_control, self._root_dir, self._username,
+                      self._debug, self._idle_timeout,
+                      self._history_policy),
+            )
+            process.start()
+            worker_control.close()
+            self._workers.append((process, control))
+
+    # closed control stops worker, it saves its documents and exits,
+    # only workers that don't finish in time are terminated
+    def stop(self, timeout=30):
+        for _, control in self._workers:
+            control.close()
+        for process, _ in self._workers:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._workers = []
+
+    # handshake data ends after -C message, it stays with connection
+    async def _read_handshake(self, conn):
+        loop = asyncio.get_running_loop()
+        data = b""
+        while TEXT_DELIMITER not in data:
+            if len(data) >= SessionRegistry.MAX_HANDOFF_SIZE:
+                return None
+            chunk = await loop.sock_recv(
+                conn, SessionRegistry.MAX_HANDOFF_SIZE - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    async def _handle_connection(self, conn):
+        try:
+            data = await self._read_handshake(conn)
+            if data is None:
+                return
+            args = data[: data.index(TEXT_DELIMITER)].decode().split(" ")
+            document = document_from_args(args)
+            while True:
+                worker = self.worker_for(document)
+                process, control = self._workers[worker]
+                if process.is_alive():
+                    break
+                # documents of dead worker move to the others
+                self._ring.remove(worker)
+            socket.send_fds(control, [data], [conn.fileno()])
+        except (OSError, UnicodeDecodeError, LookupError):
+            pass
+        finally:
+            # worker has its own copy of the socket
+            conn.close()
+
+    async def serve(
+        self,
+        address=MtTextEditApp._HOST_ADDRESS,
+        port=MtTextEditApp._PORT,
+    ):
+        loop = asyncio.get_running_loop()
+        listener = socket.create_server((address, port))
+        listener.setblocking(False)
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self._stopped.set)
+        print(f"hosting {self._root_dir} on {address}:{port} "
+              f"with {self._worker_count} workers", flush=True)
+        accept_task = asyncio.create_task(self._accept_loop(listener))
+        await self._stopped.wait()
+        accept_task.cancel()
+        listener.close()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+
+    async def _accept_loop(self, listener):
+        loop = asyncio.get_running_loop()
+        tasks = set()
+        while True:
+            conn, _ = await loop.sock_accept(listener)
+            task = asyncio.create_task(self._handle_connection(conn))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    def run(self):
+        self.start()
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.stop()